@@ -0,0 +1,426 @@
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import logging
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import awkward as ak
+import numpy as np
+import uproot
+
+import postproc
+from postproc.misc import format_size, load_inst
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+TREE = "g4sntuple"
+BRANCHES = ["Edep", "volID", "x", "y", "z", "t"]
+
+# Runs a command and writes the peak resident memory of the largest process of its tree
+# (ru_maxrss of the waited for descendants, in kilobytes on Linux) to the file given first
+RUSAGE_WRAPPER = """
+import resource, subprocess, sys
+code = subprocess.run(sys.argv[2:], check=False).returncode
+with open(sys.argv[1], "w") as f:
+    f.write(str(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+sys.exit(code)
+"""
+
+
+def generate_inputs(folder, n_files, n_entries, seed=1):
+    """
+    Write synthetic Geant4-like ROOT files (steps with Edep, volID, x, y, z and t per event).
+    Existing files with the same name are kept, so the inputs of previous sweeps are reused.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    files = []
+    for i in range(n_files):
+        path = folder.joinpath(f"sim_{i:04d}.root")
+        files.append(path)
+        if path.exists():
+            continue
+        counts = rng.integers(0, 20, n_entries)
+        n_steps = int(counts.sum())
+        steps = {
+            "Edep": rng.exponential(0.2, n_steps),
+            "volID": rng.integers(1, 3, n_steps).astype(np.int32),
+            "x": rng.normal(0, 20, n_steps),
+            "y": rng.normal(0, 20, n_steps),
+            "z": rng.normal(0, 30, n_steps),
+            "t": rng.exponential(1e3, n_steps),
+        }
+        with uproot.recreate(path) as f:
+            f[TREE] = {key: ak.unflatten(value, counts) for key, value in steps.items()}
+    return files
+
+
+def default_inst():
+    """
+    Instructions of the synthetic benchmark: group the steps of the sensitive volumes, sum the
+    energy and keep the events above threshold.
+    """
+    return {
+        "para": {
+            "sensitive_volumes": {
+                "names": ["Det1", "Det2"],
+                "sensVolID": [1, 2],
+                "group": ["HPGe", "HPGe"],
+            },
+        },
+        "input": {
+            "tree": TREE,
+            "var": {"edep": "Edep", "vol": "volID", "t": "t"},
+        },
+        "instr": [
+            {
+                "name": "Group HPGe steps",
+                "module": "group_sensitive_volume",
+                "para": {"group": "HPGe"},
+                "input": {"vol": "vol", "edep": "edep", "t": "t"},
+                "output": {"vol": "ged_vol", "edep": "ged_edep", "t": "ged_t"},
+            },
+            {
+                "name": "HPGe energy",
+                "module": "sum",
+                "input": {"val": "ged_edep"},
+                "output": {"val": "ged_etot"},
+            },
+            {
+                "name": "HPGe last hit",
+                "module": "max",
+                "input": {"val": "ged_t"},
+                "output": {"val": "ged_tmax"},
+            },
+            {
+                "name": "threshold",
+                "module": "acceptance_range",
+                "para": {"thr": [0.25, 10]},
+                "input": {"val": "ged_etot"},
+                "output": {"val": "mask_w_edep"},
+            },
+            {
+                "name": "only keep events with edep",
+                "module": "mask",
+                "input": {"mask": "mask_w_edep", "edep": "ged_etot", "t": "ged_tmax"},
+                "output": {"edep": "ged_etot_w_edep", "t": "ged_tmax_w_edep"},
+            },
+        ],
+        "output": ["ged_etot_w_edep", "ged_tmax_w_edep"],
+    }
+
+
+def check_inputs(inst):
+    """
+    The benchmark only generates the synthetic inputs, so a config must read their tree and
+    branches.
+    """
+    branches = [value.rsplit("/")[-1] for value in inst["input"]["var"].values()]
+    unknown = [branch for branch in branches if branch not in BRANCHES]
+    if inst["input"].get("tree") != TREE or unknown:
+        text = (
+            f"The config reads tree {inst['input'].get('tree')} and branches {branches}, but the "
+            f"synthetic inputs only have the tree {TREE} with the branches {BRANCHES}."
+        )
+        raise ValueError(text)
+
+
+def _children(pids):
+    """
+    Returns the pids of the direct children of the given processes (Linux).
+    """
+    children = set()
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The parent pid is the second field after the command name in parentheses
+            ppid = int(stat.read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid in pids:
+            children.add(int(stat.parent.name))
+    return children
+
+
+def tree_memory(pid):
+    """
+    Returns the summed resident memory in bytes of a process and all its descendants (Linux).
+    """
+    pids = {pid}
+    new = {pid}
+    while new:
+        new = _children(new) - pids
+        pids |= new
+    total = 0
+    for p in pids:
+        try:
+            with Path.open(Path(f"/proc/{p}/status")) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+class memory_sampler:
+    """
+    Samples the summed resident memory of a process tree in a thread and keeps the largest
+    value. Only available on Linux (peak is None elsewhere). As a sample, it can miss short
+    peaks between two samples.
+    """
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        if Path(f"/proc/{self.pid}/status").exists():
+            self.peak = 0
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_memory(self.pid))
+            self._stop.wait(self.interval)
+
+
+def run_setting(inst, in_folder, work_dir, threads, step_size, mode):
+    """
+    Run postproc on the input folder in a fresh process, so every setting starts without
+    imported modules or compiled kernels.
+
+    Returns:
+    dict: Wall time, entries, bytes and the measured peak memory: of the largest process
+        (from its resource usage) and of all processes together (sampled, Linux only).
+    """
+    work_dir = Path(work_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+    out = work_dir.joinpath("out.hdf5" if mode == "summarize" else "out")
+    if mode != "summarize":
+        out.mkdir()
+    timings = work_dir.joinpath("timings.json")
+    config = {
+        **inst,
+        "io": {
+            "input": {"folder": str(in_folder), "format": "root"},
+            "output": str(out),
+        },
+        "para": {
+            **inst["para"],
+            "threads": threads,
+            "step_size": step_size,
+            "mode": mode,
+            "timings": str(timings),
+            "schedule": "glob",
+        },
+    }
+    config_file = work_dir.joinpath("config.json")
+    with Path.open(config_file, "w") as f:
+        json.dump(config, f, indent=1)
+
+    rusage_file = work_dir.joinpath("rusage.txt")
+    script = Path(postproc.__file__).parent.joinpath("postproc.py")
+    start = time.time()
+    with subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            RUSAGE_WRAPPER,
+            str(rusage_file),
+            sys.executable,
+            str(script),
+            str(config_file),
+            "--overwrite",
+        ],
+        cwd=script.parent,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    ) as process, memory_sampler(process.pid) as sampler:
+        _, stderr = process.communicate()
+    wall_time = time.time() - start
+    if process.returncode != 0:
+        text = f"postproc failed for threads={threads}, step_size={step_size}, mode={mode}:\n{stderr}"
+        raise RuntimeError(text)
+
+    with Path.open(timings) as f:
+        tasks = list(json.load(f).values())
+    maxrss = int(rusage_file.read_text())
+    return {
+        "wall_time": wall_time,
+        "entries": sum(t["entries"] for t in tasks),
+        "bytes": sum(t["bytes"] for t in tasks),
+        # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+        "peak_process_memory": maxrss if sys.platform == "darwin" else maxrss * 1024,
+        "peak_memory": sampler.peak,
+    }
+
+
+def sweep(inst, work_dir, scaling, files, entries, threads, step_sizes, modes):
+    """
+    Run every combination of threads, step size and mode.
+
+    In strong scaling the number of input files is fixed, in weak scaling it grows with the
+    number of threads (files per thread). The parallel efficiency is relative to the smallest
+    number of threads of the same step size and mode: T_1 * p_1 / (T_p * p) for strong and
+    T_1 / T_p for weak scaling.
+
+    Returns:
+    list of dict: One result per setting.
+    """
+    work_dir = Path(work_dir)
+    n_inputs = files * max(threads) if scaling == "weak" else files
+    inputs = generate_inputs(work_dir.joinpath("inputs"), n_inputs, entries)
+
+    results = []
+    for mode, step_size, n_threads in itertools.product(modes, step_sizes, threads):
+        n_files = files * n_threads if scaling == "weak" else files
+        # Each setting reads its inputs from a folder with links to the generated files
+        in_folder = work_dir.joinpath(f"inputs_{n_files}")
+        if not in_folder.exists():
+            in_folder.mkdir()
+            for path in inputs[:n_files]:
+                in_folder.joinpath(path.name).symlink_to(path.resolve())
+
+        logging.info(
+            "Running %s scaling: threads=%d, step_size=%s, mode=%s, files=%d",
+            scaling,
+            n_threads,
+            step_size,
+            mode,
+            n_files,
+        )
+        result = run_setting(
+            inst, in_folder, work_dir.joinpath("run"), n_threads, step_size, mode
+        )
+        result.update(
+            {
+                "scaling": scaling,
+                "threads": n_threads,
+                "step_size": step_size,
+                "mode": mode,
+                "files": n_files,
+                "entries_per_second": result["entries"] / result["wall_time"],
+                "bytes_per_second": result["bytes"] / result["wall_time"],
+            }
+        )
+        results.append(result)
+
+    for result in results:
+        base = min(
+            (
+                r
+                for r in results
+                if r["step_size"] == result["step_size"] and r["mode"] == result["mode"]
+            ),
+            key=lambda r: r["threads"],
+        )
+        if scaling == "weak":
+            result["efficiency"] = base["wall_time"] / result["wall_time"]
+        else:
+            result["efficiency"] = (base["wall_time"] * base["threads"]) / (
+                result["wall_time"] * result["threads"]
+            )
+    return results
+
+
+def report(results):
+    """
+    Returns the results as a table. "proc mem" is the peak of the largest process, "total mem"
+    the sampled peak of all processes of the run.
+    """
+    header = f"{'scaling':>7} {'mode':>10} {'step_size':>10} {'threads':>7} {'files':>5} {'wall [s]':>9} {'evt/s':>10} {'MB/s':>7} {'eff.':>5} {'proc mem':>10} {'total mem':>10}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['scaling']:>7} {r['mode']:>10} {r['step_size']!s:>10} {r['threads']:>7} "
+            f"{r['files']:>5} {r['wall_time']:>9.1f} {r['entries_per_second']:>10.0f} "
+            f"{r['bytes_per_second'] / 1e6:>7.2f} {r['efficiency']:>5.2f} "
+            f"{format_size(r['peak_process_memory']) if r['peak_process_memory'] else '-':>10} "
+            f"{format_size(r['peak_memory']) if r['peak_memory'] else '-':>10}"
+        )
+    return "\n".join(lines)
+
+
+def step_size_arg(value):
+    return int(value) if value.isdigit() else value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="postproc_benchmark",
+        description="Strong and weak scaling benchmark of postproc on synthetic input files",
+    )
+    parser.add_argument("work_dir", help="Folder for the generated inputs and outputs")
+    parser.add_argument(
+        "--scaling", choices=["strong", "weak", "both"], default="strong"
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        default=8,
+        help="Number of input files (strong) or input files per thread (weak)",
+    )
+    parser.add_argument(
+        "--entries", type=int, default=20000, help="Entries per input file"
+    )
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--step-size", type=step_size_arg, nargs="+", default=["50 MB"])
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=["individual", "summarize"],
+        default=["individual"],
+    )
+    parser.add_argument(
+        "--config",
+        help="Instruction file whose input, para and instr are used instead of the synthetic "
+        "pipeline. It must read the synthetic inputs: tree g4sntuple with the branches Edep, "
+        "volID, x, y, z and t",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    inst = default_inst()
+    if args.config is not None:
+        inst = {
+            key: value for key, value in load_inst(args.config).items() if key != "io"
+        }
+        check_inputs(inst)
+
+    results = []
+    for scaling in ["strong", "weak"] if args.scaling == "both" else [args.scaling]:
+        results += sweep(
+            inst,
+            Path(args.work_dir).joinpath(scaling),
+            scaling,
+            args.files,
+            args.entries,
+            args.threads,
+            args.step_size,
+            args.modes,
+        )
+    print(report(results))  # noqa: T201
+    if args.output is not None:
+        with Path.open(Path(args.output), "w") as f:
+            json.dump(results, f, indent=1)
@@ -1,82 +1,507 @@
 from __future__ import annotations
 
 import gc
+import hashlib
+import json
+import logging
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import awkward as ak
 import h5py
 import numpy as np
+import transfer
 import uproot
+from misc import config_hash, format_size, pipelines
+from module_manager import run_pipelines
+from modules.compact import ENTRY_KEY, FILE_KEY, VARIABLES_KEY, variable_entries
+from modules.histogram import histogram
+from modules.misc import compact_layout, narrow_variables, share_offsets
+from telemetry import progress_reporter
 from tqdm import tqdm
+from writer import output_writer
+
+
+def write_hdf5(path, array, histograms, narrow_offsets=False):
+    """
+    Write an output array (group "awkward") and histograms (group "histograms") to an HDF5 file.
+    With narrow_offsets, offsets and indices are stored as int32 if they fit.
+    """
+    with h5py.File(path, "w") as f:
+        if array is not None:
+            group = f.create_group("awkward")
+            form, length, container = ak.to_buffers(
+                compact_layout(array, narrow=narrow_offsets), container=group
+            )
+            group.attrs["form"] = form.to_json()
+            group.attrs["length"] = length
+        for key, hist in histograms.items():
+            hist.write(f.create_group(f"histograms/{key}"))
+
+
+def read_awkward(group):
+    """
+    Read an array from an HDF5 group written by write_hdf5, or the parts of an output_writer
+    (subgroups "0", "1", ...), which are concatenated.
+    """
+    if "parts" in group.attrs:
+        return ak.concatenate(
+            [read_awkward(group[str(i)]) for i in range(group.attrs["parts"])]
+        )
+    return ak.from_buffers(
+        ak.forms.from_json(group.attrs["form"]),
+        group.attrs["length"],
+        {k: np.asarray(v) for k, v in group.items()},
+    )
+
+
+def read_hdf5(path):
+    """
+    Read an output file written by write_hdf5 or an output_writer.
+
+    Returns:
+    tuple: The output array (None if the file has no event level output) and the histograms.
+    """
+    with h5py.File(path, "r") as f:
+        array = None
+        if "awkward" in f:
+            array = read_awkward(f["awkward"])
+        histograms = {
+            key: histogram.read(group) for key, group in f.get("histograms", {}).items()
+        }
+    return array, histograms
+
+
+class pipeline_output:
+    """
+    Output of one pipeline of a data_manager: the output file (None if the output is handed to the
+    parent in shared memory), the per event outputs of the batches and the summed histograms.
+    """
+
+    def __init__(self, pipeline, outfile):
+        self.name = pipeline["name"]
+        self.keys = pipeline["output"]
+        self.dtypes = pipeline["dtype"]
+        self.outfile = outfile
+        self.batches = []
+        self.n_batches = 0
+        self.histograms = {}
+        self.array = None
+        self.writer = None
 
 
 class data_manager:
-    def __init__(self, inst, infile, outfile, pm, task_id):
+    def __init__(self, inst, infile, outfiles, pms, task_id, progress_queue=None):
         self.inst = inst
         self.infile = infile
         self.infile_format = inst["io"]["input"]["format"]
-        self.outfile = outfile
-        self.module_manager = pm
-        self.output_dict = {}
+        # One module manager and one output per pipeline, all fed by the same read loop
+        self.module_managers = pms
+        self.outputs = [
+            pipeline_output(pipeline, outfile)
+            for pipeline, outfile in zip(pipelines(inst), outfiles)
+        ]
         self.task_id = task_id
-        for key in self.inst["output"]:
-            self.output_dict[key] = []
+        self.progress_queue = progress_queue
+        self.batch_threads = inst["para"].get("batch_threads", 1)
+        self.dtypes = inst.get("dtype", {})
+        # Batches are committed next to the (first) output file, so an interrupted run can be resumed
+        self.checkpoint_dir = None
+        if inst["para"].get("checkpoint", False) and outfiles[0] is not None:
+            self.checkpoint_dir = Path(outfiles[0]).with_name(
+                Path(outfiles[0]).name + ".partial"
+            )
+        # Entry ranges of the batches committed by a previous run
+        self.committed = set()
+        self._local = threading.local()
         if self.infile_format == "root":
             self.ttree = uproot.open(self.infile)[self.inst["input"]["tree"]]
         elif self.infile_format == "hdf5":
             with h5py.File(self.infile, "r") as f:
-                group = f[self.inst["input"]["base_name"]]
-                reconstituted = ak.from_buffers(
-                    ak.forms.from_json(group.attrs["form"]),
-                    group.attrs["length"],
-                    {k: np.asarray(v) for k, v in group.items()},
+                self.ttree = read_awkward(f[self.inst["input"]["base_name"]])
+        # Batches are written by a background thread while the next ones are processed. The
+        # writers are started once the input is open, see abort for failures after that.
+        if inst["para"].get("async_write", False):
+            try:
+                for output in self.outputs:
+                    if output.outfile is not None:
+                        output.writer = output_writer(
+                            output.outfile, inst["para"].get("compact_layouts", False)
+                        )
+            except BaseException:
+                self.abort()
+                raise
+
+    def num_entries(self):
+        if self.infile_format == "root":
+            return self.ttree.num_entries
+        return len(self.ttree)
+
+    def progress_bar(self, n_entries):
+        """
+        Returns a per task tqdm bar, or a reporter forwarding the progress to the
+        parent process if a progress queue was given.
+        """
+        if self.progress_queue is None:
+            return tqdm(total=n_entries, position=self.task_id)
+        n_bytes = Path(self.infile).stat().st_size
+        return progress_reporter(
+            self.progress_queue,
+            self.task_id,
+            n_entries,
+            n_bytes / max(n_entries, 1),
+            str(self.infile),
+        )
+
+    def _thread_ttree(self):
+        """
+        Each worker thread reads through its own file handle, so concurrent
+        batches never share uproot's source and cache objects.
+        """
+        if not hasattr(self._local, "ttree"):
+            self._local.ttree = uproot.open(self.infile)[self.inst["input"]["tree"]]
+        return self._local.ttree
+
+    def entry_ranges(self):
+        """
+        Split the tree into (start, stop) entry ranges of the configured step_size,
+        matching the batches produced by ttree.iterate.
+        """
+        step_size = self.inst["para"]["step_size"]
+        if isinstance(step_size, str):
+            step_size = self.ttree.num_entries_for(step_size)
+        step_size = max(1, int(step_size))
+        n_entries = self.ttree.num_entries
+        return [
+            (start, min(start + step_size, n_entries))
+            for start in range(0, n_entries, step_size)
+        ]
+
+    def narrow(self, variables, keys, dtypes=None):
+        """
+        Cast the given processing variables to the dtypes of the "dtype" policy of the config
+        (e.g. {"vol": "int32", "edep": "float32"}). Variables without a policy are left as they are.
+        """
+        return narrow_variables(
+            variables, keys, self.dtypes if dtypes is None else dtypes
+        )
+
+    def run_modules(self, processing_variables, pbar, entry_start=0):
+        """
+        Run the pipelines on the variables read from the input.
+
+        Returns:
+        list of tuple: The output of each pipeline (see collect_output).
+        """
+        self.narrow(processing_variables, self.inst["input"]["var"])
+        # Variables with the same jagged structure share one set of offsets. Comparing the
+        # structures costs a pass over the offsets of every batch, so it is only done on request.
+        if self.inst["para"].get("share_offsets", False):
+            processing_variables = share_offsets(processing_variables)
+        # Original entry numbers, kept aligned with the events by modules dropping events
+        n_entries = len(next(iter(processing_variables.values())))
+        processing_variables[ENTRY_KEY] = np.arange(
+            entry_start, entry_start + n_entries
+        )
+        processing_variables[FILE_KEY] = Path(self.infile).name
+        processing_variables[VARIABLES_KEY] = tuple(self.inst["input"]["var"])
+        results = run_pipelines(
+            self.module_managers, processing_variables, pbar, self.task_id
+        )
+        return [
+            self.collect_output(variables, output)
+            for variables, output in zip(results, self.outputs)
+        ]
+
+    def process_batch(self, batch, pbar, entry_start=0):
+        processing_variables = {
+            key: batch[value.rsplit("/")[-1]]
+            for key, value in self.inst["input"]["var"].items()
+        }
+        return self.run_modules(processing_variables, pbar, entry_start)
+
+    def collect_output(self, processing_variables, output):
+        """
+        Returns the record of the per event outputs of a pipeline (None if there are only
+        histogram outputs) and its histogram outputs of the batch.
+        """
+        fields = {}
+        histograms = {}
+        for key in output.keys:
+            value = processing_variables[key]
+            if isinstance(value, histogram):
+                histograms[key] = value
+            else:
+                fields[key] = value
+        self.narrow(fields, list(fields), output.dtypes)
+        # Sharded outputs record the entry ranges of each shard in their index
+        entry = (
+            variable_entries(processing_variables, next(iter(fields)))
+            if fields
+            else None
+        )
+        if (
+            fields
+            and "shards" in self.inst["para"]
+            and self.inst["para"].get("mode") == "summarize"
+            and entry is not None
+            and len(entry) == len(next(iter(fields.values())))
+        ):
+            fields[ENTRY_KEY] = entry
+        return (ak.Array(fields) if fields else None), histograms
+
+    def checkpoint_paths(self, entry_range):
+        """
+        Returns the files of a committed batch, one per pipeline.
+        """
+        return [
+            self.checkpoint_dir.joinpath(f"{entry_range[0]}_{entry_range[1]}.{i}.hdf5")
+            for i in range(len(self.outputs))
+        ]
+
+    def add_batch(self, batch_outputs, entry_range=None):
+        """
+        Add the outputs of a batch, one per pipeline. Histograms are added to those of the previous
+        batches. If checkpointing is enabled, the batch is also committed to the checkpoint directory.
+        """
+        for (array, histograms), output in zip(batch_outputs, self.outputs):
+            output.n_batches += 1
+            if output.writer is None:
+                output.batches.append(array)
+            elif array is not None:
+                output.writer.put(array)
+            for key, hist in histograms.items():
+                output.histograms[key] = (
+                    output.histograms[key] + hist if key in output.histograms else hist
                 )
-            self.ttree = ak.Array(reconstituted)
+        if (
+            self.checkpoint_dir is not None
+            and entry_range is not None
+            and entry_range not in self.committed
+        ):
+            for path, batch_output in zip(
+                self.checkpoint_paths(entry_range), batch_outputs
+            ):
+                tmp_path = path.with_name(path.name + ".tmp")
+                write_hdf5(tmp_path, *batch_output)
+                tmp_path.replace(path)
+
+    def checkpoint_key(self):
+        """
+        Identifies the input file and the parts of the config that change the output (see
+        misc.config_hash, also used by the run manifest), so a checkpoint is only resumed by a run
+        producing the same output. The step size only changes the batches, so a task retried with
+        a smaller step size resumes the committed batches.
+        """
+        stat = Path(self.infile).stat()
+        text = json.dumps(
+            [str(self.infile), stat.st_size, stat.st_mtime_ns, config_hash(self.inst)]
+        )
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def committed_ranges(self):
+        """
+        Returns the sorted entry ranges committed for all pipelines in the checkpoint directory.
+        """
+        ranges = set()
+        for path in self.checkpoint_dir.glob("*_*.0.hdf5"):
+            start, stop = path.name.split(".")[0].split("_")
+            entry_range = (int(start), int(stop))
+            if all(path.exists() for path in self.checkpoint_paths(entry_range)):
+                ranges.add(entry_range)
+        return sorted(ranges)
+
+    def resume(self):
+        """
+        Prepare the checkpoint directory and plan the batches of the file around the batches
+        committed by a previous run of the same file and config.
+
+        Committed batches are reused even if they were made with another step size (e.g. by a
+        task retried with a smaller step size): the entries between them are split into new
+        batches of the current step size. Committed batches overlapping an earlier one are
+        ignored.
+
+        Returns:
+        list of tuple: The entry ranges of the batches in entry order. The committed ones are in
+            self.committed and read back instead of processed.
+        """
+        entry_ranges = self.entry_ranges()
+        if self.checkpoint_dir is None:
+            return entry_ranges
+
+        key = self.checkpoint_key()
+        key_file = self.checkpoint_dir.joinpath("checkpoint.json")
+        if key_file.exists():
+            with Path.open(key_file) as f:
+                if json.load(f).get("key") != key:
+                    shutil.rmtree(self.checkpoint_dir)
+        if not key_file.exists():
+            self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+            with Path.open(key_file, "w") as f:
+                json.dump({"key": key, "infile": str(self.infile)}, f)
+
+        step_size = max((stop - start for start, stop in entry_ranges), default=1)
+        n_entries = self.num_entries()
+        plan = []
+        position = 0
+        for start, stop in self.committed_ranges():
+            if start < position or stop > n_entries:
+                continue
+            plan += [
+                (s, min(s + step_size, start))
+                for s in range(position, start, step_size)
+            ]
+            plan.append((start, stop))
+            self.committed.add((start, stop))
+            position = stop
+        plan += [
+            (s, min(s + step_size, n_entries))
+            for s in range(position, n_entries, step_size)
+        ]
+        if self.committed:
+            logging.info(
+                "Resuming %s: %d of %d batches already processed",
+                self.infile,
+                len(self.committed),
+                len(plan),
+            )
+        return plan
+
+    def _process_range(self, entry_range, pbar):
+        if entry_range in self.committed:
+            return [read_hdf5(path) for path in self.checkpoint_paths(entry_range)]
+        batch = self._thread_ttree().arrays(
+            entry_start=entry_range[0], entry_stop=entry_range[1]
+        )
+        return self.process_batch(batch, pbar, entry_range[0])
+
+    def _process_data_threaded(self, pbar, entry_ranges):
+        """
+        Process independent batches of the file concurrently. At most two batches
+        per thread are in flight, and results are collected in entry order.
+        """
+        entry_ranges = deque(entry_ranges)
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.batch_threads) as executor:
+            while entry_ranges or in_flight:
+                while entry_ranges and len(in_flight) < 2 * self.batch_threads:
+                    entry_range = entry_ranges.popleft()
+                    in_flight.append(
+                        (
+                            entry_range,
+                            executor.submit(self._process_range, entry_range, pbar),
+                        )
+                    )
+                entry_range, future = in_flight.popleft()
+                self.add_batch(future.result(), entry_range)
+                pbar.update(entry_range[1] - entry_range[0])
+
+    def _concatenate_batches(self):
+        for output in self.outputs:
+            if output.writer is not None:
+                if output.n_batches == 0:
+                    output.writer.put(ak.Array({key: [] for key in output.keys}))
+                continue
+            batches = [batch for batch in output.batches if batch is not None]
+            if batches:
+                output.array = ak.concatenate(batches)
+            elif output.batches:
+                # Only histograms were produced
+                output.array = None
+            else:
+                output.array = ak.Array({key: [] for key in output.keys})
+            output.batches = []
 
     def process_data(self):
         if self.infile_format == "root":
             n_entries = self.ttree.num_entries
-            pbar = tqdm(total=n_entries, position=self.task_id)
-            for batch, report in self.ttree.iterate(
-                step_size=self.inst["para"]["step_size"], report=True
-            ):
-                processing_variables = {
-                    key: batch[value.rsplit("/")[-1]]
-                    for key, value in self.inst["input"]["var"].items()
-                }
-                self.module_manager.run(processing_variables, pbar, self.task_id)
-                for key in self.output_dict:
-                    self.output_dict[key].extend(processing_variables[key])
-                del processing_variables
-                gc.collect()
-                pbar.update(report.stop - report.start)
-            self.output_dict = ak.Array(self.output_dict)
+            pbar = self.progress_bar(n_entries)
+            if self.batch_threads > 1 or self.checkpoint_dir is not None:
+                self._process_data_threaded(pbar, self.resume())
+            else:
+                for batch, report in self.ttree.iterate(
+                    step_size=self.inst["para"]["step_size"], report=True
+                ):
+                    self.add_batch(self.process_batch(batch, pbar, report.start))
+                    gc.collect()
+                    pbar.update(report.stop - report.start)
+            self._concatenate_batches()
             pbar.close()
+            self.log_layout_report()
 
         elif self.infile_format == "hdf5":
             n_entries = len(self.ttree)
-            pbar = tqdm(total=n_entries, position=self.task_id)
+            pbar = self.progress_bar(n_entries)
             # for entry in self.ttree:
             #    pbar.update(1)
             processing_variables = {
                 key: self.ttree[value]
                 for key, value in self.inst["input"]["var"].items()
             }
-            self.module_manager.run(processing_variables, pbar, self.task_id)
-            for key in self.output_dict:
-                self.output_dict[key].extend(processing_variables[key])
+            self.add_batch(self.run_modules(processing_variables, pbar))
             del processing_variables
+            self._concatenate_batches()
             gc.collect()
-            self.output_dict = ak.Array(self.output_dict)
             pbar.close()
+            self.log_layout_report()
+
+    def log_layout_report(self):
+        total = [0, 0]
+        for pm, output in zip(self.module_managers, self.outputs):
+            for name, before, after in pm.layout_report():
+                logging.debug(
+                    "%s - %s: outputs compacted from %s to %s",
+                    Path(self.infile).name,
+                    name if output.name is None else f"{output.name}/{name}",
+                    format_size(before),
+                    format_size(after),
+                )
+                total[0] += before
+                total[1] += after
+        if total[0] > total[1]:
+            logging.info(
+                "%s: module outputs compacted from %s to %s",
+                Path(self.infile).name,
+                format_size(total[0]),
+                format_size(total[1]),
+            )
 
     def write_output(self):
-        with h5py.File(self.outfile, "w") as f:
-            group = f.create_group("awkward")
-            form, length, container = ak.to_buffers(
-                ak.to_packed(self.output_dict), container=group
+        for output in self.outputs:
+            if output.writer is not None:
+                output.writer.close(output.histograms)
+                continue
+            write_hdf5(
+                output.outfile,
+                output.array,
+                output.histograms,
+                self.inst["para"].get("compact_layouts", False),
             )
-            group.attrs["form"] = form.to_json()
-            group.attrs["length"] = length
+            output.array = None
+            gc.collect()
+        # The output is complete, the committed batches are not needed anymore
+        if self.checkpoint_dir is not None:
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+    def abort(self):
+        """
+        Stop the background writers after a failure, removing their temporary files.
+        """
+        for output in self.outputs:
+            if output.writer is not None:
+                output.writer.abort()
 
-        del self.output_dict
-        gc.collect()
+    def share_output(self):
+        """
+        Copy the outputs into shared memory blocks instead of writing them to files.
+        Returns the descriptors of the blocks for the parent process, one per pipeline.
+        """
+        descriptors = []
+        for output in self.outputs:
+            descriptors.append(transfer.share_output(output.array, output.histograms))
+            output.array = None
+            gc.collect()
+        return descriptors
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import sqlite3
+import time
+from pathlib import Path
+
+# Status of an input file in the manifest
+RUNNING = "running"
+DONE = "done"
+# The tree was not found in the file
+EMPTY = "empty"
+FAILED = "failed"
+
+
+class run_manifest:
+    """
+    SQLite database in the output directory recording the state of every input file of a
+    campaign across runs: status, config hash, entries, bytes, duration, peak memory, attempts
+    and the last error.
+
+    Restarts skip the files completed with the same config and input file (size and
+    modification time), and retry the others, or only the failed ones. The recorded durations
+    and peak memory are the history of the scheduler.
+
+    The manifest is only accessed by the parent process.
+
+    Parameters:
+    path (str or Path): The database file. Created if it does not exist.
+    config (str): Config hash of the run (see misc.config_hash), so work recorded by a run with
+        a different config is not treated as completed.
+    """
+
+    def __init__(self, path, config):
+        self.path = Path(path)
+        self.config = config
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    infile TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    config_hash TEXT,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    entries INTEGER,
+                    bytes INTEGER,
+                    duration REAL,
+                    peak_memory INTEGER,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated REAL
+                )
+                """
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def records(self):
+        """
+        Returns the rows of all files as dicts by input file.
+        """
+        cursor = self.connection.execute("SELECT * FROM files")
+        names = [column[0] for column in cursor.description]
+        return {row[0]: dict(zip(names, row)) for row in cursor}
+
+    def _record(self, infile):
+        cursor = self.connection.execute(
+            "SELECT * FROM files WHERE infile = ?", (str(infile),)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def completed(self, infile):
+        """
+        True if the file was processed (or found without tree) with the config of this run and
+        has not changed since.
+        """
+        record = self._record(infile)
+        if record is None or record["status"] not in [DONE, EMPTY]:
+            return False
+        stat = Path(infile).stat()
+        return (
+            record["config_hash"] == self.config
+            and record["size"] == stat.st_size
+            and record["mtime_ns"] == stat.st_mtime_ns
+        )
+
+    def failed(self, infile):
+        record = self._record(infile)
+        return record is not None and record["status"] == FAILED
+
+    def start(self, infiles):
+        """
+        Mark files as running. Files still running at the start of a later run were interrupted
+        and are retried.
+        """
+        with self.connection:
+            for infile in infiles:
+                stat = Path(infile).stat()
+                self.connection.execute(
+                    """
+                    INSERT INTO files (infile, status, config_hash, size, mtime_ns, attempts, updated)
+                    VALUES (?, ?, ?, ?, ?, 1, ?)
+                    ON CONFLICT (infile) DO UPDATE SET
+                        status = excluded.status,
+                        config_hash = excluded.config_hash,
+                        size = excluded.size,
+                        mtime_ns = excluded.mtime_ns,
+                        attempts = attempts + 1,
+                        error = NULL,
+                        updated = excluded.updated
+                    """,
+                    (
+                        str(infile),
+                        RUNNING,
+                        self.config,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        time.time(),
+                    ),
+                )
+
+    def finish(self, infile, result):
+        """
+        Record the result of a file (see process.process_file), None if its tree was not found.
+        """
+        result = result or {}
+        with self.connection:
+            self.connection.execute(
+                """
+                UPDATE files SET status = ?, entries = ?, bytes = ?, duration = ?,
+                    peak_memory = ?, error = NULL, updated = ?
+                WHERE infile = ?
+                """,
+                (
+                    DONE if result else EMPTY,
+                    result.get("entries"),
+                    result.get("bytes"),
+                    result.get("duration"),
+                    result.get("peak_memory"),
+                    time.time(),
+                    str(infile),
+                ),
+            )
+
+    def fail(self, infile, error):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE files SET status = ?, error = ?, updated = ? WHERE infile = ?",
+                (FAILED, str(error), time.time(), str(infile)),
+            )
+
+    def history(self):
+        """
+        Returns the entries, bytes, duration and peak memory of the completed files in the
+        format of scheduler.load_timings.
+        """
+        return {
+            infile: {
+                key: record[key]
+                for key in ["entries", "bytes", "duration", "peak_memory"]
+                if record[key] is not None
+            }
+            for infile, record in self.records().items()
+            if record["status"] == DONE
+        }
@@ -1,9 +1,181 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import re
 from pathlib import Path
 
+# Parameters that change how a run is executed, but not its output
+RUNTIME_PARAMETERS = [
+    "threads",
+    "batch_threads",
+    "progress",
+    "telemetry",
+    "schedule",
+    "timings",
+    "cost_model",
+    "checkpoint",
+    "transfer",
+    "watch",
+    "module_threads",
+    "coalesce",
+    "memory_budget",
+    "oom_retries",
+    "async_write",
+    "share_offsets",
+    "pack_outputs",
+    "manifest",
+]
+
+
+def config_hash(inst):
+    """
+    Hash of the parts of a config that change the output. The runtime parameters, the step size
+    (which only changes the batches) and io are left out. The run manifest and the checkpoints
+    both use it, so they treat the same configs as equal.
+    """
+    para = {
+        key: value
+        for key, value in inst["para"].items()
+        if key not in [*RUNTIME_PARAMETERS, "step_size"]
+    }
+    config = {**inst, "para": para, "io": None}
+    text = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
 
 def load_inst(file):
     with Path.open(Path(file), mode="r") as f:
         return json.load(f)
+
+
+def pipelines(inst):
+    """
+    Returns the pipelines of a config, each a dict with the keys name, instr, output, para, dtype
+    and output_path.
+
+    A config either describes one pipeline (instr, output and io.output at the top level) or lists
+    named pipelines under "pipelines", each with its own instr, output and io.output and optionally
+    para and dtype, which are added to those of the top level. All pipelines share the input and
+    the read loop. Their modules run one after the other, module_threads is ignored.
+    """
+    if "pipelines" not in inst:
+        return [
+            {
+                "name": None,
+                "instr": inst["instr"],
+                "output": inst["output"],
+                "para": inst["para"],
+                "dtype": inst.get("dtype", {}),
+                "output_path": inst["io"]["output"],
+            }
+        ]
+    result = []
+    for pipeline in inst["pipelines"]:
+        for key in ["name", "instr", "output", "io"]:
+            if key not in pipeline:
+                text = (
+                    f"Required key {key} not found in pipeline {pipeline.get('name')}."
+                )
+                raise ValueError(text)
+        result.append(
+            {
+                "name": pipeline["name"],
+                "instr": pipeline["instr"],
+                "output": pipeline["output"],
+                "para": {**inst["para"], **pipeline.get("para", {})},
+                "dtype": {**inst.get("dtype", {}), **pipeline.get("dtype", {})},
+                "output_path": pipeline["io"]["output"],
+            }
+        )
+    names = [pipeline["name"] for pipeline in result]
+    if len(set(names)) != len(names):
+        text = f"Pipeline names must be unique, got {names}."
+        raise ValueError(text)
+    return result
+
+
+def merge_insts(insts, names):
+    """
+    Combine the configs of several runs over the same input into one config with a named pipeline
+    per config, so the input is read once for all of them.
+
+    The input (io.input and input) must be the same, except that the variables read are combined.
+    The runtime parameters, the step size and the input dtype policy of the first config are used
+    for the shared read loop.
+    """
+    first = insts[0]
+    variables = {}
+    merged = []
+    for name, inst in zip(names, insts):
+        if inst["io"]["input"] != first["io"]["input"] or {
+            k: v for k, v in inst["input"].items() if k != "var"
+        } != {k: v for k, v in first["input"].items() if k != "var"}:
+            text = f"Config {name} reads a different input than config {names[0]}."
+            raise ValueError(text)
+        for key, value in inst["input"]["var"].items():
+            if variables.setdefault(key, value) != value:
+                text = f"Input variable {key} is read from different branches."
+                raise ValueError(text)
+        for pipeline in pipelines(inst):
+            para = {
+                **pipeline["para"],
+                **{
+                    key: value
+                    for key, value in first["para"].items()
+                    if key in [*RUNTIME_PARAMETERS, "step_size", "mode"]
+                },
+            }
+            merged.append(
+                {
+                    "name": name if pipeline["name"] is None else pipeline["name"],
+                    "instr": pipeline["instr"],
+                    "output": pipeline["output"],
+                    "para": para,
+                    "dtype": pipeline["dtype"],
+                    "io": {"output": pipeline["output_path"]},
+                }
+            )
+    return {
+        "io": {"input": first["io"]["input"]},
+        "input": {**first["input"], "var": variables},
+        "para": first["para"],
+        "dtype": first.get("dtype", {}),
+        "pipelines": merged,
+    }
+
+
+_size_units = {
+    "": 1,
+    "B": 1,
+    "KB": 1000,
+    "MB": 1000**2,
+    "GB": 1000**3,
+    "TB": 1000**4,
+    "KIB": 1024,
+    "MIB": 1024**2,
+    "GIB": 1024**3,
+    "TIB": 1024**4,
+}
+
+
+def parse_size(size):
+    """
+    Convert a memory size like "500 MB" or "2 GiB" to a number of bytes.
+    Integers are returned unchanged. Units follow uproot's step_size convention.
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([a-zA-Z]*)\s*", size)
+    if match is None or match.group(2).upper() not in _size_units:
+        text = f"Cannot interpret {size!r} as a memory size."
+        raise ValueError(text)
+    return int(float(match.group(1)) * _size_units[match.group(2).upper()])
+
+
+def format_size(n_bytes):
+    for unit in ["B", "kB", "MB", "GB"]:
+        if abs(n_bytes) < 1000:
+            return f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1000
+    return f"{n_bytes:.1f} TB"
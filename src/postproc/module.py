@@ -1,40 +1,84 @@
 from __future__ import annotations
 
+import json
+import threading
+
+import awkward as ak
 import modules as mod
+from misc import RUNTIME_PARAMETERS
+from modules.compact import VARIABLES_KEY, propagate_entries
+from modules.misc import compact_layout
+
+# Modules of a batch can run concurrently and all extend the variables of the pipeline
+_variables_lock = threading.Lock()
 
 
 class module:
     def __init__(self, inst):
+        for key in ["name", "module", "input", "output"]:
+            if key not in inst:
+                text = (
+                    f"Required key {key} not found in instruction {inst.get('name')}."
+                )
+                raise ValueError(text)
         self.name = inst["name"]
         self.input = inst["input"]
         self.output = inst["output"]
         self.module_name = inst["module"]
         self.para = inst.get("para", {})
         self.module = self._get_module(self.module_name)
+        # The outputs are packed after the module runs unless para pack_outputs is false. Their
+        # offsets stay int64 in memory, see compact_layout.
+        self.pack_outputs = self.para.get("pack_outputs", True)
+        # Modules like compact rewrite every processing variable, not only their outputs
+        self.modifies_all = getattr(self.module, "modifies_all", False)
+        # Layout bytes of the outputs before and after compaction, summed over all batches
+        self.layout_bytes = [0, 0]
+        self._lock = threading.Lock()
+        # Identifies the computation of the module, so pipelines starting with the same
+        # stages can share them
+        self.key = json.dumps(
+            [
+                self.module_name,
+                self.input,
+                self.output,
+                {k: v for k, v in self.para.items() if k not in RUNTIME_PARAMETERS},
+            ],
+            sort_keys=True,
+            default=str,
+        )
 
     def _get_module(self, module):
-        if module == "group_sensitive_volume":
-            return mod.m_group_sensitive_volume
-        if module == "window":
-            return mod.m_window
-        if module == "active_volume":
-            return mod.m_active_volume
-        if module == "sum":
-            return mod.m_sum
-        if module == "r90_estimator":
-            return mod.m_r90_estimator
-        if module == "coincidence_window":
-            return mod.m_coincidence_window
-        if module == "acceptance_range":
-            return mod.m_acceptance_range
-        if module == "max":
-            return mod.m_max
-        if module == "mask":
-            return mod.m_mask
-        if module == "detector_active_time":
-            return mod.m_detector_active_time
-        error_message = f"{module} not defined."
-        raise NotImplementedError(error_message)
+        return mod.get_module(module)
 
     def run(self, processing_variables):
         self.module(self.para, self.input, self.output, processing_variables)
+        if not self.modifies_all:
+            propagate_entries(self.input, self.output, processing_variables)
+        if VARIABLES_KEY in processing_variables:
+            with _variables_lock:
+                processing_variables[VARIABLES_KEY] = tuple(
+                    dict.fromkeys(
+                        [*processing_variables[VARIABLES_KEY], *self.output.values()]
+                    )
+                )
+        if self.pack_outputs:
+            self.compact_outputs(processing_variables)
+
+    def compact_outputs(self, processing_variables):
+        """
+        Pack the awkward outputs of the module, so nested outputs do not keep unpacked layouts
+        (and the full arrays they index into) alive through the following modules.
+        """
+        before = after = 0
+        for name in self.output.values():
+            value = processing_variables.get(name)
+            if not isinstance(value, ak.Array):
+                continue
+            before += value.layout.nbytes
+            value = compact_layout(value)
+            after += value.layout.nbytes
+            processing_variables[name] = value
+        with self._lock:
+            self.layout_bytes[0] += before
+            self.layout_bytes[1] += after
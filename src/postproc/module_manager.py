@@ -1,23 +1,127 @@
 from __future__ import annotations
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 from module import module
 
 
+def dependencies(modules):
+    """
+    Derive the dependency graph of the modules from their input and output maps.
+
+    A module depends on every earlier module that writes a variable it reads (read after write),
+    reads or writes a variable it writes (write after read or write) or modifies all variables.
+
+    Returns:
+    list of set: For each module, the indices of the earlier modules it has to wait for.
+    """
+    result = []
+    for i, proc in enumerate(modules):
+        reads = set(proc.input.values())
+        writes = set(proc.output.values())
+        result.append(
+            {
+                j
+                for j, other in enumerate(modules[:i])
+                if proc.modifies_all
+                or other.modifies_all
+                or reads & set(other.output.values())
+                or writes & (set(other.input.values()) | set(other.output.values()))
+            }
+        )
+    return result
+
+
 class module_manager:
     def __init__(self, inst):
         self.module_list = []
         for p_inst in inst["instr"]:
             p_inst_local = p_inst.copy()
-            if "para" in p_inst_local:
-                p_inst_local["para"].update(inst["para"])
-            else:
-                p_inst_local["para"] = inst["para"]
+            # The instruction of the config is not modified
+            p_inst_local["para"] = {**p_inst.get("para", {}), **inst["para"]}
             self.module_list.append(module(p_inst_local))
+        # Independent modules of a batch run concurrently if more than one thread is given
+        self.module_threads = inst["para"].get("module_threads", 1)
+        self.dependencies = dependencies(self.module_list)
 
     def run(self, processing_variables, pbar, task_id):
+        if self.module_threads > 1:
+            self._run_concurrent(processing_variables, pbar, task_id)
+            return
         for proc in (
             self.module_list
         ):  # tqdm(self.module_list, desc="Processing", unit="proc"):
             # tqdm.write(f"Running: {proc.name}")  # Display the name of the current process
             pbar.set_description(f"{task_id} - {proc.name}")
             proc.run(processing_variables)
+
+    def _run_concurrent(self, processing_variables, pbar, task_id):
+        """
+        Run each module as soon as the modules it depends on are done. The modules write
+        different variables, so they can share the processing variables.
+        """
+        waiting = {i: set(deps) for i, deps in enumerate(self.dependencies)}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.module_threads) as executor:
+            while waiting or running:
+                for i in [i for i, deps in waiting.items() if not deps]:
+                    del waiting[i]
+                    proc = self.module_list[i]
+                    pbar.set_description(f"{task_id} - {proc.name}")
+                    running[executor.submit(proc.run, processing_variables)] = i
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    future.result()
+                    for deps in waiting.values():
+                        deps.discard(i)
+
+    def layout_report(self):
+        """
+        Returns (name, bytes before, bytes after) of the modules that compact their outputs.
+        """
+        return [
+            (proc.name, *proc.layout_bytes)
+            for proc in self.module_list
+            if proc.pack_outputs
+        ]
+
+
+def run_pipelines(managers, processing_variables, pbar, task_id):
+    """
+    Run the modules of several pipelines on the same processing variables.
+
+    Leading stages that are the same in several pipelines (same module, inputs, outputs and
+    parameters) are run once. The pipelines branch off on a shallow copy of the processing
+    variables, so the arrays computed before the branch are shared, not copied.
+
+    With several pipelines the modules run one after the other, module_threads only applies to
+    a single pipeline.
+
+    Returns:
+    list of dict: The processing variables at the end of each pipeline.
+    """
+    if len(managers) == 1:
+        managers[0].run(processing_variables, pbar, task_id)
+        return [processing_variables]
+    results = [None] * len(managers)
+
+    def run(indices, depth, variables):
+        branches = {}
+        for i in indices:
+            if depth == len(managers[i].module_list):
+                results[i] = variables
+            else:
+                key = managers[i].module_list[depth].key
+                branches.setdefault(key, []).append(i)
+        # A copy is only needed if the variables are used by more than one pipeline
+        shared = len(branches) + (len(indices) - sum(map(len, branches.values()))) > 1
+        for members in branches.values():
+            branch = dict(variables) if shared else variables
+            proc = managers[members[0]].module_list[depth]
+            pbar.set_description(f"{task_id} - {proc.name}")
+            proc.run(branch)
+            run(members, depth + 1, branch)
+
+    run(range(len(managers)), 0, processing_variables)
+    return results
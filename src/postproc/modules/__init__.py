@@ -1,25 +1,18 @@
 from __future__ import annotations
 
-from .acceptance_range import m_acceptance_range
-from .active_volume import m_active_volume
-from .coincidence_window import m_coincidence_window
-from .detector_active_time import m_detector_active_time
-from .group_sensitive_volume import m_group_sensitive_volume
-from .mask import m_mask
-from .max import m_max
-from .r90_estimator import m_r90_estimator
-from .sum import m_sum
-from .window import m_window
+from .registry import available_modules, get_module, register_module
 
 __all__ = [
-    "m_active_volume",
-    "m_group_sensitive_volume",
-    "m_r90_estimator",
-    "m_sum",
-    "m_window",
-    "m_coincidence_window",
-    "m_acceptance_range",
-    "m_max",
-    "m_mask",
-    "m_detector_active_time",
+    "available_modules",
+    "get_module",
+    "register_module",
 ]
+
+
+def __getattr__(name):
+    # Keep the module functions reachable as attributes (e.g. modules.m_sum)
+    # without importing every module up front
+    if name.startswith("m_") and name[2:] in available_modules():
+        return get_module(name[2:])
+    error_message = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(error_message)
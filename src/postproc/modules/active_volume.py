@@ -6,9 +6,9 @@ from pathlib import Path
 import awkward as ak
 import numpy as np
 from numba import njit, types
-from numba.typed import Dict, List
+from numba.typed import Dict
 
-from .misc import python_list_to_numba_list
+from .misc import map_flat, take_together
 
 
 def generate_mask_cylinder(x, y, z, para):
@@ -28,7 +28,7 @@ def generate_mask_cylinder(x, y, z, para):
     return mask > 0
 
 
-@njit
+@njit(nogil=True)
 def is_point_inside_polycone(x, y, z, r_val, z_val):
     r = np.sqrt(x**2 + y**2)
     n = len(r_val)
@@ -49,7 +49,75 @@ def is_point_inside_polycone(x, y, z, r_val, z_val):
     return inside
 
 
-@njit
+def build_polycone_slabs(r_val, z_val):
+    """
+    Precompile the (r, z) polygon of a polycone into a z-sorted slab table.
+
+    The sorted vertex z values split the polygon into bands (z_k, z_k+1]. Within a band, the same
+    edges are crossed by every horizontal line, so only these edges have to be tested for a point
+    in the band. The edges keep their orientation along the polygon, so the crossing points are
+    computed exactly as in is_point_inside_polycone.
+
+    Returns:
+    tuple of np.ndarray:
+        - slab_z: Sorted unique z values of the vertices (band boundaries).
+        - slab_offsets: Start of the edges of each band in slab_edges, length n_bands + 1.
+          Stored as float64 to fit the numba dictionary of the deadlayer input.
+        - slab_edges: Flattened (p1r, p1z, p2r, p2z) of the edges of all bands.
+        - bbox: Bounding box (r_max, z_min, z_max) of the polygon.
+    """
+    r_val = np.asarray(r_val, dtype=np.float64)
+    z_val = np.asarray(z_val, dtype=np.float64)
+    n = len(r_val)
+    # Edges in the order of the ray casting loop, the last one closes the polygon
+    edges = [
+        (r_val[i - 1], z_val[i - 1], r_val[i % n], z_val[i % n])
+        for i in range(1, n + 1)
+    ]
+    slab_z = np.unique(z_val)
+
+    slab_offsets = [0]
+    slab_edges = []
+    for k in range(len(slab_z) - 1):
+        for p1r, p1z, p2r, p2z in edges:
+            if min(p1z, p2z) <= slab_z[k] and max(p1z, p2z) >= slab_z[k + 1]:
+                slab_edges.extend([p1r, p1z, p2r, p2z])
+        slab_offsets.append(len(slab_edges) // 4)
+
+    bbox = np.array([np.max(r_val), slab_z[0], slab_z[-1]], dtype=np.float64)
+    return (
+        slab_z,
+        np.array(slab_offsets, dtype=np.float64),
+        np.array(slab_edges, dtype=np.float64),
+        bbox,
+    )
+
+
+@njit(nogil=True)
+def is_point_inside_polycone_slabs(x, y, z, slab_z, slab_offsets, slab_edges, bbox):
+    """
+    Point containment using the slab table of build_polycone_slabs.
+    Gives the same result as is_point_inside_polycone, but only tests the edges of the band containing z.
+    """
+    r = np.sqrt(x**2 + y**2)
+    if r > bbox[0] or z <= bbox[1] or z > bbox[2]:
+        return False
+    k = np.searchsorted(slab_z, z) - 1
+    inside = False
+    rints = 0.0
+    for e in range(int(slab_offsets[k]), int(slab_offsets[k + 1])):
+        p1r = slab_edges[4 * e]
+        p1z = slab_edges[4 * e + 1]
+        p2r = slab_edges[4 * e + 2]
+        p2z = slab_edges[4 * e + 3]
+        if r <= max(p1r, p2r):
+            rints = (z - p1z) * (p2r - p1r) / (p2z - p1z) + p1r
+            if p1r == p2r or r <= rints:
+                inside = not inside
+    return inside
+
+
+@njit(nogil=True)
 def is_in_active_volume_polycone(x, y, z, vol, dl_input):
     pos = dl_input[vol]["center"]
     r_dl = dl_input[vol]["r_dl"]
@@ -57,78 +125,97 @@ def is_in_active_volume_polycone(x, y, z, vol, dl_input):
     return is_point_inside_polycone(x - pos[0], y - pos[1], z - pos[2], r_dl, z_dl)
 
 
-def generate_mask_deadlayer(x, y, z, vol, para):
-    if isinstance(para["file"], str):
-        para["file"] = Path(para["file"])
+@njit(nogil=True)
+def is_in_active_volume_slabs(x, y, z, vol, dl_input):
+    vol_dict = dl_input[vol]
+    pos = vol_dict["center"]
+    return is_point_inside_polycone_slabs(
+        x - pos[0],
+        y - pos[1],
+        z - pos[2],
+        vol_dict["slab_z"],
+        vol_dict["slab_offsets"],
+        vol_dict["slab_edges"],
+        vol_dict["bbox"],
+    )
 
-    with Path.open(para["file"]) as f:
-        dl_input = json.load(f)
 
-    def convert_to_numba_dict(py_dict):
-        # Create the outer numba.typed.Dict
-        nb_dict = Dict.empty(
-            key_type=types.int64,
-            value_type=types.DictType(types.unicode_type, types.float64[:]),
+def convert_to_numba_dict(py_dict):
+    # Create the outer numba.typed.Dict
+    nb_dict = Dict.empty(
+        key_type=types.int64,
+        value_type=types.DictType(types.unicode_type, types.float64[:]),
+    )
+
+    for vol_key, vol_value in py_dict.items():
+        # Create the inner dictionary for each volume (flatten surface_mesh fields)
+        vol_dict = Dict.empty(key_type=types.unicode_type, value_type=types.float64[:])
+
+        # Convert "center" to a numpy array
+        center_array = np.array(vol_value["center"], dtype=np.float64)
+        vol_dict["center"] = center_array
+
+        # Flatten "surface_mesh.orig.r", "surface_mesh.orig.z", "surface_mesh.dl.r", and "surface_mesh.dl.z"
+        r_orig_array = np.array(
+            vol_value["surface_mesh"]["orig"]["r"], dtype=np.float64
+        )
+        z_orig_array = np.array(
+            vol_value["surface_mesh"]["orig"]["z"], dtype=np.float64
+        )
+        r_dl_array = np.array(vol_value["surface_mesh"]["dl"]["r"], dtype=np.float64)
+        z_dl_array = np.array(vol_value["surface_mesh"]["dl"]["z"], dtype=np.float64)
+
+        # Store the flattened arrays into the vol_dict
+        vol_dict["r_orig"] = r_orig_array
+        vol_dict["z_orig"] = z_orig_array
+        vol_dict["r_dl"] = r_dl_array
+        vol_dict["z_dl"] = z_dl_array
+
+        # Precompiled slab table of the active volume
+        slab_z, slab_offsets, slab_edges, bbox = build_polycone_slabs(
+            r_dl_array, z_dl_array
+        )
+        vol_dict["slab_z"] = slab_z
+        vol_dict["slab_offsets"] = slab_offsets
+        vol_dict["slab_edges"] = slab_edges
+        vol_dict["bbox"] = bbox
+
+        # Store vol_dict inside the nb_dict with the integer key
+        nb_dict[int(vol_key)] = vol_dict
+
+    return nb_dict
+
+
+_deadlayer_cache = {}
+
+
+def load_deadlayer(file):
+    """
+    Load the deadlayer model and precompile its geometry. The result is cached per file
+    (and modification time), so the geometry is built once per worker instead of once per batch.
+    """
+    file = Path(file)
+    key = (str(file.resolve()), file.stat().st_mtime_ns)
+    if key not in _deadlayer_cache:
+        with Path.open(file) as f:
+            _deadlayer_cache[key] = convert_to_numba_dict(json.load(f))
+    return _deadlayer_cache[key]
+
+
+@njit(nogil=True)
+def _deadlayer_mask_kernel(x, y, z, vol, dl_input):
+    mask = np.empty(len(x), dtype=np.bool_)
+    for i in range(len(x)):
+        mask[i] = is_in_active_volume_slabs(
+            x[i], y[i], z[i], np.int64(vol[i]), dl_input
         )
+    return mask
+
+
+def generate_mask_deadlayer(x, y, z, vol, para):
+    dl_input_numba = load_deadlayer(para["file"])
 
-        for vol_key, vol_value in py_dict.items():
-            # Create the inner dictionary for each volume (flatten surface_mesh fields)
-            vol_dict = Dict.empty(
-                key_type=types.unicode_type, value_type=types.float64[:]
-            )
-
-            # Convert "center" to a numpy array
-            center_array = np.array(vol_value["center"], dtype=np.float64)
-            vol_dict["center"] = center_array
-
-            # Flatten "surface_mesh.orig.r", "surface_mesh.orig.z", "surface_mesh.dl.r", and "surface_mesh.dl.z"
-            r_orig_array = np.array(
-                vol_value["surface_mesh"]["orig"]["r"], dtype=np.float64
-            )
-            z_orig_array = np.array(
-                vol_value["surface_mesh"]["orig"]["z"], dtype=np.float64
-            )
-            r_dl_array = np.array(
-                vol_value["surface_mesh"]["dl"]["r"], dtype=np.float64
-            )
-            z_dl_array = np.array(
-                vol_value["surface_mesh"]["dl"]["z"], dtype=np.float64
-            )
-
-            # Store the flattened arrays into the vol_dict
-            vol_dict["r_orig"] = r_orig_array
-            vol_dict["z_orig"] = z_orig_array
-            vol_dict["r_dl"] = r_dl_array
-            vol_dict["z_dl"] = z_dl_array
-
-            # Store vol_dict inside the nb_dict with the integer key
-            nb_dict[int(vol_key)] = vol_dict
-
-        return nb_dict
-
-    dl_input_numba = convert_to_numba_dict(dl_input)
-
-    @njit
-    def _internal(x, y, z, vol, dl_input):
-        return is_in_active_volume_polycone(x, y, z, vol, dl_input)
-
-    @njit
-    def recursion_function(x, y, z, vol, dl_input_numba):
-        if isinstance(x, List):
-            return List(
-                [
-                    recursion_function(x[i], y[i], z[i], vol[i], dl_input_numba)
-                    for i in range(len(x))
-                ]
-            )
-        return _internal(x, y, z, vol, dl_input_numba)
-
-    x = python_list_to_numba_list(ak.Array(x).to_list())
-    y = python_list_to_numba_list(ak.Array(y).to_list())
-    z = python_list_to_numba_list(ak.Array(z).to_list())
-    vol = python_list_to_numba_list(ak.Array(vol).to_list())
-
-    return ak.Array(recursion_function(x, y, z, vol, dl_input_numba))
+    return map_flat(_deadlayer_mask_kernel, [x, y, z, vol], dl_input_numba)
 
 
 def m_active_volume(para, input, output, pv):
@@ -204,8 +291,9 @@ def m_active_volume(para, input, output, pv):
             pv[input["posx"]], pv[input["posy"]], pv[input["posz"]], para
         )
 
+        selected = take_together({key: pv[input[key]] for key in input}, mask)
         for key in input:
-            pv[output[key]] = pv[input[key]][mask]
+            pv[output[key]] = selected[key]
 
     if para["type"] == "deadlayer":
         mask = generate_mask_deadlayer(
@@ -217,5 +305,6 @@ def m_active_volume(para, input, output, pv):
         )
         pv[output["vol_red"]] = ak.firsts(pv[input["vol"]], axis=-1)
 
+        selected = take_together({key: pv[input[key]] for key in input}, mask)
         for key in input:
-            pv[output[key]] = pv[input[key]][mask]
+            pv[output[key]] = selected[key]
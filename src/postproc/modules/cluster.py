@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import numpy as np
+from numba import njit, types
+from numba.typed import Dict
+
+from .misc import aligned_buffers, from_jagged_buffers
+
+_cell_key = types.UniTuple(types.int64, 5)
+
+
+@njit(nogil=True)
+def _cell_lookup(cells, key):
+    # dict.get with a default is typed as optional by numba
+    if key in cells:
+        return cells[key]
+    return -1
+
+
+@njit(nogil=True)
+def _cluster_kernel(offsets, x, y, z, t, vol, size, dT, radius_mode):
+    """
+    Assigns the steps of each list to clusters using a spatial hash.
+
+    Steps of a list are keyed by volume, time bin and voxel of edge length size. The keys are cleared
+    at each list, so the hash only holds the voxels of one list. In voxel mode all steps of a key form
+    one cluster. In radius mode a step joins the closest cluster seed within size in the
+    same or a neighbouring voxel, otherwise it seeds a new cluster.
+
+    Returns the cluster offsets per list, the cluster index of each step (-1 for steps outside
+    the lists) and the index of the first step of each cluster.
+    """
+    n_lists = len(offsets) - 1
+    step_cluster = np.full(len(x), -1, dtype=np.int64)
+    first_step = np.empty(len(x), dtype=np.int64)
+    cluster_next = np.empty(len(x), dtype=np.int64)
+    cluster_offsets = np.empty(n_lists + 1, dtype=np.int64)
+    cluster_offsets[0] = 0
+    cells = Dict.empty(key_type=_cell_key, value_type=types.int64)
+    n_clusters = 0
+    for i in range(n_lists):
+        cells.clear()
+        for j in range(offsets[i], offsets[i + 1]):
+            it = np.int64(np.floor(t[j] / dT)) if dT > 0 else np.int64(0)
+            ix = np.int64(np.floor(x[j] / size))
+            iy = np.int64(np.floor(y[j] / size))
+            iz = np.int64(np.floor(z[j] / size))
+            v = np.int64(vol[j])
+
+            cluster = -1
+            if radius_mode:
+                best = size * size
+                for dx in range(-1, 2):
+                    for dy in range(-1, 2):
+                        for dz in range(-1, 2):
+                            key = (v, it, ix + dx, iy + dy, iz + dz)
+                            c = _cell_lookup(cells, key)
+                            while c >= 0:
+                                s = first_step[c]
+                                d2 = (
+                                    (x[j] - x[s]) ** 2
+                                    + (y[j] - y[s]) ** 2
+                                    + (z[j] - z[s]) ** 2
+                                )
+                                if d2 <= best:
+                                    best = d2
+                                    cluster = c
+                                c = cluster_next[c]
+            else:
+                key = (v, it, ix, iy, iz)
+                cluster = _cell_lookup(cells, key)
+
+            if cluster < 0:
+                cluster = n_clusters
+                n_clusters += 1
+                first_step[cluster] = j
+                key = (v, it, ix, iy, iz)
+                cluster_next[cluster] = _cell_lookup(cells, key)
+                cells[key] = cluster
+            step_cluster[j] = cluster
+        cluster_offsets[i + 1] = n_clusters
+
+    return cluster_offsets, step_cluster, first_step[:n_clusters]
+
+
+def _weighted_mean(step_cluster, valid, weights, values, n_clusters):
+    """
+    Weighted mean of the values per cluster. Falls back to the plain mean for clusters without weight.
+    """
+    total_weight = np.bincount(
+        step_cluster[valid], weights=weights[valid], minlength=n_clusters
+    )
+    weighted = np.bincount(
+        step_cluster[valid], weights=(weights * values)[valid], minlength=n_clusters
+    )
+    plain = np.bincount(
+        step_cluster[valid], weights=values[valid], minlength=n_clusters
+    ) / np.maximum(np.bincount(step_cluster[valid], minlength=n_clusters), 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total_weight != 0, weighted / total_weight, plain)
+
+
+def cluster_steps(para, edep, posx, posy, posz, vol, t=None, additional=None):
+    """
+    Merge the steps of each innermost list into clusters.
+
+    Returns:
+    dict: Clustered arrays with the keys edep, posx, posy, posz, vol, t (if given) and the keys of
+        additional. Positions and times are energy-weighted means, edep is summed and vol and the
+        additional arrays take the value of the first step of each cluster.
+    """
+    additional = additional or {}
+    size = float(para["size"])
+    dT = float(para.get("dT", 0.0))
+    mode = para.get("type", "voxel")
+    if mode not in ["voxel", "radius"]:
+        text = f"Unknown cluster type {mode}. Options are 'voxel' or 'radius'."
+        raise ValueError(text)
+
+    arrays = {"edep": edep, "posx": posx, "posy": posy, "posz": posz, "vol": vol}
+    if t is not None:
+        arrays["t"] = t
+    arrays.update(additional)
+
+    offsets, contents = aligned_buffers(list(arrays.values()))
+    contents = dict(zip(arrays, contents))
+    flat = len(offsets) == 0
+    if flat:
+        offsets = (np.array([0, len(contents["edep"])], dtype=np.int64),)
+
+    t_content = contents["t"] if t is not None else np.zeros(len(contents["edep"]))
+    cluster_offsets, step_cluster, first_step = _cluster_kernel(
+        offsets[-1],
+        contents["posx"],
+        contents["posy"],
+        contents["posz"],
+        t_content,
+        contents["vol"],
+        size,
+        dT,
+        mode == "radius",
+    )
+    n_clusters = len(first_step)
+    valid = step_cluster >= 0
+    weights = contents["edep"].astype(np.float64)
+
+    output = {}
+    for key, content in contents.items():
+        if key == "edep":
+            clustered = np.bincount(
+                step_cluster[valid], weights=weights[valid], minlength=n_clusters
+            )
+        elif key in ["posx", "posy", "posz", "t"]:
+            clustered = _weighted_mean(
+                step_cluster, valid, weights, content.astype(np.float64), n_clusters
+            )
+        else:
+            clustered = content[first_step]
+        if np.issubdtype(content.dtype, np.floating):
+            clustered = clustered.astype(content.dtype, copy=False)
+        result = from_jagged_buffers((*offsets[:-1], cluster_offsets), clustered)
+        output[key] = result[0] if flat else result
+    return output
+
+
+def m_cluster(para, input, output, pv):
+    """
+    Cluster module for the postprocessing pipeline.
+
+    Merges the steps of each innermost list (e.g. the steps of an event) into clusters using spatial hashing.
+    Steps are only merged within the same volume. The number of dimensions stays the same.
+
+    Parameters:
+    para (dict): Dictionary containing parameters for the module.
+        required:
+        - size (float): Voxel edge length for type 'voxel' or cluster radius for type 'radius'.
+        optional:
+        - type (str): 'voxel' (default) merges all steps in the same voxel. 'radius' merges steps within
+            size of the first step of a cluster.
+        - dT (float): If given, only steps in the same time bin of width dT are merged.
+
+    input (dict): Dictionary containing input parameters.
+        required:
+        - edep: Name of the energy deposition array.
+        - posx: Name of the x positions array.
+        - posy: Name of the y positions array.
+        - posz: Name of the z positions array.
+        - vol: Name of the volume array.
+        optional:
+        - t: Name of the time array.
+        additional:
+        - arbitrary number of input arrays. The value of the first step of each cluster is kept.
+
+    output (dict): Dictionary containing output parameters.
+        One output array for each input array. edep is the summed energy, positions and time are
+        energy-weighted means.
+
+    pv (dict): Dictionary to store the processed values.
+
+    """
+
+    required_input = ["edep", "posx", "posy", "posz", "vol"]
+    for r in required_input:
+        if r not in input:
+            text = f"Required input {r} not found in input. All required inputs are {required_input}."
+            raise ValueError(text)
+
+    required_para = ["size"]
+    for r in required_para:
+        if r not in para:
+            text = f"Required parameter {r} not found in para. All required parameters are {required_para}."
+            raise ValueError(text)
+
+    for r in input:
+        if r not in output:
+            text = f"For each input parameter, there must be a corresponding output parameter. {r} is in input but not in output."
+            raise ValueError(text)
+
+    additional = {
+        key: pv[value]
+        for key, value in input.items()
+        if key not in [*required_input, "t"]
+    }
+    clustered = cluster_steps(
+        para,
+        pv[input["edep"]],
+        pv[input["posx"]],
+        pv[input["posy"]],
+        pv[input["posz"]],
+        pv[input["vol"]],
+        pv[input["t"]] if "t" in input else None,
+        additional,
+    )
+
+    for key in input:
+        pv[output[key]] = clustered[key]
@@ -3,6 +3,8 @@ from __future__ import annotations
 import awkward as ak
 from numba import njit
 
+from .misc import restore_dtype
+
 
 def generate_output(wt_m1, wt_m2, val, para):
     if isinstance(wt_m1[0], (list, ak.Array)):
@@ -75,6 +77,7 @@ def m_coincidence_window(para, input, output, pv):
             text = f"Output {r} not found in input."
             raise ValueError(text)
 
-        pv[output[r]] = generate_output(
-            pv[input["w_t_1"]], pv[input["w_t_2"]], pv[input[r]], para
+        pv[output[r]] = restore_dtype(
+            generate_output(pv[input["w_t_1"]], pv[input["w_t_2"]], pv[input[r]], para),
+            pv[input[r]],
         )
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import awkward as ak
+import numpy as np
+
+from .misc import take_together
+
+ENTRY_KEY = "_entry"
+# Name of the input file of the batch, set by the data manager
+FILE_KEY = "_file"
+# Names of the variables of the pipeline: the input variables and the outputs of the modules
+# run so far, set by the data manager and extended by every module
+VARIABLES_KEY = "_variables"
+
+
+def entry_key(name):
+    """
+    Name of the entry numbers of a variable whose events were selected (e.g. by mask), so they
+    differ from those of the batch.
+    """
+    return f"{ENTRY_KEY}/{name}"
+
+
+def variable_entries(pv, name):
+    """
+    Returns the entry numbers of the events of a variable: those recorded for it if its events
+    were selected, else those of the batch (None if unknown).
+    """
+    return pv.get(entry_key(name), pv.get(ENTRY_KEY))
+
+
+def propagate_entries(input, output, pv):
+    """
+    Record the entry numbers of the outputs of a module computed from variables whose events
+    were selected: an output gets those of the first such input with the same number of events.
+    """
+    entries = [
+        pv[entry_key(name)]
+        for name in input.values()
+        if isinstance(name, str) and entry_key(name) in pv
+    ]
+    if not entries:
+        return
+    for name in output.values():
+        value = pv.get(name) if isinstance(name, str) else None
+        if entry_key(name) in pv or not isinstance(value, (ak.Array, np.ndarray)):
+            continue
+        for entry in entries:
+            if len(entry) == len(value):
+                pv[entry_key(name)] = entry
+                break
+
+
+def event_selection(input, pv):
+    """
+    Returns the per event boolean selection defined by the inputs of the compact module.
+    A nested mask selects an event if any of its values is True, a nested val if it has any value.
+    """
+    if "mask" in input:
+        mask = ak.Array(pv[input["mask"]])
+        while mask.ndim > 1:
+            mask = ak.any(mask, axis=-1)
+        return ak.to_numpy(ak.fill_none(mask, False)).astype(bool)
+
+    val = ak.Array(pv[input["val"]])
+    if val.ndim == 1:
+        return ak.to_numpy(~ak.is_none(val))
+    while val.ndim > 2:
+        val = ak.flatten(val, axis=-1)
+    return ak.to_numpy(ak.num(val, axis=1) > 0)
+
+
+def event_variables(para, pv):
+    """
+    Returns the names of the per event variables compacted with the events: para["variables"] if
+    given, else the variables of the pipeline (or every variable not starting with "_" if pv was
+    not filled by a pipeline), and the entry numbers.
+    """
+    if "variables" in para:
+        names = list(para["variables"])
+    elif VARIABLES_KEY in pv:
+        names = list(pv[VARIABLES_KEY])
+    else:
+        names = [key for key in pv if not key.startswith("_")]
+    return list(dict.fromkeys([*names, ENTRY_KEY]))
+
+
+def m_compact(para, input, output, pv):
+    """
+    Compact module for the postprocessing pipeline.
+
+    Drops the events failing a per event selection from all processing variables at once, so
+    empty events are not carried through the following modules and not written to disk.
+    The original entry numbers of the kept events can be stored to join outputs back to the input.
+
+    Parameters:
+    para (dict): Dictionary containing parameters for the module.
+        optional:
+        - variables (list): Names of the per event variables to compact. Default is the input
+            variables and the outputs of the previous modules. Variables which are not arrays
+            (e.g. histograms) are skipped.
+
+    input (dict): Dictionary containing input parameters.
+        required (one of):
+        - mask: Name of a boolean array. Events are kept if any of their values is True.
+        - val: Name of an array. Events are kept if they contain at least one value.
+
+    output (dict): Dictionary containing output parameters.
+        optional:
+        - entry: Name of the array storing the original entry number of each kept event.
+
+    pv (dict): Dictionary to store the processed values.
+
+    """
+
+    if ("mask" in input) == ("val" in input):
+        text = "Exactly one of the inputs 'mask' or 'val' is required."
+        raise ValueError(text)
+
+    selection = event_selection(input, pv)
+    n_events = len(selection)
+
+    if ENTRY_KEY not in pv:
+        pv[ENTRY_KEY] = np.arange(n_events)
+
+    per_event = {}
+    for key in event_variables(para, pv):
+        value = pv.get(key)
+        if isinstance(value, (list, tuple)):
+            value = ak.Array(value)
+        if not isinstance(value, (ak.Array, np.ndarray)):
+            continue
+        if len(value) != n_events:
+            text = f"Variable {key} has {len(value)} entries, but there are {n_events} events. Set para variables to the per event variables."
+            raise ValueError(text)
+        per_event[key] = value
+    pv.update(take_together(per_event, selection))
+    # The compacted variables have the entries of the batch again
+    for key in per_event:
+        pv.pop(entry_key(key), None)
+
+    if "entry" in output:
+        pv[output["entry"]] = pv[ENTRY_KEY]
+
+
+# The module changes every processing variable, not only its outputs
+m_compact.modifies_all = True
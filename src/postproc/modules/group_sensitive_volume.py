@@ -1,11 +1,10 @@
 from __future__ import annotations
 
 import awkward as ak
-import numba as nb
 import numpy as np
 from numba import njit
 
-from .misc import python_list_to_numba_list
+from .misc import aligned_buffers, from_jagged_buffers, map_sublists, take_together
 
 
 def generate_group_mask(vol, group, sensitive_volumes):
@@ -22,51 +21,85 @@ def generate_group_mask(vol, group, sensitive_volumes):
     return mask > 0
 
 
-def group_all_in_detector_ids(v_voln_hw, v_in):
-    @njit
-    def _internal(builder, v_voln_hw, v_in):
-        # Ensure that list_indices is a numba typed list
-        list_indices = nb.typed.List.empty_list(v_voln_hw._dtype)
-        for i in range(len(v_voln_hw)):
-            cont_flag = False
-            for j in range(len(list_indices)):
-                if v_voln_hw[i] == list_indices[j]:
-                    cont_flag = True
+@njit(nogil=True)
+def _group_order_kernel(offsets, ids):
+    """
+    Groups the elements of each list by id, in order of the first appearance of each id.
+    Returns the group offsets per list, the element offsets per group and the order of the elements.
+    """
+    n_lists = len(offsets) - 1
+    group_offsets = np.empty(n_lists + 1, dtype=np.int64)
+    element_offsets = np.empty(offsets[-1] - offsets[0] + 1, dtype=np.int64)
+    order = np.empty(offsets[-1] - offsets[0], dtype=np.int64)
+    group_offsets[0] = 0
+    element_offsets[0] = 0
+    n_groups = 0
+    pos = 0
+    for i in range(n_lists):
+        start = offsets[i]
+        stop = offsets[i + 1]
+        unique_ids = np.empty(stop - start, dtype=ids.dtype)
+        n_unique = 0
+        for j in range(start, stop):
+            found = False
+            for k in range(n_unique):
+                if unique_ids[k] == ids[j]:
+                    found = True
                     break
-            if cont_flag:
-                continue
-            list_indices.append(v_voln_hw[i])
-
-        for i in range(len(list_indices)):
-            builder.begin_list()
-            for j in range(len(v_in)):
-                if list_indices[i] == v_voln_hw[j]:
-                    builder.append(v_in[j])
-            builder.end_list()
-
-    @njit
-    def recursive(builder, v_voln_hw, v_in):
-        if isinstance(v_voln_hw[0], (nb.typed.List)):
-            for i in range(len(v_voln_hw)):
-                builder.begin_list()
-                recursive(builder, v_voln_hw[i], v_in[i])
-                builder.end_list()
-            return
-
-        _internal(builder, v_voln_hw, v_in)
-
-    builder = ak.ArrayBuilder()
-
-    if isinstance(v_voln_hw, ak.Array):
-        v_voln_hw_list = python_list_to_numba_list(v_voln_hw.to_list())
-        v_in_list = python_list_to_numba_list(v_in.to_list())
-    else:
-        v_voln_hw_list = python_list_to_numba_list(v_voln_hw)
-        v_in_list = python_list_to_numba_list(v_in)
+            if not found:
+                unique_ids[n_unique] = ids[j]
+                n_unique += 1
+
+        for k in range(n_unique):
+            for j in range(start, stop):
+                if ids[j] == unique_ids[k]:
+                    order[pos] = j
+                    pos += 1
+            n_groups += 1
+            element_offsets[n_groups] = pos
+        group_offsets[i + 1] = n_groups
 
-    recursive(builder, v_voln_hw_list, v_in_list)
+    return group_offsets, element_offsets[: n_groups + 1], order
 
-    return builder.snapshot()
+
+@njit(nogil=True)
+def _group_by_id_kernel(offsets, ids, values):
+    group_offsets, element_offsets, order = _group_order_kernel(offsets, ids)
+    return group_offsets, element_offsets, values[order]
+
+
+def group_all_in_detector_ids(v_voln_hw, v_in):
+    """
+    Adds a dimension to v_in, grouping the values of each innermost list by the volume ids in v_voln_hw.
+    """
+    return map_sublists(_group_by_id_kernel, [v_voln_hw, v_in])
+
+
+def group_all_in_detector_ids_together(v_voln_hw, arrays):
+    """
+    Same as group_all_in_detector_ids for several arrays. The grouping is computed once and
+    the grouped arrays share their offsets.
+
+    Parameters:
+    v_voln_hw: Volume ids.
+    arrays (dict): Arrays by name with the same structure as v_voln_hw.
+
+    Returns:
+    dict: The grouped arrays by name.
+    """
+    offsets, contents = aligned_buffers([v_voln_hw, *arrays.values()])
+    flat = len(offsets) == 0
+    if flat:
+        offsets = (np.array([0, len(contents[0])], dtype=np.int64),)
+    group_offsets, element_offsets, order = _group_order_kernel(
+        offsets[-1], contents[0]
+    )
+    new_offsets = (*offsets[:-1], group_offsets, element_offsets)
+    grouped = {}
+    for key, content in zip(arrays, contents[1:]):
+        result = from_jagged_buffers(new_offsets, content[order])
+        grouped[key] = result[0] if flat else result
+    return grouped
 
 
 def m_group_sensitive_volume(para, input, output, pv):
@@ -120,9 +153,13 @@ def m_group_sensitive_volume(para, input, output, pv):
         mask = generate_group_mask(
             pv[input["vol"]], para["group"], para["sensitive_volumes"]
         )
+        selected = take_together({key: pv[input[key]] for key in output}, mask)
         for key, value in output.items():
-            pv[value] = pv[input[key]][mask]
+            pv[value] = selected[key]
 
     else:
+        grouped = group_all_in_detector_ids_together(
+            pv[input["vol"]], {key: pv[input[key]] for key in output}
+        )
         for key, value in output.items():
-            pv[value] = group_all_in_detector_ids(pv[input["vol"]], pv[input[key]])
+            pv[value] = grouped[key]
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import awkward as ak
+import numpy as np
+
+
+class histogram:
+    """
+    Fixed binning histogram with 1 or more dimensions.
+
+    Histograms with the same binning are merged by adding them, so partial histograms of
+    batches, files and workers can be combined into the histogram of the full run.
+
+    Parameters:
+    edges (list of np.ndarray): Bin edges of each axis.
+    counts (np.ndarray): Sum of weights per bin. Defaults to zeros.
+    sumw2 (np.ndarray): Sum of squared weights per bin, only kept for weighted histograms.
+    """
+
+    def __init__(self, edges, counts=None, sumw2=None):
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        shape = tuple(len(e) - 1 for e in self.edges)
+        self.counts = np.zeros(shape) if counts is None else np.asarray(counts)
+        self.sumw2 = None if sumw2 is None else np.asarray(sumw2)
+
+    @property
+    def ndim(self):
+        return len(self.edges)
+
+    def fill(self, *values, weights=None):
+        """
+        Fill flat arrays of values (one per axis), optionally weighted.
+        """
+        sample = np.stack([np.asarray(v, dtype=np.float64) for v in values], axis=-1)
+        counts, _ = np.histogramdd(sample, bins=self.edges, weights=weights)
+        self.counts = self.counts + counts
+        if weights is not None:
+            sumw2, _ = np.histogramdd(
+                sample, bins=self.edges, weights=np.asarray(weights) ** 2
+            )
+            self.sumw2 = sumw2 if self.sumw2 is None else self.sumw2 + sumw2
+
+    def __add__(self, other):
+        if self.ndim != other.ndim or not all(
+            np.array_equal(a, b) for a, b in zip(self.edges, other.edges)
+        ):
+            text = "Only histograms with the same binning can be merged."
+            raise ValueError(text)
+        if self.sumw2 is None and other.sumw2 is None:
+            sumw2 = None
+        else:
+            sumw2 = (self.counts if self.sumw2 is None else self.sumw2) + (
+                other.counts if other.sumw2 is None else other.sumw2
+            )
+        return histogram(self.edges, self.counts + other.counts, sumw2)
+
+    def write(self, group):
+        """
+        Write the histogram to an HDF5 group: counts, edges_<axis> and for weighted histograms sumw2.
+        """
+        group.attrs["ndim"] = self.ndim
+        group.create_dataset("counts", data=self.counts)
+        for i, edges in enumerate(self.edges):
+            group.create_dataset(f"edges_{i}", data=edges)
+        if self.sumw2 is not None:
+            group.create_dataset("sumw2", data=self.sumw2)
+
+    @classmethod
+    def read(cls, group):
+        edges = [np.asarray(group[f"edges_{i}"]) for i in range(group.attrs["ndim"])]
+        sumw2 = np.asarray(group["sumw2"]) if "sumw2" in group else None
+        return cls(edges, np.asarray(group["counts"]), sumw2)
+
+
+def binning(para, ndim):
+    """
+    Returns the bin edges of each axis from the module parameters.
+
+    bins is either the number of bins of all axes, the bin edges (1D) or a list with the number
+    of bins or the bin edges of each axis. range gives [low, high] (1D) or one [low, high] per
+    axis and is required for axes given by their number of bins.
+    """
+    bins = para["bins"]
+    if isinstance(bins, int):
+        bins = [bins] * ndim
+    elif ndim == 1:
+        bins = [bins]
+
+    ranges = para.get("range")
+    if ranges is not None and ndim == 1:
+        ranges = [ranges]
+
+    if len(bins) != ndim:
+        text = f"Expected bins for {ndim} axes, got {len(bins)}."
+        raise ValueError(text)
+
+    edges = []
+    for i, b in enumerate(bins):
+        if isinstance(b, int):
+            if ranges is None:
+                text = "Parameter 'range' is required if the number of bins is given."
+                raise ValueError(text)
+            edges.append(np.linspace(ranges[i][0], ranges[i][1], b + 1))
+        else:
+            edges.append(np.asarray(b, dtype=np.float64))
+    return edges
+
+
+def flat_values(arrays):
+    """
+    Broadcast the arrays against each other and return their values as flat numpy arrays.
+    Entries where any of the arrays is missing (None) are dropped.
+    """
+    arrays = ak.broadcast_arrays(*arrays)
+    valid = None
+    flat = []
+    for array in arrays:
+        present = ~ak.to_numpy(ak.flatten(ak.is_none(array, axis=-1), axis=None))
+        valid = present if valid is None else valid & present
+        flat.append(ak.to_numpy(ak.flatten(ak.fill_none(array, 0), axis=None)))
+    return [f[valid] for f in flat]
+
+
+def m_histogram(para, input, output, pv):
+    """
+    Histogram module for the postprocessing pipeline.
+
+    Fills the input values of the batch into a histogram with fixed binning. The data manager adds
+    the histograms of all batches (and process_manager.summarize those of all files), and only the
+    histogram is written, not the events.
+
+    Parameters:
+    para (dict): Dictionary containing parameters for the module.
+        required:
+        - bins (int or list): Number of bins of all axes, bin edges (1D) or the number of bins or
+            bin edges of each axis.
+        optional:
+        - range (list): [low, high] (1D) or [[low, high], ...] per axis. Required for axes given
+            by their number of bins.
+
+    input (dict): Dictionary containing input parameters.
+        required:
+        - x: Name of the values of the first axis.
+        optional:
+        - y: Name of the values of the second axis.
+        - z: Name of the values of the third axis.
+        - weight: Name of the weights. Broadcast against the values, e.g. one weight per event.
+
+    output (dict): Dictionary containing output parameters.
+        required:
+        - hist: Name of the histogram.
+
+    pv (dict): Dictionary to store the processed values.
+
+    """
+
+    if "x" not in input:
+        text = "Required input x not found in input."
+        raise ValueError(text)
+
+    if "hist" not in output:
+        text = "Required output hist not found in output."
+        raise ValueError(text)
+
+    if "bins" not in para:
+        text = "Required parameter bins not found in para."
+        raise ValueError(text)
+
+    axes = [key for key in ["x", "y", "z"] if key in input]
+    arrays = [pv[input[key]] for key in axes]
+    if "weight" in input:
+        arrays.append(pv[input["weight"]])
+    values = flat_values(arrays)
+
+    hist = histogram(binning(para, len(axes)))
+    if "weight" in input:
+        hist.fill(*values[:-1], weights=values[-1])
+    else:
+        hist.fill(*values)
+    pv[output["hist"]] = hist
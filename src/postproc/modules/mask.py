@@ -1,5 +1,11 @@
 from __future__ import annotations
 
+import awkward as ak
+import numpy as np
+
+from .compact import entry_key, variable_entries
+from .misc import take_together
+
 
 def m_mask(para, input, output, pv):  # noqa: ARG001
     """
@@ -24,6 +30,10 @@ def m_mask(para, input, output, pv):  # noqa: ARG001
 
     pv (dict): Dictionary to store the processed values.
 
+    If the mask selects events (one value per event), the entry numbers of the selected events
+    are recorded for each output (see compact.entry_key), so the outputs can be joined back to
+    the input.
+
     """
 
     required_input = ["mask"]
@@ -39,5 +49,16 @@ def m_mask(para, input, output, pv):  # noqa: ARG001
             text = f"All additional input parameters must have an output parameter. {r} not found in output."
             raise ValueError(text)
 
+    selected = take_together(
+        {r: pv[input[r]] for r in additional_input}, pv[input["mask"]]
+    )
+    for r in additional_input:
+        pv[output[r]] = selected[r]
+
+    mask = ak.Array(pv[input["mask"]])
+    if mask.ndim > 1:
+        return
     for r in additional_input:
-        pv[output[r]] = pv[input[r]][pv[input["mask"]]]
+        entry = variable_entries(pv, input[r])
+        if entry is not None and len(entry) == len(mask):
+            pv[entry_key(output[r])] = ak.to_numpy(ak.Array(np.asarray(entry))[mask])
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import awkward as ak
+import numpy as np
 from numba import jit, types
 from numba.typed import List
 
@@ -71,3 +73,319 @@ def python_list_to_numba_list(py_list):
     elem_type, depth = infer_numba_type_and_depth(py_list)
     # Use Numba-compiled function for conversion
     return _convert_to_numba_list(py_list, elem_type, depth)
+
+
+def jagged_buffers(array):
+    """
+    Returns the buffers of a (nested) jagged array for use in numba kernels.
+
+    The list offsets of every level and the flat content are returned as views of the
+    awkward layout, so no data is copied for ListOffsetArray and NumpyArray layouts.
+    RegularArray and ListArray levels are converted to offsets first.
+
+    Parameters:
+    array (ak.Array, np.ndarray, list): The jagged array.
+
+    Returns:
+    tuple: (offsets, content) with offsets a tuple of np.ndarray (outermost level first) and
+        content the flat np.ndarray of the innermost values. The innermost offsets index
+        into content, each other level indexes into the level below.
+    """
+    layout = ak.to_layout(array)
+    offsets = []
+    while True:
+        if isinstance(layout, ak.contents.NumpyArray):
+            if layout.data.ndim > 1:
+                layout = layout.to_RegularArray()
+                continue
+            return tuple(offsets), np.asarray(layout.data)
+        if isinstance(layout, ak.contents.EmptyArray):
+            return tuple(offsets), np.empty(0, dtype=np.float64)
+        if isinstance(layout, ak.contents.ListOffsetArray):
+            offsets.append(np.asarray(layout.offsets.data))
+            layout = layout.content
+        elif isinstance(layout, (ak.contents.ListArray, ak.contents.RegularArray)):
+            layout = layout.to_ListOffsetArray64(False)
+        elif isinstance(layout, ak.contents.IndexedArray):
+            layout = layout.project()
+        elif isinstance(layout, ak.contents.UnmaskedArray):
+            layout = layout.content
+        else:
+            text = f"Unsupported layout for jagged kernels: {type(layout).__name__}"
+            raise TypeError(text)
+
+
+def from_jagged_buffers(offsets, content):
+    """
+    Build an awkward array from list offsets (outermost level first) and a flat content buffer
+    without copying them. Inverse of jagged_buffers.
+    """
+    layout = ak.contents.NumpyArray(content)
+    for level_offsets in reversed(offsets):
+        layout = ak.contents.ListOffsetArray(ak.index.Index(level_offsets), layout)
+    return ak.Array(layout)
+
+
+def aligned_buffers(arrays):
+    """
+    Returns the common offsets and the flat contents of arrays with the same jagged structure.
+
+    Raises:
+    ValueError: If the arrays do not have the same structure.
+    """
+    buffers = [jagged_buffers(array) for array in arrays]
+    if not _same_offsets(buffers):
+        # e.g. sliced arrays whose offsets do not start at zero
+        buffers = [jagged_buffers(ak.to_packed(ak.Array(array))) for array in arrays]
+        if not _same_offsets(buffers):
+            text = "Arrays passed to a jagged kernel must have the same structure."
+            raise ValueError(text)
+    return buffers[0][0], [content for _, content in buffers]
+
+
+def _same_offsets(buffers):
+    reference = buffers[0][0]
+    for offsets, _ in buffers[1:]:
+        if len(offsets) != len(reference):
+            return False
+        for a, b in zip(offsets, reference):
+            if a is not b and not np.array_equal(a, b):
+                return False
+    return True
+
+
+def map_flat(kernel, arrays, *args):
+    """
+    Apply a per-element kernel to the flat contents of arrays with the same jagged structure.
+
+    Parameters:
+    kernel (callable): Called as kernel(*contents, *args) and returns a flat array of the same
+        length as the contents. Usually a numba function.
+    arrays (list): Jagged arrays with identical structure.
+    args: Additional arguments passed to the kernel.
+
+    Returns:
+    ak.Array: The kernel output with the structure of the input arrays.
+    """
+    offsets, contents = aligned_buffers(arrays)
+    return from_jagged_buffers(offsets, kernel(*contents, *args))
+
+
+def map_sublists(kernel, arrays, *args):
+    """
+    Apply a kernel to the innermost lists of arrays with the same jagged structure.
+
+    Parameters:
+    kernel (callable): Called as kernel(offsets, *contents, *args) with the innermost offsets.
+        Returns a tuple (offsets_1, ..., offsets_k, content) describing the new lists that replace
+        the innermost level: offsets_1 has one entry per innermost list plus one, every further level
+        indexes into the previous one and content is the new flat content. Usually a numba function.
+    arrays (list): Jagged arrays with identical structure. A flat array is treated as a single list.
+    args: Additional arguments passed to the kernel.
+
+    Returns:
+    ak.Array: The rebuilt array with the outer levels of the input arrays.
+    """
+    offsets, contents = aligned_buffers(arrays)
+    flat = len(offsets) == 0
+    if flat:
+        offsets = (np.array([0, len(contents[0])], dtype=np.int64),)
+    *new_offsets, content = kernel(offsets[-1], *contents, *args)
+    result = from_jagged_buffers((*offsets[:-1], *new_offsets), content)
+    return result[0] if flat else result
+
+
+def content_dtype(array):
+    """
+    Returns the dtype of the innermost values of an array, or None for records, unions and empty arrays.
+    """
+    layout = ak.to_layout(array)
+    while not isinstance(layout, ak.contents.NumpyArray):
+        if not hasattr(layout, "content"):
+            return None
+        layout = layout.content
+    return layout.data.dtype
+
+
+def cast_dtype(array, dtype):
+    """
+    Cast the values of an array to the given dtype, keeping its structure.
+
+    Raises:
+    ValueError: If an integer dtype cannot represent all values of the array.
+    """
+    dtype = np.dtype(dtype)
+    current = content_dtype(array)
+    if current == dtype:
+        return array
+    if np.issubdtype(dtype, np.integer) and current is not None:
+        info = np.iinfo(dtype)
+        low, high = ak.min(array, axis=None), ak.max(array, axis=None)
+        if low is not None and (low < info.min or high > info.max):
+            text = f"Values out of range for dtype {dtype}."
+            raise ValueError(text)
+    return ak.values_astype(array, dtype)
+
+
+def narrow_variables(variables, keys, dtypes):
+    """
+    Cast the given variables in place to the dtypes of a "dtype" policy (e.g.
+    {"vol": "int32", "edep": "float32"}). Variables without a policy are left as they are.
+    """
+    for key in keys:
+        if key in dtypes:
+            variables[key] = cast_dtype(variables[key], dtypes[key])
+    return variables
+
+
+def restore_dtype(result, reference):
+    """
+    Cast the result of a module back to the dtype of its input if the module upcast it
+    (e.g. float32 to float64 by building Python lists). Different kinds are left as they are.
+    """
+    dtype = content_dtype(reference)
+    current = content_dtype(result)
+    if dtype is None or current is None or dtype == current:
+        return result
+    if dtype.kind != current.kind:
+        return result
+    return ak.values_astype(result, dtype)
+
+
+def _structure_groups(arrays):
+    """
+    Group the keys of awkward arrays that have the same jagged structure (same length, offsets
+    and content length). Other arrays are returned as single groups.
+    """
+    groups = {}
+    for key, array in arrays.items():
+        signature = key
+        if isinstance(array, ak.Array):
+            try:
+                offsets, content = jagged_buffers(array)
+                signature = (
+                    len(array),
+                    tuple(hash(o.tobytes()) for o in offsets),
+                    len(content),
+                )
+            except TypeError:
+                pass
+        groups.setdefault(signature, []).append(key)
+    return list(groups.values())
+
+
+def _zip_group(arrays, keys):
+    if len(keys) < 2:
+        return None
+    try:
+        return ak.zip({key: arrays[key] for key in keys})
+    except ValueError:
+        return None
+
+
+def share_offsets(arrays):
+    """
+    Hold arrays with the same jagged structure as fields of one record array, so they share
+    one set of list offsets instead of one copy per array.
+
+    Parameters:
+    arrays (dict): Arrays by name.
+
+    Returns:
+    dict: The same arrays, those with the same structure as views of one record array.
+    """
+    result = dict(arrays)
+    for keys in _structure_groups(arrays):
+        record = _zip_group(arrays, keys)
+        if record is not None:
+            result.update(zip(record.fields, ak.unzip(record)))
+    return result
+
+
+def take_together(arrays, index):
+    """
+    Apply the same mask or index to several arrays. Arrays with the same jagged structure are
+    zipped into a record first, so the selection is computed once and the results share their
+    offsets.
+
+    Parameters:
+    arrays (dict): Arrays by name.
+    index: Mask or index array applied to every array.
+
+    Returns:
+    dict: The selected arrays by name.
+    """
+    result = {}
+    for keys in _structure_groups(arrays):
+        record = _zip_group(arrays, keys)
+        if record is None:
+            result.update({key: arrays[key][index] for key in keys})
+        else:
+            selected = record[index]
+            result.update(zip(selected.fields, ak.unzip(selected)))
+    return result
+
+
+def _narrow_index(index, cache):
+    data = np.asarray(index.data)
+    if cache is None:
+        return index
+    if data.dtype != np.int64 or (len(data) and data.max() > np.iinfo(np.int32).max):
+        return index
+    key = (data.ctypes.data, len(data))
+    if key not in cache:
+        cache[key] = ak.index.Index32(data.astype(np.int32))
+    return cache[key]
+
+
+def _compact_layout(layout, cache):
+    if isinstance(layout, ak.contents.ListOffsetArray):
+        return ak.contents.ListOffsetArray(
+            _narrow_index(layout.offsets, cache),
+            _compact_layout(layout.content, cache),
+            parameters=layout.parameters,
+        )
+    if isinstance(layout, ak.contents.IndexedOptionArray):
+        return ak.contents.IndexedOptionArray(
+            _narrow_index(layout.index, cache),
+            _compact_layout(layout.content, cache),
+            parameters=layout.parameters,
+        )
+    if isinstance(layout, ak.contents.RecordArray):
+        return layout.copy(
+            contents=[_compact_layout(content, cache) for content in layout.contents]
+        )
+    if isinstance(
+        layout,
+        (
+            ak.contents.RegularArray,
+            ak.contents.ByteMaskedArray,
+            ak.contents.BitMaskedArray,
+            ak.contents.UnmaskedArray,
+        ),
+    ):
+        return layout.copy(content=_compact_layout(layout.content, cache))
+    return layout
+
+
+def compact_layout(array, narrow=False, cache=None):
+    """
+    Pack an array, e.g. the ListArray and IndexedArray layouts left by slicing or ak.Array(list).
+
+    Parameters:
+    array (ak.Array): The array.
+    narrow (bool): Also store offsets and indices as int32 if they fit. Awkward lacks kernels for
+        some operations on arrays mixing int32 and int64 offsets, so only narrow arrays that
+        are not processed further, e.g. before writing.
+    cache (dict): Optional. Arrays narrowed with the same cache keep sharing offsets that they
+        shared before.
+
+    Returns:
+    ak.Array: The compacted array with the same values.
+    """
+    if narrow and cache is None:
+        cache = {}
+    layout = ak.to_layout(ak.to_packed(array))
+    return ak.Array(
+        _compact_layout(layout, cache if narrow else None), behavior=array.behavior
+    )
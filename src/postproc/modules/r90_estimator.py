@@ -3,6 +3,8 @@ from __future__ import annotations
 import awkward as ak
 import numpy as np
 
+from .misc import restore_dtype
+
 
 def get_R90_per_detector(v_dist, v_edep):
     tot_e = np.sum(v_edep)
@@ -88,6 +90,9 @@ def m_r90_estimator(para, input, output, pv):  # noqa: ARG001
             text = f"Required output {r} not found in output. All required outputs are {required_output}."
             raise ValueError(text)
 
-    pv[output["r90"]] = calculate_R90(
+    r90 = calculate_R90(
         pv[input["edep"]], pv[input["posx"]], pv[input["posy"]], pv[input["posz"]]
     )
+    if isinstance(r90, ak.Array):
+        r90 = restore_dtype(r90, pv[input["posx"]])
+    pv[output["r90"]] = r90
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import importlib
+import threading
+from importlib import metadata
+
+ENTRY_POINT_GROUP = "postproc.modules"
+
+_builtin_modules = {
+    "acceptance_range": ".acceptance_range:m_acceptance_range",
+    "active_volume": ".active_volume:m_active_volume",
+    "cluster": ".cluster:m_cluster",
+    "coincidence_window": ".coincidence_window:m_coincidence_window",
+    "compact": ".compact:m_compact",
+    "detector_active_time": ".detector_active_time:m_detector_active_time",
+    "group_sensitive_volume": ".group_sensitive_volume:m_group_sensitive_volume",
+    "histogram": ".histogram:m_histogram",
+    "mask": ".mask:m_mask",
+    "max": ".max:m_max",
+    "r90_estimator": ".r90_estimator:m_r90_estimator",
+    "select_events": ".compact:m_compact",
+    "smear": ".smear:m_smear",
+    "sum": ".sum:m_sum",
+    "window": ".window:m_window",
+}
+
+_registered_modules = {}
+_loaded_modules = {}
+_lock = threading.Lock()
+
+
+def _entry_points():
+    eps = metadata.entry_points()
+    if hasattr(eps, "select"):
+        return {ep.name: ep for ep in eps.select(group=ENTRY_POINT_GROUP)}
+    return {ep.name: ep for ep in eps.get(ENTRY_POINT_GROUP, [])}
+
+
+def _import_target(target):
+    module_path, _, attr = target.partition(":")
+    if module_path.startswith("."):
+        return getattr(importlib.import_module(module_path, __package__), attr)
+    return getattr(importlib.import_module(module_path), attr)
+
+
+def register_module(name, module):
+    """
+    Register a processing module under the given name.
+
+    Parameters:
+    name (str): Name used in the "module" field of an instruction.
+    module (callable, str): The module function with the signature (para, input, output, pv),
+        or its import path in the form "package.module:function". Import paths are only
+        imported once an instruction references the module.
+
+    """
+    with _lock:
+        _registered_modules[name] = module
+        _loaded_modules.pop(name, None)
+
+
+def available_modules():
+    """
+    Returns the sorted names of all built-in, registered and entry point modules.
+    """
+    return sorted(
+        set(_builtin_modules) | set(_registered_modules) | set(_entry_points())
+    )
+
+
+def get_module(name):
+    """
+    Returns the processing module registered under the given name, importing it on first use.
+
+    Modules are looked up in the following order: modules registered with register_module,
+    the built-in modules and modules advertised by installed packages in the
+    "postproc.modules" entry point group.
+
+    Raises:
+    NotImplementedError: If no module with the given name is known.
+    """
+    with _lock:
+        if name in _loaded_modules:
+            return _loaded_modules[name]
+
+        if name in _registered_modules:
+            module = _registered_modules[name]
+            if isinstance(module, str):
+                module = _import_target(module)
+        elif name in _builtin_modules:
+            module = _import_target(_builtin_modules[name])
+        else:
+            entry_points = _entry_points()
+            if name not in entry_points:
+                error_message = f"{name} not defined."
+                raise NotImplementedError(error_message)
+            module = entry_points[name].load()
+
+        _loaded_modules[name] = module
+        return module
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import hashlib
+
+import awkward as ak
+import numpy as np
+
+from .compact import FILE_KEY, variable_entries
+from .misc import aligned_buffers, from_jagged_buffers
+
+# FWHM = 2 sqrt(2 ln 2) sigma
+FWHM_TO_SIGMA = 1 / (2 * np.sqrt(2 * np.log(2)))
+
+
+def _mix(x):
+    """
+    SplitMix64 finalizer. Maps a uint64 counter to a statistically independent uint64.
+    """
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def file_key(seed, file):
+    """
+    Returns the 64 bit key of the random streams of a file. Python's hash is salted per
+    process, so the name is hashed with blake2b.
+    """
+    digest = hashlib.blake2b(f"{seed}:{file}".encode(), digest_size=8).digest()
+    return np.uint64(int.from_bytes(digest, "little"))
+
+
+def counter_normal(key, entry, position):
+    """
+    Counter-based standard normal numbers: the value for (key, entry, position) does not depend
+    on which other values are generated, so it is the same however a file is split into tasks
+    and batches.
+
+    Parameters:
+    key (np.uint64): Key of the stream, see file_key.
+    entry (np.ndarray): Entry number of each value.
+    position (np.ndarray): Position of each value within its entry.
+    """
+    with np.errstate(over="ignore"):
+        h = _mix(key ^ _mix(np.asarray(entry, dtype=np.uint64)))
+        h = _mix(h ^ np.asarray(position, dtype=np.uint64))
+        u1 = ((_mix(h ^ np.uint64(1)) >> np.uint64(11)) + 0.5) * 2.0**-53
+        u2 = (_mix(h ^ np.uint64(2)) >> np.uint64(11)) * 2.0**-53
+    # Box-Muller
+    return np.sqrt(-2 * np.log(u1)) * np.cos(2 * np.pi * u2)
+
+
+def element_positions(offsets, n_events, n_values):
+    """
+    Returns the event index and the position within its event of every value of a jagged array.
+    """
+    event = np.arange(n_events)
+    start = np.arange(n_events)
+    for level in offsets:
+        event = np.repeat(event, np.diff(level))
+        start = level[start]
+    if not offsets:
+        return event, np.zeros(n_values, dtype=np.int64)
+    return event, np.arange(n_values) - start[event]
+
+
+def resolution_coefficients(resolution, vol, n_values):
+    """
+    Returns the coefficients (a, b, c) of FWHM(E) = sqrt(a + b E + c E^2) for each value.
+
+    Parameters:
+    resolution (dict): Coefficients per volume id. The curve under "default" is used for volumes
+        without their own curve. Shorter lists are padded with zeros, e.g. [a] is a constant FWHM
+        of sqrt(a).
+    vol (np.ndarray): Volume id of each value, or None to use the default curve for all values.
+    """
+    curves = {
+        key: np.pad(np.asarray(value, dtype=np.float64), (0, 3 - len(value)))
+        for key, value in resolution.items()
+    }
+    default = curves.pop("default", None)
+    if vol is None:
+        if default is None:
+            text = "Without input vol, para resolution needs a 'default' curve."
+            raise ValueError(text)
+        return np.broadcast_to(default, (n_values, 3)).T
+
+    ids = np.array(sorted(int(key) for key in curves), dtype=np.int64)
+    table = np.array([curves[key] for key in sorted(curves, key=int)]).reshape(-1, 3)
+    index = np.clip(np.searchsorted(ids, vol), 0, max(len(ids) - 1, 0))
+    known = ids[index] == vol if len(ids) else np.zeros(len(vol), dtype=bool)
+    if not np.all(known):
+        if default is None:
+            text = f"No resolution curve for volumes {np.unique(vol[~known]).tolist()}."
+            raise ValueError(text)
+        table = np.vstack([table, default])
+        index = np.where(known, index, len(ids))
+    return table[index].T
+
+
+def smear_energies(edep, vol, entry, key, resolution):
+    """
+    Smear energies with a Gaussian of the FWHM of their volume.
+
+    Parameters:
+    edep (ak.Array): Energies, one per event or jagged.
+    vol (ak.Array): Volume ids with the same structure as edep, or None.
+    entry (np.ndarray): Entry number of each event.
+    key (np.uint64): Key of the random streams of the file.
+    resolution (dict): Coefficients of the FWHM curves (see resolution_coefficients).
+
+    Returns:
+    ak.Array: The smeared energies with the structure and dtype of edep. Values <= 0 (e.g.
+        events without energy) are not smeared.
+    """
+    arrays = [edep] if vol is None else [edep, vol]
+    offsets, contents = aligned_buffers(arrays)
+    energy = contents[0].astype(np.float64)
+    event, position = element_positions(offsets, len(entry), len(energy))
+
+    a, b, c = resolution_coefficients(
+        resolution, None if vol is None else contents[1], len(energy)
+    )
+    sigma = np.sqrt(np.maximum(a + b * energy + c * energy**2, 0)) * FWHM_TO_SIGMA
+    smeared = energy + sigma * counter_normal(key, entry[event], position)
+    smeared = np.where(energy > 0, smeared, energy)
+    if np.issubdtype(contents[0].dtype, np.floating):
+        smeared = smeared.astype(contents[0].dtype, copy=False)
+    return from_jagged_buffers(offsets, smeared)
+
+
+def m_smear(para, input, output, pv):
+    """
+    Smear module for the postprocessing pipeline.
+
+    Applies the energy resolution of the detectors: every energy is smeared with a Gaussian of
+    FWHM(E) = sqrt(a + b E + c E^2), with the coefficients of its volume. The random numbers are
+    drawn from a counter-based generator keyed on (seed, file, entry, position in the event), so
+    the result does not depend on batching, threads or how a file is split into tasks.
+
+    Parameters:
+    para (dict): Dictionary containing parameters for the module.
+        required:
+        - resolution (dict): Coefficients [a, b, c] per volume id and optionally under "default"
+            for all other volumes. Units follow those of the energies.
+        optional:
+        - seed (int): Seed of the random numbers. Default is 0.
+
+    input (dict): Dictionary containing input parameters.
+        required:
+        - edep: Name of the energy array.
+        optional:
+        - vol: Name of the volume array with the same structure as edep. Without it, the
+            "default" curve is used.
+
+    output (dict): Dictionary containing output parameters.
+        required:
+        - edep: Name of the smeared energy array.
+
+    pv (dict): Dictionary to store the processed values.
+
+    """
+
+    if "edep" not in input:
+        text = "Required input edep not found in input."
+        raise ValueError(text)
+
+    if "edep" not in output:
+        text = "Required output edep not found in output."
+        raise ValueError(text)
+
+    if "resolution" not in para:
+        text = "Required parameter resolution not found in para."
+        raise ValueError(text)
+
+    edep = ak.Array(pv[input["edep"]])
+    vol = ak.Array(pv[input["vol"]]) if "vol" in input else None
+    entry = variable_entries(pv, input["edep"])
+    entry = np.arange(len(edep)) if entry is None else np.asarray(entry)
+    key = file_key(para.get("seed", 0), pv.get(FILE_KEY, ""))
+
+    # Missing events and missing values of the innermost lists stay missing
+    missing_events = None
+    if edep.layout.is_option:
+        missing_events = ak.is_none(edep, axis=0)
+        edep = ak.fill_none(edep, [] if edep.ndim > 1 else 0.0, axis=0)
+        if vol is not None:
+            vol = ak.fill_none(vol, [] if vol.ndim > 1 else 0, axis=0)
+    missing_values = None
+    if edep.ndim > 1 and ak.any(ak.is_none(edep, axis=-1)):
+        missing_values = ak.is_none(edep, axis=-1)
+        edep = ak.fill_none(edep, 0.0, axis=-1)
+        if vol is not None:
+            vol = ak.fill_none(vol, 0, axis=-1)
+
+    smeared = smear_energies(edep, vol, entry, key, para["resolution"])
+    if missing_values is not None:
+        smeared = ak.mask(smeared, ~missing_values)
+    if missing_events is not None:
+        smeared = ak.mask(smeared, ~missing_events)
+    pv[output["edep"]] = smeared
@@ -6,6 +6,8 @@ import numpy as np
 from numba import jit
 from numba.typed import List
 
+from .misc import restore_dtype
+
 
 def subtract_smallest_time(t, t_all):
     if t.ndim == 1:
@@ -115,6 +117,33 @@ def generate_windowed_hits(mapping, v_in):
     return _recursion_function(mapping, v_in)
 
 
+def group_by_window(mapping, arrays):
+    """
+    Adds a dimension to the arrays, grouping the values of each innermost list by their window
+    index in mapping. Gives the same result as generate_windowed_hits, but regroups all arrays at
+    once: arrays with the same structure are grouped as one record and share their offsets.
+
+    Parameters:
+    mapping: Window index of each value, as returned by generate_map.
+    arrays (dict): Arrays by name with the same structure as mapping.
+
+    Returns:
+    dict: The windowed arrays by name.
+    """
+    mapping = ak.values_astype(ak.Array(mapping), np.int64)
+    order = ak.argsort(mapping, axis=-1, stable=True)
+    counts = ak.flatten(ak.run_lengths(mapping[order]), axis=None)
+    try:
+        record = ak.zip(arrays)
+    except ValueError:
+        return {
+            key: ak.unflatten(array[order], counts, axis=-1)
+            for key, array in arrays.items()
+        }
+    windowed = ak.unflatten(record[order], counts, axis=-1)
+    return dict(zip(windowed.fields, ak.unzip(windowed)))
+
+
 def m_window(para, input, output, pv):
     """
     Windowing module for the postprocessing pipeline.
@@ -141,10 +170,10 @@ def m_window(para, input, output, pv):
         additional:
         - arbitrary many additional output arrays. One for each additional input array.
 
-
-
     pv (dict): Dictionary to store the processed values.
 
+    Events without times have no windows: their outputs are empty lists.
+
     """
 
     required_input = ["t_all", "t"]
@@ -175,12 +204,18 @@ def m_window(para, input, output, pv):
             raise ValueError(text)
 
     t_sub = subtract_smallest_time(pv[input["t"]], pv[input["t_all"]])
+    if t_sub.ndim > 1:
+        # Events without times have no smallest time, their times are an empty list and the
+        # option type is removed
+        t_sub = ak.fill_none(t_sub, [], axis=0)
     w_t = define_windows(t_sub, para["dT"])
     map = generate_map(t_sub, w_t)
 
-    pv[output["t_sub"]] = ak.Array(generate_windowed_hits(map, t_sub))
-    pv[output["w_t"]] = ak.Array(w_t)
+    hits = {key: pv[input[key]] for key in input if key in output}
+    windowed = group_by_window(map, {**hits, "t_sub": t_sub})
+    pv[output["t_sub"]] = windowed.pop("t_sub")
+    # The windows are built from Python and numba lists, cast back to the input dtypes
+    pv[output["w_t"]] = restore_dtype(ak.Array(w_t), t_sub)
 
-    for key in input:
-        if key in output:
-            pv[output[key]] = ak.Array(generate_windowed_hits(map, pv[input[key]]))
+    for key in hits:
+        pv[output[key]] = windowed[key]
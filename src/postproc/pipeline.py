@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import numpy as np
+from module_manager import module_manager
+from modules.compact import ENTRY_KEY, FILE_KEY, VARIABLES_KEY
+from modules.misc import narrow_variables, share_offsets
+from tqdm import tqdm
+
+
+class pipeline:
+    """
+    Runs the instructions of a config on awkward arrays in memory, without input or output files,
+    e.g. for online monitoring.
+
+    The pipeline is built once: the instructions are checked and the modules resolved by a
+    module_manager (and with an example batch, run once so their numba kernels are compiled).
+    Each call then only runs the modules on the given batch.
+
+        p = pipeline(inst)
+        processing_variables = p({"edep": edep, "vol": vol, ...})
+
+    Parameters:
+    inst (dict): Config with the keys instr and optionally para (merged into the parameters of
+        every module, as in a file based run), dtype and input. io and output are not used.
+        With para share_offsets, inputs with the same jagged structure share their offsets.
+    inputs (list): Names of the variables passed to each call. Defaults to the keys of
+        inst["input"]["var"]. If given, the instructions are checked to only use variables that
+        are passed or computed by a previous module.
+    example (dict): Optional batch run once at construction.
+    """
+
+    def __init__(self, inst, inputs=None, example=None):
+        self.dtypes = inst.get("dtype", {})
+        self.share_offsets = inst.get("para", {}).get("share_offsets", False)
+        if inputs is None and "input" in inst:
+            inputs = list(inst["input"]["var"])
+        self.inputs = inputs
+        self.module_manager = module_manager(
+            {"instr": inst["instr"], "para": inst.get("para", {})}
+        )
+        # Modules report their progress to a bar, which is not shown
+        self._pbar = tqdm(disable=True)
+        if inputs is not None:
+            self.check_variables(inputs)
+
+        if example is not None:
+            self(example)
+
+    def check_variables(self, inputs):
+        """
+        Check that every module only reads variables passed to the pipeline or computed by a
+        previous module.
+
+        Raises:
+        ValueError: Naming the first module reading an unknown variable.
+        """
+        available = {*inputs, ENTRY_KEY, FILE_KEY, VARIABLES_KEY}
+        for proc in self.module_manager.module_list:
+            missing = [value for value in proc.input.values() if value not in available]
+            if missing:
+                text = f"Module {proc.name} reads {missing}, which are neither inputs nor outputs of a previous module."
+                raise ValueError(text)
+            available.update(proc.output.values())
+
+    def __call__(self, variables, entry_start=0, file=""):
+        """
+        Run the modules on a batch.
+
+        Parameters:
+        variables (dict): The input arrays by name. The dict is not modified.
+        entry_start (int): Entry number of the first event of the batch.
+        file (str): Name of the file the batch was read from, e.g. for the random streams of smear.
+
+        Returns:
+        dict: The processing variables after the last module.
+        """
+        processing_variables = narrow_variables(dict(variables), variables, self.dtypes)
+        if self.share_offsets:
+            processing_variables = share_offsets(processing_variables)
+        n_entries = len(next(iter(variables.values()))) if variables else 0
+        processing_variables[ENTRY_KEY] = np.arange(
+            entry_start, entry_start + n_entries
+        )
+        processing_variables[FILE_KEY] = file
+        processing_variables[VARIABLES_KEY] = tuple(variables)
+        self.module_manager.run(processing_variables, self._pbar, 0)
+        return processing_variables
@@ -1,14 +1,30 @@
 from __future__ import annotations
 
 import argparse
+from pathlib import Path
 
 import process_manager
-from misc import load_inst
+from misc import load_inst, merge_insts
+from watcher import folder_watcher
 
 
-def main(infile, overwrite):
-    inst = load_inst(infile)
-    pm = process_manager.process_manager(inst, overwrite=overwrite)
+def main(infiles, overwrite, watch=False, retry_failed=False):
+    if isinstance(infiles, (str, Path)):
+        infiles = [infiles]
+    if len(infiles) == 1:
+        inst = load_inst(infiles[0])
+    else:
+        # Several configs over the same input are run as pipelines of one read pass
+        inst = merge_insts(
+            [load_inst(infile) for infile in infiles],
+            [Path(infile).stem for infile in infiles],
+        )
+    if watch:
+        folder_watcher(inst, overwrite=overwrite).run()
+        return
+    pm = process_manager.process_manager(
+        inst, overwrite=overwrite, retry_failed=retry_failed
+    )
     pm.run_processes()
 
 
@@ -16,11 +32,25 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog="post_proc", description="A generic post processor for Geant4 simulation"
     )
-    parser.add_argument("input_file")
+    parser.add_argument(
+        "input_files",
+        nargs="+",
+        help="Instruction file(s). Several files reading the same input share one read pass.",
+    )
     parser.add_argument(
         "--overwrite",
         action="store_true",
         help="Overwrite existing output files",
     )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and process input files as they are completed",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Only process the input files that failed in a previous run (requires para manifest)",
+    )
     args = parser.parse_args()
-    main(args.input_file, args.overwrite)
+    main(args.input_files, args.overwrite, args.watch, args.retry_failed)
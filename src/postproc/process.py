@@ -1,20 +1,146 @@
 from __future__ import annotations
 
+import sys
+import time
+from pathlib import Path
+
 import uproot
 from data_manager import data_manager
+from misc import pipelines
 from module_manager import module_manager
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
-def run_post_proc(args):
+
+def reset_peak_memory():
+    """
+    Reset the peak resident memory of the current process, so peak_memory measures the work
+    done after. Only possible on Linux.
+
+    Returns:
+    bool: True if the peak was reset.
+    """
     try:
-        infile = args[0]
-        outfile = args[1]
-        inst = args[2]
-        task_id = args[3]
-
-        pm = module_manager(inst)
-        dm = data_manager(inst, infile, outfile, pm, task_id)
-        dm.process_data()
-        dm.write_output()
-    except uproot.exceptions.KeyInFileError:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_memory():
+    """
+    Peak resident memory of the current process in bytes (since the last reset_peak_memory on
+    Linux), or None if it cannot be determined.
+    """
+    try:
+        with Path.open(Path("/proc/self/status")) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
         pass
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def process_file(infile, outfiles, inst, task_id, progress_queue=None):
+    """
+    Process one input file and write (or share) the output of each pipeline.
+
+    Returns:
+    dict: The task result with entries, bytes, duration and peak memory, and the shared output
+        descriptors if there are no output files. None if the tree is not in the file.
+    """
+    try:
+        start = time.time()
+        # A worker processes several files (coalesced tasks or threads=1), so the peak of the
+        # process is reset per file. Where it cannot be, the peak is only attributed to this
+        # file if it was reached while processing it.
+        previous_peak = None if reset_peak_memory() else peak_memory()
+        pms = [module_manager(pipeline) for pipeline in pipelines(inst)]
+        dm = data_manager(inst, infile, outfiles, pms, task_id, progress_queue)
+        try:
+            n_entries = dm.num_entries()
+            dm.process_data()
+            # Without output files the outputs are handed to the parent in shared memory
+            shared_output = None
+            if outfiles[0] is None:
+                shared_output = dm.share_output()
+            else:
+                dm.write_output()
+        except BaseException:
+            dm.abort()
+            raise
+        peak = peak_memory()
+        if peak is not None and previous_peak is not None and peak <= previous_peak:
+            peak = None
+        result = {
+            "infile": str(infile),
+            "entries": n_entries,
+            "bytes": Path(infile).stat().st_size,
+            "duration": time.time() - start,
+            "peak_memory": peak,
+        }
+        if shared_output is not None:
+            result["output"] = shared_output
+        return result
+    except uproot.exceptions.KeyInFileError:
+        return None
+
+
+def run_post_proc(args):
+    infile = args[0]
+    outfiles = args[1]
+    inst = args[2]
+    task_id = args[3]
+    progress_queue = args[4] if len(args) > 4 else None
+    return process_file(infile, outfiles, inst, task_id, progress_queue)
+
+
+class task_error(Exception):
+    """
+    Raised by run_post_proc_group if a file of a task fails. Carries the results of the files
+    processed before it, so the parent knows which file failed and which are complete.
+    """
+
+    def __init__(self, results, message, memory_error=False):
+        super().__init__(results, message, memory_error)
+        self.results = results
+        self.message = message
+        self.memory_error = memory_error
+
+    def __str__(self):
+        return self.message
+
+
+def run_post_proc_group(args):
+    """
+    Process several input files in one task, one after the other, so small files share the
+    start-up of the worker (imports and compiled kernels). Each file keeps its own outputs.
+
+    Returns:
+    list of dict: The result of each file.
+
+    Raises:
+    task_error: If a file fails, the files after it are not processed.
+    """
+    infiles = args[0]
+    outfiles = args[1]
+    inst = args[2]
+    task_id = args[3]
+    progress_queue = args[4] if len(args) > 4 else None
+    results = []
+    for infile, files in zip(infiles, outfiles):
+        try:
+            results.append(process_file(infile, files, inst, task_id, progress_queue))
+        except Exception as e:
+            raise task_error(
+                results, f"{infile}: {e}", isinstance(e, MemoryError)
+            ) from e
+    return results
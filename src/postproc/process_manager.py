@@ -1,15 +1,27 @@
 from __future__ import annotations
 
+import gc
 import logging
-import os
+import multiprocessing
+import queue
+import shutil
 import tempfile
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
 import awkward as ak
 import h5py
-import numpy as np
-from process import run_post_proc
+import scheduler
+import transfer
+from data_manager import read_hdf5
+from manifest import run_manifest
+from misc import config_hash, format_size, pipelines
+from modules.misc import compact_layout
+from process import run_post_proc_group, task_error
+from shards import shard_writer
+from telemetry import progress_monitor
 
 # Configure logging
 logging.basicConfig(
@@ -20,103 +32,576 @@ logging.basicConfig(
 
 
 class process_manager:
-    def __init__(self, inst, overwrite=False):
+    def __init__(self, inst, overwrite=False, retry_failed=False):
         self.in_folder = inst["io"]["input"]["folder"]
         self.in_format = inst["io"]["input"]["format"]
-        self.out = inst["io"]["output"]
+        # Every pipeline writes its own output, all are fed by one read pass over the input
+        self.pipelines = pipelines(inst)
+        self.outs = [pipeline["output_path"] for pipeline in self.pipelines]
+        if len(self.pipelines) > 1 and inst["para"].get("module_threads", 1) > 1:
+            logging.warning(
+                "module_threads is ignored with several pipelines, their modules run one "
+                "after the other."
+            )
+        self.out = self.outs[0]
         self.overwrite = overwrite
         self.threads = inst["para"]["threads"]
         self.mode = inst["para"].get("mode", "individual")
+        self.progress = inst["para"].get("progress", "aggregate")
+        self.telemetry = inst["para"].get("telemetry", {})
+        self.transfer = inst["para"].get("transfer", "file")
+        self.retry_failed = retry_failed
 
-        # Get input files and corresponding output files
+        # Get input files and the corresponding output files of each pipeline
         self.input_files = list(Path(self.in_folder).glob("*." + self.in_format))
         if self.mode != "summarize":
             self.output_files = [
-                Path(self.out).joinpath(infile.stem + ".hdf5")
+                [Path(out).joinpath(infile.stem + ".hdf5") for out in self.outs]
                 for infile in self.input_files
             ]
+        elif self.transfer == "shared_memory":
+            # The tasks hand their outputs to the parent in shared memory blocks
+            self.output_files = [[None] * len(self.outs) for _ in self.input_files]
+            if inst["para"].get("checkpoint", False):
+                logging.warning(
+                    "Checkpoints are not written with transfer shared_memory, interrupted "
+                    "files are processed again. Use transfer file to resume them."
+                )
         else:
-            self.tmp_dir = tempfile.mkdtemp()
+            if inst["para"].get("checkpoint", False):
+                # Keep the task outputs next to the outputs, so an interrupted run can be resumed
+                self.tmp_dirs = [
+                    Path(out).with_name(Path(out).name + ".tasks") for out in self.outs
+                ]
+                for tmp_dir in self.tmp_dirs:
+                    tmp_dir.mkdir(parents=True, exist_ok=True)
+            else:
+                self.tmp_dirs = [tempfile.mkdtemp() for _ in self.outs]
             self.output_files = [
-                Path(self.tmp_dir).joinpath(infile.stem + ".hdf5")
+                [
+                    Path(tmp_dir).joinpath(infile.stem + ".hdf5")
+                    for tmp_dir in self.tmp_dirs
+                ]
                 for infile in self.input_files
             ]
             # self.output_files = self.out
+        # summarize reads the outputs of all tasks, including those of a previous run
+        self.task_files = list(self.output_files)
+        self.task_inputs = list(self.input_files)
 
-        # Filter out files that already exist if overwrite is False
-        if not self.overwrite:
-            mask_doesnt_exist = np.array(
-                [not Path.exists(f) for f in self.output_files]
+        # The state of the input files across runs
+        self.manifest = None
+        if inst["para"].get("manifest", False):
+            self.manifest = run_manifest(
+                self.manifest_path(inst["para"]["manifest"]),
+                config_hash(inst),
             )
-            self.input_files = np.array(self.input_files)[mask_doesnt_exist].tolist()
-            self.output_files = np.array(self.output_files)[mask_doesnt_exist].tolist()
 
-        # Create a list of arguments: each is a tuple (input_file, output_file, inst)
-        self.args = list(
-            zip(
+        # Filter out files whose outputs already exist if overwrite is False. With a manifest,
+        # the file must also have been completed with the same config.
+        if not self.overwrite:
+            mask_doesnt_exist = [
+                not all(f is not None and Path.exists(f) for f in files)
+                or (self.manifest is not None and not self.manifest.completed(infile))
+                for infile, files in zip(self.input_files, self.output_files)
+            ]
+            self.input_files = [
+                f for f, keep in zip(self.input_files, mask_doesnt_exist) if keep
+            ]
+            self.output_files = [
+                f for f, keep in zip(self.output_files, mask_doesnt_exist) if keep
+            ]
+
+        if self.retry_failed:
+            if self.manifest is None:
+                text = "Retrying failed files requires para manifest."
+                raise ValueError(text)
+            keep = [self.manifest.failed(infile) for infile in self.input_files]
+            self.input_files = [f for f, k in zip(self.input_files, keep) if k]
+            self.output_files = [f for f, k in zip(self.output_files, keep) if k]
+
+        # Spread the available threads over the batches of each file if there are
+        # fewer files than threads
+        if inst["para"].get("batch_threads", 1) == "auto":
+            inst = {
+                **inst,
+                "para": {
+                    **inst["para"],
+                    "batch_threads": max(
+                        1, self.threads // max(1, len(self.input_files))
+                    ),
+                },
+            }
+        self.batch_threads = inst["para"].get("batch_threads", 1)
+        self.inst = inst
+
+        self.schedule = inst["para"].get("schedule", "longest_first")
+        self.coalesce = inst["para"].get("coalesce")
+        self.memory_budget = scheduler.memory_budget(inst["para"])
+        self.oom_retries = inst["para"].get("oom_retries", 2)
+        # Tasks running when the pool broke, run alone until the killed one is known
+        self.suspects = set()
+        # Estimated peak memory per task id and the correction learned from finished tasks
+        self.task_memory = {}
+        self.memory_scale = None
+        if "timings" in inst["para"]:
+            self.timings_file = Path(inst["para"]["timings"])
+        elif self.mode != "summarize":
+            self.timings_file = Path(self.out).joinpath("postproc_timings.json")
+        else:
+            self.timings_file = Path(self.out).with_suffix(".timings.json")
+        self.results = []
+
+        self.log_initialization()
+        self.plan_tasks()
+
+    def plan_tasks(self):
+        """
+        Order the tasks longest-first according to the cost model (unless the schedule
+        is "glob"), group small files into shared tasks if coalesce is given and create the
+        list of arguments: each is a tuple (input_files, output_files, inst, task_id) with
+        one list of output files (one per pipeline) per input file.
+        """
+        order = list(range(len(self.input_files)))
+        self.costs = None
+        if self.schedule != "glob" and self.input_files:
+            order, self.costs = scheduler.plan(
                 self.input_files,
-                self.output_files,
-                [inst] * len(self.input_files),
-                np.arange(len(self.input_files)),
+                self.inst,
+                self.threads,
+                self.history(),
             )
-        )
 
-        self.log_initialization()
+        if (
+            self.costs is None
+            and self.input_files
+            and (self.coalesce is not None or self.memory_budget is not None)
+        ):
+            self.costs = scheduler.estimate_costs(self.input_files, self.inst)
+
+        if self.coalesce is not None and self.input_files:
+            groups = scheduler.coalesce(self.costs, order, self.coalesce)
+            logging.info(
+                "Coalesced %d files into %d tasks", len(self.input_files), len(groups)
+            )
+        else:
+            groups = [[i] for i in order]
+
+        self.args = [
+            (
+                [self.input_files[i] for i in group],
+                [self.output_files[i] for i in group],
+                self.inst,
+                task_id,
+            )
+            for task_id, group in enumerate(groups)
+        ]
+        # Entries of the files for the ETA of the progress display
+        self.planned_entries = {}
+        if self.costs is not None:
+            self.planned_entries = {
+                str(infile): cost["entries"]
+                for infile, cost in zip(self.input_files, self.costs)
+            }
+            # The files of a task are processed one after the other
+            self.task_memory = {
+                task_id: max(self.costs[i]["memory"] for i in group)
+                for task_id, group in enumerate(groups)
+            }
+        self.input_files = [self.input_files[i] for i in order]
+        self.output_files = [self.output_files[i] for i in order]
+
+    def manifest_path(self, path):
+        """
+        Returns the manifest file: the given path, or by default a file in the output directory
+        (next to the output file in summarize mode).
+        """
+        if isinstance(path, (str, Path)):
+            return Path(path)
+        if self.mode != "summarize":
+            return Path(self.out).joinpath("postproc_manifest.sqlite")
+        return Path(self.out).with_suffix(".manifest.sqlite")
+
+    def history(self):
+        """
+        Timings of previous runs for the scheduler. Those recorded in the manifest take
+        precedence over the timings file.
+        """
+        history = scheduler.load_timings(self.timings_file)
+        if self.manifest is not None:
+            history.update(self.manifest.history())
+        return history
+
+    def _start(self, arg):
+        if self.manifest is not None:
+            self.manifest.start(arg[0])
+
+    def _finish(self, arg, results):
+        if self.manifest is not None:
+            for infile, result in zip(arg[0], results):
+                self.manifest.finish(infile, result)
+
+    def _fail(self, arg, error):
+        if self.manifest is not None:
+            for infile in arg[0]:
+                self.manifest.fail(infile, error)
+
+    @staticmethod
+    def _remaining(arg, start, stop=None):
+        """
+        Returns the task restricted to its files start:stop.
+        """
+        return (arg[0][start:stop], arg[1][start:stop], *arg[2:])
 
     def log_initialization(self):
         logging.info("Process manager initialized with the following parameters:")
         logging.info("Input folder: %s", self.in_folder)
         logging.info("Input format: %s", self.in_format)
-        logging.info("Output folder: %s", self.out)
+        for pipeline, out in zip(self.pipelines, self.outs):
+            if pipeline["name"] is None:
+                logging.info("Output folder: %s", out)
+            else:
+                logging.info("Output folder of %s: %s", pipeline["name"], out)
         logging.info("Overwrite: %s", self.overwrite)
         logging.info("Threads: %s", self.threads)
+        logging.info("Batch threads per file: %s", self.batch_threads)
         logging.info("Mode: %s", self.mode)
+        if self.mode == "summarize":
+            logging.info("Transfer: %s", self.transfer)
+            if "shards" in self.inst["para"]:
+                logging.info("Shards: %s", self.inst["para"]["shards"])
+        logging.info("Schedule: %s", self.schedule)
+        if self.memory_budget is not None:
+            logging.info("Memory budget: %s", format_size(self.memory_budget))
+        logging.info("Progress display: %s", self.progress)
+        if self.manifest is not None:
+            logging.info("Manifest: %s", self.manifest.path)
         logging.info("Number of input files found: %d", len(self.input_files))
 
+    def _file_parts(self, index):
+        """
+        Read back the output of each task for pipeline index from its temporary file.
+
+        Returns:
+        list of tuple: The input file, output array and histograms of each task.
+        """
+        return [
+            (infile, *read_hdf5(files[index]))
+            for infile, files in zip(self.task_inputs, self.task_files)
+            if Path(files[index]).exists()
+        ]
+
+    def _shared_parts(self, index):
+        """
+        Attach to the shared memory blocks for pipeline index the tasks handed over in their
+        results, in the order of the input files (as the file parts), not of their completion.
+        """
+        order = {str(infile): i for i, infile in enumerate(self.task_inputs)}
+        results = sorted(
+            (r for r in self.results if r is not None and "output" in r),
+            key=lambda r: order[r["infile"]],
+        )
+        parts, blocks = [], []
+        for result in results:
+            descriptor = result["output"][index]
+            shm, array = transfer.open_shared_output(descriptor)
+            if shm is not None:
+                blocks.append(shm)
+            parts.append((result["infile"], array, descriptor["histograms"]))
+        return parts, blocks
+
     def summarize(self):
-        def gen_files():
-            for file in self.output_files:
-                with h5py.File(file, "r") as f:
-                    group = f["awkward"]
-                    reconstituted = ak.from_buffers(
-                        ak.forms.from_json(group.attrs["form"]),
-                        group.attrs["length"],
-                        {k: np.asarray(v) for k, v in group.items()},
-                    )
-                    yield ak.Array(reconstituted)
+        for index, out in enumerate(self.outs):
+            self._summarize(index, out)
+
+    def _summarize(self, index, out):
+        if self.transfer == "shared_memory":
+            parts, blocks = self._shared_parts(index)
+        else:
+            parts, blocks = self._file_parts(index), []
+
+        arrays = [array for _, array, _ in parts if array is not None]
+        # Partial histograms of the files are merged by adding them
+        histograms = {}
+        for _, _, hists in parts:
+            for key, hist in hists.items():
+                histograms[key] = histograms[key] + hist if key in histograms else hist
 
-        with h5py.File(self.out, "w") as f:
-            group = f.create_group("awkward")
-            form, length, container = ak.to_buffers(
-                ak.to_packed(ak.concatenate(ak.from_iter(gen_files()))), container=group
+        shards = self.inst["para"].get("shards")
+        if shards is not None and arrays:
+            # The events go to the shards, the output file only keeps the histograms
+            writer = shard_writer(
+                out,
+                shards["size"],
+                shards.get("index", []),
+                self.inst["para"].get("compact_layouts", False),
             )
-            group.attrs["form"] = form.to_json()
-            group.attrs["length"] = length
+            for infile, array, _ in parts:
+                if array is not None:
+                    writer.add(infile, array)
+            index_file = writer.close()
+            logging.info(
+                "Wrote %d events in %d shards, index %s",
+                writer.length,
+                len(writer.shards),
+                index_file,
+            )
+            arrays = []
+
+        with h5py.File(out, "w") as f:
+            if arrays:
+                group = f.create_group("awkward")
+                form, length, container = ak.to_buffers(
+                    compact_layout(
+                        ak.concatenate(arrays),
+                        narrow=self.inst["para"].get("compact_layouts", False),
+                    ),
+                    container=group,
+                )
+                group.attrs["form"] = form.to_json()
+                group.attrs["length"] = length
+            for key, hist in histograms.items():
+                hist.write(f.create_group(f"histograms/{key}"))
 
-        os.system(f"rm -rf {self.tmp_dir}")
+        # The arrays of the shared parts are views of the blocks
+        del parts, arrays
+        gc.collect()
+        for shm in blocks:
+            transfer.release_shared_output(shm)
+        if self.transfer != "shared_memory":
+            shutil.rmtree(self.tmp_dirs[index], ignore_errors=True)
 
     def run_processes(self):
+        if self.progress == "per_task":
+            self._run_processes(self.args)
+        else:
+            # Workers push their progress events to one aggregate display
+            if self.threads > 1:
+                manager = multiprocessing.Manager()
+                progress_queue = manager.Queue()
+            else:
+                manager = None
+                progress_queue = queue.Queue()
+            args = [(*arg, progress_queue) for arg in self.args]
+            try:
+                with progress_monitor(
+                    progress_queue,
+                    len(self.input_files),
+                    self.telemetry,
+                    self.planned_entries,
+                ):
+                    self._run_processes(args)
+            finally:
+                if manager is not None:
+                    manager.shutdown()
+
+        try:
+            if self.mode == "summarize":
+                self.summarize()
+        finally:
+            if self.manifest is not None:
+                self.manifest.close()
+
+    def _run_processes(self, args):
         if self.threads > 1:
             logging.debug(
                 "Running with multiprocessing. Number of threads: %d", self.threads
             )
-            # Use multiprocessing to run run_post_proc with the arguments
-            with ProcessPoolExecutor(
-                max_workers=self.threads, max_tasks_per_child=1
-            ) as executor:
-                # Unpack the arguments using *args
-                futures = [executor.submit(run_post_proc, arg) for arg in self.args]
-                # iterate over all submitted tasks and get results as they are available
-                for future in as_completed(futures):
-                    try:
-                        result = future.result()  # blocks
-                        logging.debug("Process completed with result: %s", result)
-                    except Exception as e:
-                        logging.error("Process raised an exception: %s", e)
+            self._run_pool(args)
 
         else:
-            for i in range(len(self.args)):
-                run_post_proc(self.args[i])
+            for arg in args:
+                self._start(arg)
+                try:
+                    results = run_post_proc_group(arg)
+                except task_error as e:
+                    self._finish(arg, e.results)
+                    self.results.extend(e.results)
+                    done = len(e.results)
+                    self._fail(self._remaining(arg, done, done + 1), e)
+                    raise e.__cause__ from None
+                self._finish(arg, results)
+                self.results.extend(results)
 
-        if self.mode == "summarize":
-            self.summarize()
+        if any(result is not None for result in self.results):
+            scheduler.record_timings(self.timings_file, self.results)
+
+    def _run_pool(self, args):
+        """
+        Run the tasks on a process pool. A task is only admitted while the estimated memory of
+        the running tasks stays within the memory budget (at least one task always runs).
+        The estimates are scaled by the largest ratio of observed to estimated peak memory of
+        the finished tasks.
+
+        Tasks whose worker was killed (e.g. by the OOM killer) or that raised a MemoryError are
+        retried up to oom_retries times with half the step size. A killed worker breaks the
+        pool (noticed when collecting a task or when submitting the next one), and all tasks
+        running at that moment are lost. If only one task was running it was killed; otherwise
+        the tasks are run again unchanged, one at a time, until the killed one is known (see
+        _recover).
+        """
+        waiting = deque((arg, 0) for arg in args)
+        running = {}
+        executor = ProcessPoolExecutor(max_workers=self.threads, max_tasks_per_child=1)
+        try:
+            while waiting or running:
+                broken = self._submit(
+                    executor, self._admit(waiting, running), running, waiting
+                )
+                lost = []
+                if not broken:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        item = running.pop(future)
+                        if self._collect(future, item, waiting):
+                            lost.append(item)
+                if broken or lost:
+                    # The other tasks of the pool are lost as well
+                    for future in wait(running).done:
+                        item = running.pop(future)
+                        if self._collect(future, item, waiting):
+                            lost.append(item)
+                    self._recover(lost, waiting)
+                    executor.shutdown(wait=True)
+                    executor = ProcessPoolExecutor(
+                        max_workers=self.threads, max_tasks_per_child=1
+                    )
+        finally:
+            executor.shutdown(wait=True)
+
+    def _submit(self, executor, admitted, running, waiting):
+        """
+        Submit the admitted tasks. If the pool broke since the last collection, the tasks not
+        submitted are queued again in front of the waiting ones.
+
+        Returns:
+        bool: True if the pool is broken.
+        """
+        for i, item in enumerate(admitted):
+            try:
+                future = executor.submit(run_post_proc_group, item[0])
+            except BrokenProcessPool:
+                waiting.extendleft(reversed(admitted[i:]))
+                return True
+            self._start(item[0])
+            running[future] = item
+        return False
+
+    def _recover(self, lost, waiting):
+        """
+        Queue the tasks lost with a broken pool again. A task that was running alone was killed
+        and is retried with a smaller step size. Otherwise the killed task is not known: the
+        tasks are queued unchanged, without using up a retry, and run alone (see _admit).
+        """
+        if len(lost) == 1:
+            arg, retries = lost[0]
+            self.suspects.discard(arg[3])
+            self._retry(arg, retries, BrokenProcessPool("worker killed"), waiting)
+            return
+        for arg, retries in reversed(lost):
+            self.suspects.add(arg[3])
+            waiting.appendleft((arg, retries))
+
+    def _retry(self, arg, retries, error, waiting):
+        """
+        Queue a task that was killed or ran out of memory again with half the step size, or fail
+        it if it has no retries left.
+        """
+        para = arg[2]["para"]
+        if retries >= self.oom_retries:
+            logging.error("Task %d failed after %d retries: %s", arg[3], retries, error)
+            self._fail(arg, error)
+            return
+        step_size = scheduler.reduce_step_size(para["step_size"])
+        logging.warning(
+            "Task %d was killed or ran out of memory, retrying with step_size %s",
+            arg[3],
+            step_size,
+        )
+        inst = {**arg[2], "para": {**para, "step_size": step_size}}
+        waiting.appendleft(((arg[0], arg[1], inst, *arg[3:]), retries + 1))
+
+    def _task_memory(self, arg):
+        scale = 1.0 if self.memory_scale is None else self.memory_scale
+        return self.task_memory.get(arg[3], 0) * scale
+
+    def _admit(self, waiting, running):
+        """
+        Remove and return the waiting tasks that fit into the free workers and memory budget.
+        Tasks that may have broken the pool (self.suspects) only run alone, and the tasks
+        queued behind them wait.
+        """
+        admitted = []
+        if any(arg[3] in self.suspects for arg, _ in running.values()):
+            return admitted
+        used = sum(self._task_memory(arg) for arg, _ in running.values())
+        for item in list(waiting):
+            if len(running) + len(admitted) >= self.threads:
+                break
+            if item[0][3] in self.suspects:
+                if not (running or admitted):
+                    waiting.remove(item)
+                    admitted.append(item)
+                break
+            memory = self._task_memory(item[0])
+            if (
+                self.memory_budget is None
+                or used + memory <= self.memory_budget
+                or not (running or admitted)
+            ):
+                waiting.remove(item)
+                admitted.append(item)
+                used += memory
+        return admitted
+
+    def _collect(self, future, item, waiting):
+        """
+        Store the results of a finished task, or queue it again if it ran out of memory.
+
+        If a file of a task fails, the results of the files before it are kept. A file that ran
+        out of memory is retried with the rest of the task. After any other error only that file
+        is failed and the files after it are queued again.
+
+        Returns:
+        bool: True if the pool is broken. The task is lost and left to _recover.
+        """
+        arg, retries = item
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            return True
+        except MemoryError as e:
+            self.suspects.discard(arg[3])
+            self._retry(arg, retries, e, waiting)
+            return False
+        except task_error as e:
+            self.suspects.discard(arg[3])
+            self._finish(arg, e.results)
+            self.results.extend(e.results)
+            rest = self._remaining(arg, len(e.results))
+            if e.memory_error:
+                self._retry(rest, retries, e, waiting)
+                return False
+            logging.error("Process raised an exception: %s", e)
+            self._fail(self._remaining(rest, 0, 1), e)
+            if len(rest[0]) > 1:
+                waiting.appendleft((self._remaining(rest, 1), retries))
+            return False
+        except Exception as e:
+            logging.error("Process raised an exception: %s", e)
+            self.suspects.discard(arg[3])
+            self._fail(arg, e)
+            return False
+
+        self.suspects.discard(arg[3])
+        logging.debug("Process completed with result: %s", result)
+        self._finish(arg, result)
+        self.results.extend(result)
+        peaks = [r["peak_memory"] for r in result if r and r.get("peak_memory")]
+        estimate = self.task_memory.get(arg[3])
+        if peaks and estimate:
+            ratio = max(peaks) / estimate
+            self.memory_scale = (
+                ratio if self.memory_scale is None else max(self.memory_scale, ratio)
+            )
+        return False
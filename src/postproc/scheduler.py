@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import heapq
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import uproot
+from misc import format_size, parse_size
+
+# Rough factor between the step size read from disk and the resident memory of a
+# task (decompressed arrays plus the copies made by the modules).
+MEMORY_PER_STEP_FACTOR = 4
+BASE_TASK_MEMORY = 300 * 1000**2
+
+
+def load_timings(path):
+    """
+    Load the timings recorded in previous runs. Returns an empty history if the file does not exist.
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with Path.open(path) as f:
+        return json.load(f)
+
+
+def record_timings(path, results):
+    """
+    Add the per task results of this run (entries, bytes, duration, peak memory) to the history file.
+    """
+    history = load_timings(path)
+    for result in results:
+        if result is None:
+            continue
+        history[str(result["infile"])] = {
+            key: result[key]
+            for key in ["entries", "bytes", "duration", "peak_memory"]
+            if result.get(key) is not None
+        }
+    tmp_path = Path(path).with_name(Path(path).name + ".tmp")
+    with Path.open(tmp_path, "w") as f:
+        json.dump(history, f, indent=1)
+    tmp_path.replace(path)
+
+
+def count_entries(infile, inst):
+    if inst["io"]["input"]["format"] != "root":
+        return None
+    try:
+        with uproot.open(infile) as f:
+            return int(f[inst["input"]["tree"]].num_entries)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def estimate_costs(input_files, inst, history=None):
+    """
+    Estimate the cost of processing each input file.
+
+    The cost is the entry count (cost_model "entries", default) or the file size (cost_model "size").
+    Counting the entries opens every file. Entry counts recorded by previous runs for a file of the
+    same size are used instead, and cost_model "size" never opens the files. If previous runs recorded timings, the duration and peak memory of each task are predicted from
+    the recorded duration of the same file or from the median processing rate of all recorded files.
+
+    Returns:
+    list of dict: One dict per input file with the keys entries, bytes, cost, duration and memory.
+    duration is None if no timings are available.
+    """
+    history = history or {}
+    cost_model = inst["para"].get("cost_model", "entries")
+
+    seconds_per_entry = [
+        h["duration"] / h["entries"]
+        for h in history.values()
+        if h.get("entries") and h.get("duration") is not None
+    ]
+    seconds_per_byte = [
+        h["duration"] / h["bytes"]
+        for h in history.values()
+        if h.get("bytes") and h.get("duration") is not None
+    ]
+    peak_memory = [h["peak_memory"] for h in history.values() if h.get("peak_memory")]
+
+    step_size = inst["para"].get("step_size", "100 MB")
+    costs = []
+    for infile in input_files:
+        n_bytes = Path(infile).stat().st_size
+        known = history.get(str(infile), {})
+        if known.get("entries") is not None and known.get("bytes") == n_bytes:
+            entries = known["entries"]
+        elif cost_model == "entries":
+            entries = count_entries(infile, inst)
+        else:
+            entries = None
+
+        if known.get("duration") is not None:
+            duration = known["duration"]
+        elif entries is not None and seconds_per_entry:
+            duration = entries * float(np.median(seconds_per_entry))
+        elif seconds_per_byte:
+            duration = n_bytes * float(np.median(seconds_per_byte))
+        else:
+            duration = None
+
+        if known.get("peak_memory"):
+            memory = known["peak_memory"]
+        elif peak_memory:
+            memory = float(np.median(peak_memory))
+        elif isinstance(step_size, str):
+            memory = BASE_TASK_MEMORY + MEMORY_PER_STEP_FACTOR * parse_size(step_size)
+        else:
+            bytes_per_entry = n_bytes / entries if entries else 0
+            memory = (
+                BASE_TASK_MEMORY + MEMORY_PER_STEP_FACTOR * step_size * bytes_per_entry
+            )
+
+        costs.append(
+            {
+                "entries": entries,
+                "bytes": n_bytes,
+                "cost": duration
+                if duration is not None
+                else (
+                    entries
+                    if entries is not None and cost_model == "entries"
+                    else n_bytes
+                ),
+                "duration": duration,
+                "memory": memory,
+            }
+        )
+    return costs
+
+
+def longest_first(costs):
+    """
+    Returns the task indices ordered by decreasing cost.
+    """
+    return sorted(range(len(costs)), key=lambda i: costs[i]["cost"], reverse=True)
+
+
+def memory_budget(para):
+    """
+    Memory available to the tasks of a run in bytes: para["memory_budget"] (a number or a string
+    like "64 GB") or the physical memory of the node. None if it cannot be determined.
+    """
+    if "memory_budget" in para:
+        return parse_size(para["memory_budget"])
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def reduce_step_size(step_size):
+    """
+    Returns half the step size, for retrying a task that ran out of memory. Sizes given as
+    memory ("100 MB") stay memory sizes.
+    """
+    if isinstance(step_size, str):
+        return f"{max(1, parse_size(step_size) // 2000)} kB"
+    return max(1, int(step_size) // 2)
+
+
+def coalesce(costs, order, target):
+    """
+    Group small input files into tasks of up to a target size, so the start-up of a task
+    (process spawn, imports and compiled kernels) is shared by several files.
+
+    Parameters:
+    costs (list of dict): Cost estimates of the input files (see estimate_costs).
+    order (list of int): Order of the input files, e.g. longest-first.
+    target (dict): {"entries": n} or {"bytes": size} with size a number or a string like "100 MB".
+        Files of at least this size form a task on their own, as do files without an entry
+        count (hdf5 input or cost_model "size") when coalescing by entries.
+
+    Returns:
+    list of list of int: The input file indices of each task, in order.
+    """
+    if "entries" in target:
+        key, limit = "entries", target["entries"]
+    elif "bytes" in target:
+        key, limit = "bytes", parse_size(target["bytes"])
+    else:
+        text = (
+            f"Cannot coalesce files by {list(target)}, expected 'entries' or 'bytes'."
+        )
+        raise ValueError(text)
+
+    groups = []
+    current, size = [], 0
+    for i in order:
+        n = costs[i][key]
+        if n is None or n >= limit:
+            groups.append([i])
+            continue
+        if current and size + n > limit:
+            groups.append(current)
+            current, size = [], 0
+        current.append(i)
+        size += n
+    if current:
+        groups.append(current)
+    return groups
+
+
+def predict_makespan(durations, threads):
+    """
+    Simulate greedy scheduling of the durations (in submission order) on the given number of workers
+    and return the predicted wall time.
+    """
+    workers = [0.0] * max(1, threads)
+    for duration in durations:
+        heapq.heappush(workers, heapq.heappop(workers) + duration)
+    return max(workers)
+
+
+def plan(input_files, inst, threads, history=None):
+    """
+    Planning pass of the process manager. Orders the input files longest-first and logs the
+    predicted wall time and peak memory of the run.
+
+    Returns:
+    tuple: The schedule (indices into input_files) and the list of cost estimates.
+    """
+    costs = estimate_costs(input_files, inst, history)
+    order = longest_first(costs)
+
+    if costs and all(c["duration"] is not None for c in costs):
+        wall_time = predict_makespan([costs[i]["duration"] for i in order], threads)
+        logging.info("Predicted wall time: %.1f s", wall_time)
+    else:
+        logging.info("Predicted wall time: unknown (no timings recorded yet)")
+
+    peak_memory = sum(
+        sorted((c["memory"] for c in costs), reverse=True)[: max(1, threads)]
+    )
+    logging.info(
+        "Estimated peak memory with %d parallel tasks: %s",
+        min(threads, len(costs)),
+        format_size(peak_memory),
+    )
+    return order, costs
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import awkward as ak
+import numpy as np
+from data_manager import read_hdf5, write_hdf5
+from modules.compact import ENTRY_KEY
+
+
+def index_path(out):
+    """
+    Returns the index file of a sharded output, e.g. out.index.json for out.hdf5.
+    """
+    return Path(out).with_suffix(".index.json")
+
+
+def shard_path(out, number):
+    return Path(out).with_name(f"{Path(out).stem}.{number:05d}.hdf5")
+
+
+def _value_range(array, key):
+    """
+    Returns the min and max of an output (over all values of a jagged output), or None for
+    outputs without values or of a non numeric type.
+    """
+    values = ak.flatten(array[key], axis=None)
+    values = ak.to_numpy(ak.drop_none(values)) if len(values) else np.array([])
+    if len(values) == 0 or not np.issubdtype(values.dtype, np.number):
+        return None
+    return [values.min().item(), values.max().item()]
+
+
+class shard_writer:
+    """
+    Writes the events of a summarized output into shards of a fixed number of events and a
+    small JSON index next to it. Per shard the index records its length, the input files (and
+    entry ranges) its events were produced from and the min and max of the index outputs, so
+    readers can skip shards that cannot match a selection (see read_shards).
+
+    The parts are added in the order of the input files and written as soon as a shard is full,
+    so only one shard is held in memory on top of the parts.
+
+    Parameters:
+    out (str or Path): The summarized output file. Shards are written next to it as
+        <stem>.00000.hdf5, ... and the index as <stem>.index.json.
+    size (int): Number of events per shard. The last shard can be smaller.
+    index (list): Names of the outputs whose min and max are recorded.
+    narrow_offsets (bool): Store offsets and indices as int32 if they fit.
+    """
+
+    def __init__(self, out, size, index=(), narrow_offsets=False):
+        self.out = Path(out)
+        self.size = int(size)
+        self.index = list(index)
+        self.narrow_offsets = narrow_offsets
+        self.shards = []
+        self.length = 0
+        # Slices of the shard being filled with their input file
+        self._pending = []
+        self._n_pending = 0
+        # Shards of a previous run are replaced
+        if index_path(self.out).exists():
+            with Path.open(index_path(self.out)) as f:
+                for shard in json.load(f)["shards"]:
+                    self.out.with_name(shard["path"]).unlink(missing_ok=True)
+
+    def add(self, file, array):
+        """
+        Add the events produced from an input file. If the events carry their entry numbers
+        (field "_entry"), it is removed and the entry ranges are recorded in the index.
+        """
+        start = 0
+        while start < len(array):
+            stop = min(len(array), start + self.size - self._n_pending)
+            self._pending.append((file, array[start:stop]))
+            self._n_pending += stop - start
+            start = stop
+            if self._n_pending == self.size:
+                self._write_shard()
+
+    def _write_shard(self):
+        sources = []
+        arrays = []
+        for file, part in self._pending:
+            entry = None
+            events = part
+            if ENTRY_KEY in part.fields:
+                entry = ak.to_numpy(part[ENTRY_KEY])
+                events = part[[key for key in part.fields if key != ENTRY_KEY]]
+            sources.append(
+                {
+                    "file": Path(file).name,
+                    "length": len(events),
+                    "entry_start": None if entry is None else int(entry.min()),
+                    "entry_stop": None if entry is None else int(entry.max()) + 1,
+                }
+            )
+            arrays.append(events)
+        array = ak.concatenate(arrays)
+        path = shard_path(self.out, len(self.shards))
+        write_hdf5(path, array, {}, self.narrow_offsets)
+        ranges = {key: _value_range(array, key) for key in self.index}
+        self.shards.append(
+            {
+                "path": path.name,
+                "start": self.length,
+                "length": len(array),
+                "sources": sources,
+                "min": {key: r[0] for key, r in ranges.items() if r is not None},
+                "max": {key: r[1] for key, r in ranges.items() if r is not None},
+            }
+        )
+        self.length += len(array)
+        self._pending = []
+        self._n_pending = 0
+
+    def close(self):
+        """
+        Write the last (partial) shard and the index. Returns the path of the index.
+        """
+        if self._n_pending > 0:
+            self._write_shard()
+        path = index_path(self.out)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with Path.open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "shard_size": self.size,
+                    "length": self.length,
+                    "index": self.index,
+                    "shards": self.shards,
+                },
+                f,
+                indent=1,
+            )
+        tmp_path.replace(path)
+        return path
+
+
+def select_shards(index, selection=None):
+    """
+    Returns the shards of an index that can contain events of the selection.
+
+    Parameters:
+    index (dict): The content of an index file.
+    selection (dict): Closed ranges [low, high] per output, e.g. {"ged_etot": [1000, 3000]}.
+        A shard is skipped if the range of one of the outputs does not overlap with that of the
+        shard. Outputs not in the index do not skip any shard.
+    """
+    selection = selection or {}
+    selected = []
+    for shard in index["shards"]:
+        if shard["length"] == 0:
+            continue
+        keep = True
+        for key, (low, high) in selection.items():
+            if key in shard["min"] and (
+                shard["max"][key] < low or shard["min"][key] > high
+            ):
+                keep = False
+                break
+            if key in index["index"] and key not in shard["min"]:
+                # The output has no values in this shard
+                keep = False
+                break
+        if keep:
+            selected.append(shard)
+    return selected
+
+
+def read_shards(path, selection=None, threads=1):
+    """
+    Read the events of a sharded output, skipping the shards that cannot match the selection.
+
+    Parameters:
+    path (str or Path): The index file, or the summarized output file next to it.
+    selection (dict): Closed ranges [low, high] per output (see select_shards). The events of
+        the read shards are selected as well, for outputs with one value per event.
+    threads (int): Number of shards read concurrently.
+
+    Returns:
+    ak.Array: The selected events, or None if no shard matches.
+    """
+    path = Path(path)
+    if not path.name.endswith(".index.json"):
+        path = index_path(path)
+    with Path.open(path) as f:
+        index = json.load(f)
+    shards = select_shards(index, selection)
+    files = [path.with_name(shard["path"]) for shard in shards]
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        arrays = [array for array, _ in executor.map(read_hdf5, files)]
+    if not arrays:
+        return None
+
+    array = ak.concatenate(arrays)
+    for key, (low, high) in (selection or {}).items():
+        if array[key].ndim == 1:
+            array = array[
+                ak.fill_none((array[key] >= low) & (array[key] <= high), False)
+            ]
+    return array
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from tqdm import tqdm
+
+
+class progress_reporter:
+    """
+    Worker side stand-in for the per task tqdm bar.
+
+    Implements the part of the tqdm interface used by data_manager and module_manager
+    and forwards every call as a progress event to the parent process.
+    """
+
+    def __init__(self, progress_queue, task_id, total, bytes_per_entry=0.0, file=None):
+        self.queue = progress_queue
+        self.task_id = task_id
+        self.bytes_per_entry = bytes_per_entry
+        self.description = None
+        self.queue.put(("start", self.task_id, int(total), file))
+
+    def update(self, n=1):
+        self.queue.put(("update", self.task_id, int(n), int(n * self.bytes_per_entry)))
+
+    def set_description(self, desc):
+        if desc != self.description:
+            self.description = desc
+            self.queue.put(("module", self.task_id, desc))
+
+    def close(self):
+        self.queue.put(("done", self.task_id))
+
+
+class progress_monitor:
+    """
+    Parent side consumer of the progress events of all workers.
+
+    Renders one aggregate progress bar with the event rate and ETA and optionally
+    exports the same metrics in the Prometheus text format to a file and/or an HTTP endpoint.
+
+    Parameters:
+    progress_queue (queue): Queue the workers push their progress events to.
+    n_tasks (int): Number of tasks in the run.
+    telemetry (dict): Optional export settings.
+        - file (str): Path of the metrics file, rewritten every interval.
+        - port (int): Port of an HTTP endpoint serving the metrics.
+        - host (str): Address the HTTP endpoint binds to. Default is 127.0.0.1.
+        - interval (float): Seconds between metric file updates. Default is 10.
+    planned_entries (dict): Entry counts of the input files estimated by the planner (None if
+        unknown). They are expected from the start, so the ETA covers the tasks not started
+        yet, and replaced by the actual count once the task of a file starts.
+
+    A file started again (by a task retried after it was killed or ran out of memory) is not
+    counted twice: its progress is reset and it is expected once. The processed entries and
+    bytes read still count the work of every attempt.
+    """
+
+    def __init__(self, progress_queue, n_tasks, telemetry=None, planned_entries=None):
+        self.queue = progress_queue
+        self.n_tasks = n_tasks
+        self.telemetry = telemetry or {}
+        self.interval = self.telemetry.get("interval", 10)
+        self.planned_entries = {
+            str(file): entries
+            for file, entries in (planned_entries or {}).items()
+            if entries is not None
+        }
+        self.entries_expected = sum(self.planned_entries.values())
+        self.entries_done = 0
+        # Entries of the current attempt of the started files, which the ETA is based on
+        self.entries_progress = 0
+        self.files = {}
+        self.current_file = {}
+        self.bytes_read = 0
+        self.tasks_started = 0
+        self.tasks_done = 0
+        self.current_module = {}
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._server = None
+        self.pbar = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.start_time = time.time()
+        self.pbar = tqdm(
+            total=self.entries_expected, unit="evt", unit_scale=True, desc="postproc"
+        )
+        if "port" in self.telemetry:
+            self._start_server(
+                self.telemetry.get("host", "127.0.0.1"), self.telemetry["port"]
+            )
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join()
+        self.export()
+        self.pbar.close()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _consume(self):
+        last_export = time.time()
+        while True:
+            try:
+                event = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                event = ()
+            if event is None:
+                return
+            if event:
+                self.handle(event)
+            if time.time() - last_export >= self.interval:
+                self.export()
+                last_export = time.time()
+
+    def handle(self, event):
+        kind, task_id = event[0], event[1]
+        with self._lock:
+            if kind == "start":
+                self._start_file(
+                    task_id, event[2], event[3] if len(event) > 3 else None
+                )
+            elif kind == "update":
+                self.entries_done += event[2]
+                self.entries_progress += event[2]
+                self.bytes_read += event[3]
+                file = self.files.get(self.current_file.get(task_id))
+                if file is not None:
+                    file["done"] += event[2]
+                self.pbar.update(event[2])
+            elif kind == "module":
+                self.current_module[task_id] = event[2]
+            elif kind == "done":
+                self.tasks_done += 1
+                self.current_module.pop(task_id, None)
+            self.pbar.set_postfix(
+                files=f"{self.tasks_done}/{self.n_tasks}",
+                active=self.tasks_started - self.tasks_done,
+                module=self.current_module.get(task_id, ""),
+                refresh=False,
+            )
+
+    def _start_file(self, task_id, total, file):
+        key = (task_id,) if file is None else str(file)
+        if key in self.files:
+            # Restarted: the progress of the previous attempt is done again
+            previous = self.files[key]
+            self.entries_progress -= previous["done"]
+            self.entries_expected += total - previous["total"]
+            self.pbar.n = self.entries_progress
+        else:
+            self.tasks_started += 1
+            self.entries_expected += total - self.planned_entries.pop(str(file), 0)
+        self.files[key] = {"total": total, "done": 0}
+        self.current_file[task_id] = key
+        self.pbar.total = self.entries_expected
+        self.pbar.refresh()
+
+    def metrics(self):
+        with self._lock:
+            elapsed = max(time.time() - self.start_time, 1e-9)
+            rate = self.entries_done / elapsed
+            remaining = max(self.entries_expected - self.entries_progress, 0)
+            return {
+                "postproc_entries_processed_total": self.entries_done,
+                "postproc_entries_expected": self.entries_expected,
+                "postproc_bytes_read_total": self.bytes_read,
+                "postproc_tasks": self.n_tasks,
+                "postproc_tasks_started": self.tasks_started,
+                "postproc_tasks_completed": self.tasks_done,
+                "postproc_entries_per_second": rate,
+                "postproc_eta_seconds": remaining / rate if rate > 0 else -1,
+                "postproc_elapsed_seconds": elapsed,
+            }
+
+    def metrics_text(self):
+        lines = []
+        for key, value in self.metrics().items():
+            kind = "counter" if key.endswith("_total") else "gauge"
+            lines.append(f"# TYPE {key} {kind}")
+            lines.append(f"{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        if "file" not in self.telemetry:
+            return
+        path = Path(self.telemetry["file"])
+        tmp_path = path.with_name(path.name + ".tmp")
+        with Path.open(tmp_path, "w") as f:
+            f.write(self.metrics_text())
+        tmp_path.replace(path)
+
+    def _start_server(self, host, port):
+        monitor = self
+
+        class metrics_handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = monitor.metrics_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # noqa: ARG002
+                return
+
+        self._server = ThreadingHTTPServer((host, port), metrics_handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logging.info("Serving progress metrics on %s:%d", host, port)
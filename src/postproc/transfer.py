@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import contextlib
+from multiprocessing import shared_memory
+
+import awkward as ak
+import numpy as np
+
+# Offsets of the buffers in the shared memory block are aligned to this many bytes
+ALIGNMENT = 64
+
+
+def share_output(array, histograms):
+    """
+    Copy the packed buffers of an output array into one shared memory block.
+
+    Used by the workers in summarize mode to hand their output to the parent process without
+    writing and reading back a temporary file.
+
+    Returns:
+    dict: Descriptor of the block (name, form, length and the offset, size and dtype of each
+        buffer) and the histograms of the task. Only the descriptor is sent to the parent.
+    """
+    descriptor = {"histograms": histograms, "shm": None}
+    if array is None:
+        return descriptor
+
+    form, length, container = ak.to_buffers(ak.to_packed(array))
+    container = {key: np.asarray(buffer) for key, buffer in container.items()}
+    layout = {}
+    size = 0
+    for key, buffer in container.items():
+        layout[key] = (size, buffer.nbytes, buffer.dtype.str)
+        size += -(-buffer.nbytes // ALIGNMENT) * ALIGNMENT
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for key, buffer in container.items():
+        offset, nbytes, _ = layout[key]
+        shm.buf[offset : offset + nbytes] = buffer.view(np.uint8).ravel()
+    descriptor.update(
+        {"shm": shm.name, "form": form.to_json(), "length": length, "buffers": layout}
+    )
+    # The parent unlinks the block once it has consumed it
+    shm.close()
+    return descriptor
+
+
+def open_shared_output(descriptor):
+    """
+    Attach to the shared memory block of a worker.
+
+    Returns:
+    tuple: (shm, array) with array reading directly from the block, or (None, None) if the task
+        had no event level output. The block must be released with release_shared_output once
+        all references to the array are gone.
+    """
+    if descriptor["shm"] is None:
+        return None, None
+    # The workers share the resource tracker of the parent, so the block stays registered
+    # (and is removed on exit) until release_shared_output unlinks it
+    shm = shared_memory.SharedMemory(name=descriptor["shm"])
+    buffers = {
+        key: np.frombuffer(
+            shm.buf,
+            dtype=dtype,
+            count=nbytes // np.dtype(dtype).itemsize,
+            offset=offset,
+        )
+        for key, (offset, nbytes, dtype) in descriptor["buffers"].items()
+    }
+    array = ak.from_buffers(
+        ak.forms.from_json(descriptor["form"]), descriptor["length"], buffers
+    )
+    return shm, array
+
+
+def release_shared_output(shm):
+    # The block is always unlinked. If views of it are still alive, the mapping is only
+    # released with them (and the failed close is reported when shm is collected).
+    with contextlib.suppress(BufferError):
+        shm.close()
+    shm.unlink()
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import contextlib
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from pathlib import Path
+
+import scheduler
+from misc import pipelines
+from module_manager import module_manager
+from process import run_post_proc
+from telemetry import progress_monitor
+
+
+def _warm_up(inst):
+    """
+    Worker initializer. Resolves the modules of all pipelines, so the imports are done once per
+    worker and not when the first file arrives.
+    """
+    for pipeline in pipelines(inst):
+        module_manager(pipeline)
+
+
+class folder_watcher:
+    """
+    Long-running service mode. Polls the input folder and processes every file once it is
+    complete on a pool of workers that is kept alive between files, so imports and compiled
+    kernels are reused.
+
+    Only the individual mode is supported. The settings are read from para["watch"]:
+    - interval (float): Seconds between polls of the input folder. Default is 30.
+    - stable_time (float): A file is complete once its size and modification time have not
+        changed for this many seconds. Default is 60.
+    - sentinel (str): If given, a file is complete once a file with this suffix appended to its
+        name exists (e.g. ".done" for sim_000.root.done). stable_time is then not used.
+    - idle_timeout (float): Stop after this many seconds without new files. Default is to run
+        until interrupted.
+    - tasks_per_worker (int): Replace a worker after this many files, e.g. to bound the memory
+        held by long-lived workers. Default is to keep the workers.
+    """
+
+    def __init__(self, inst, overwrite=False):
+        if inst["para"].get("mode", "individual") != "individual":
+            text = "Watch mode only supports the individual mode."
+            raise ValueError(text)
+        if inst["para"].get("batch_threads", 1) == "auto":
+            # The number of files is not known in advance
+            inst = {**inst, "para": {**inst["para"], "batch_threads": 1}}
+        self.inst = inst
+        self.in_folder = Path(inst["io"]["input"]["folder"])
+        self.in_format = inst["io"]["input"]["format"]
+        self.outs = [pipeline["output_path"] for pipeline in pipelines(inst)]
+        self.overwrite = overwrite
+        self.threads = inst["para"]["threads"]
+        self.telemetry = inst["para"].get("telemetry", {})
+
+        watch = inst["para"].get("watch", {})
+        self.interval = watch.get("interval", 30)
+        self.stable_time = watch.get("stable_time", 60)
+        self.sentinel = watch.get("sentinel")
+        self.idle_timeout = watch.get("idle_timeout")
+        self.tasks_per_worker = watch.get("tasks_per_worker")
+
+        if "timings" in inst["para"]:
+            self.timings_file = Path(inst["para"]["timings"])
+        else:
+            self.timings_file = Path(self.outs[0]).joinpath("postproc_timings.json")
+
+        # Files submitted in this session, and (size, mtime) and first sight of files not yet complete
+        self.submitted = set()
+        self.candidates = {}
+        self.n_tasks = 0
+
+        logging.info("Watching %s for *.%s files", self.in_folder, self.in_format)
+        if self.sentinel is not None:
+            logging.info("Files are complete once <file>%s exists", self.sentinel)
+        else:
+            logging.info("Files are complete once unchanged for %s s", self.stable_time)
+
+    def output_files(self, infile):
+        return [Path(out).joinpath(infile.stem + ".hdf5") for out in self.outs]
+
+    def is_complete(self, infile, now):
+        if self.sentinel is not None:
+            return infile.with_name(infile.name + self.sentinel).exists()
+        stat = infile.stat()
+        signature = (stat.st_size, stat.st_mtime_ns)
+        previous = self.candidates.get(infile)
+        if previous is None or previous[0] != signature:
+            self.candidates[infile] = (signature, now)
+            return False
+        return now - previous[1] >= self.stable_time
+
+    def poll(self):
+        """
+        Returns the files of the input folder that are complete and were not processed yet.
+        """
+        now = time.time()
+        ready = []
+        infiles = sorted(self.in_folder.glob("*." + self.in_format))
+        # Forget files that were removed or renamed before they were complete
+        for infile in self.candidates.keys() - set(infiles):
+            del self.candidates[infile]
+        for infile in infiles:
+            if infile in self.submitted:
+                continue
+            try:
+                if not self.is_complete(infile, now):
+                    continue
+            except FileNotFoundError:
+                # Removed or renamed while polling
+                self.candidates.pop(infile, None)
+                continue
+            self.submitted.add(infile)
+            self.candidates.pop(infile, None)
+            outfiles = self.output_files(infile)
+            if not self.overwrite and all(Path.exists(f) for f in outfiles):
+                continue
+            ready.append((infile, outfiles))
+        return ready
+
+    def run(self):
+        manager = multiprocessing.Manager()
+        progress_queue = manager.Queue()
+        pending = set()
+        last_activity = time.time()
+        try:
+            with contextlib.ExitStack() as stack:
+                executor = stack.enter_context(
+                    ProcessPoolExecutor(
+                        max_workers=self.threads,
+                        max_tasks_per_child=self.tasks_per_worker,
+                        initializer=_warm_up,
+                        initargs=(self.inst,),
+                    )
+                )
+                monitor = stack.enter_context(
+                    progress_monitor(progress_queue, 0, self.telemetry)
+                )
+                try:
+                    while True:
+                        for infile, outfiles in self.poll():
+                            logging.info("Processing %s", infile)
+                            pending.add(
+                                executor.submit(
+                                    run_post_proc,
+                                    (
+                                        infile,
+                                        outfiles,
+                                        self.inst,
+                                        self.n_tasks,
+                                        progress_queue,
+                                    ),
+                                )
+                            )
+                            self.n_tasks += 1
+                            monitor.n_tasks = self.n_tasks
+                            last_activity = time.time()
+
+                        if pending:
+                            done, pending = wait(pending, timeout=self.interval)
+                            self.collect(done)
+                        else:
+                            done = set()
+                            time.sleep(self.interval)
+                        if done:
+                            last_activity = time.time()
+                        if (
+                            self.idle_timeout is not None
+                            and not pending
+                            and time.time() - last_activity >= self.idle_timeout
+                        ):
+                            logging.info(
+                                "No new files for %s s, stopping", self.idle_timeout
+                            )
+                            break
+                except KeyboardInterrupt:
+                    logging.info("Interrupted, finishing the running files")
+                    for future in pending:
+                        future.cancel()
+                    self.collect(wait(pending).done)
+        finally:
+            manager.shutdown()
+
+    def collect(self, done):
+        results = []
+        for future in done:
+            if future.cancelled():
+                continue
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error("Process raised an exception: %s", e)
+                continue
+            if result is not None:
+                logging.info(
+                    "Finished %s (%d entries in %.1f s)",
+                    result["infile"],
+                    result["entries"],
+                    result["duration"],
+                )
+                results.append(result)
+        if results:
+            scheduler.record_timings(self.timings_file, results)
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import queue
+import threading
+from pathlib import Path
+
+import awkward as ak
+import h5py
+from modules.misc import compact_layout
+
+
+class output_writer:
+    """
+    Background thread writing the batches of an output file while the next batches are processed.
+
+    Batches are passed through a bounded queue, so at most max_pending finished batches wait in
+    memory. Each batch is packed and written as a part of the "awkward" group (subgroups "0",
+    "1", ... with their own form and length, the number of parts in the attribute "parts"), and
+    read_hdf5 concatenates the parts. The file is written under a temporary name and only moved
+    to its path by close. It is created before the thread starts, so a failure to open it is
+    raised to the caller.
+
+    Parameters:
+    path (str or Path): The output file.
+    narrow_offsets (bool): Store offsets and indices as int32 if they fit.
+    max_pending (int): Number of batches that can wait for the writer before put blocks.
+    """
+
+    def __init__(self, path, narrow_offsets=False, max_pending=2):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self.narrow_offsets = narrow_offsets
+        self.n_parts = 0
+        self.error = None
+        self.aborted = False
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._file = h5py.File(self.tmp_path, "w")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, array):
+        """
+        Queue a batch for writing. Blocks while max_pending batches are waiting.
+        """
+        if self.error is not None:
+            raise self.error
+        self._queue.put(array)
+
+    def _run(self):
+        with self._file as f:
+            group = f.create_group("awkward")
+            while True:
+                array = self._queue.get()
+                if array is None:
+                    break
+                # After an error the queue is still drained, so put does not block forever
+                if self.error is not None or self.aborted:
+                    continue
+                try:
+                    self._write_part(group, array)
+                except Exception as e:  # noqa: BLE001
+                    self.error = e
+            group.attrs["parts"] = self.n_parts
+
+    def _write_part(self, group, array):
+        part = group.create_group(str(self.n_parts))
+        form, length, _ = ak.to_buffers(
+            compact_layout(array, narrow=self.narrow_offsets), container=part
+        )
+        part.attrs["form"] = form.to_json()
+        part.attrs["length"] = length
+        self.n_parts += 1
+
+    def abort(self):
+        """
+        Stop the writer of a file whose processing failed: the pending batches are dropped, the
+        thread is stopped and the temporary file removed.
+        """
+        self.aborted = True
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.tmp_path.unlink(missing_ok=True)
+
+    def close(self, histograms):
+        """
+        Write the remaining batches and the histograms and move the file to its path.
+        Without parts the "awkward" group is removed (only histograms were produced).
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        with h5py.File(self.tmp_path, "a") as f:
+            if self.n_parts == 0:
+                del f["awkward"]
+            for key, hist in histograms.items():
+                hist.write(f.create_group(f"histograms/{key}"))
+        self.tmp_path.replace(self.path)
@@ -0,0 +1,8 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+# The scripts in src/postproc import each other as top-level modules. The folder is appended,
+# so "postproc" still resolves to the package and not to the postproc.py script.
+sys.path.append(str(Path(__file__).parents[1].joinpath("src", "postproc")))
@@ -11,9 +11,12 @@ from numba import types
 from numba.typed import Dict
 
 from postproc.modules.active_volume import (
+    build_polycone_slabs,
     generate_mask_cylinder,
     generate_mask_deadlayer,
     is_in_active_volume_polycone,
+    is_point_inside_polycone,
+    is_point_inside_polycone_slabs,
     m_active_volume,
 )
 
@@ -99,6 +102,43 @@ def test_is_in_active_volume_polycone():
     assert not is_in_active_volume_polycone(0.5, 0.5, 0.5, 2, dl_input_numba)
 
 
+def test_build_polycone_slabs():
+    slab_z, slab_offsets, slab_edges, bbox = build_polycone_slabs(
+        [0, 0.9, 0.9, 0], [-0.9, -0.9, 0.9, 0.9]
+    )
+
+    assert slab_z.tolist() == [-0.9, 0.9]
+    assert slab_offsets.tolist() == [0, 2]
+    assert slab_edges.reshape(-1, 4).tolist() == [
+        [0.9, -0.9, 0.9, 0.9],
+        [0, 0.9, 0, -0.9],
+    ]
+    assert bbox.tolist() == [0.9, -0.9, 0.9]
+
+
+def test_is_point_inside_polycone_slabs():
+    # Deadlayer mesh of the example detector, with a borehole
+    r_dl = np.array([0.0, 13.01, 13.0, 17.0, 17.0, 39.0, 39.0, 5.0, 5.0, 0.0])
+    z_dl = np.array(
+        [-75.19, -75.19, -72.2, -72.2, -74.2, -74.2, -1.0, -1.0, -43.0, -43.0]
+    )
+    slabs = build_polycone_slabs(r_dl, z_dl)
+
+    rng = np.random.default_rng(42)
+    x = rng.uniform(-45, 45, 5000)
+    y = rng.uniform(-45, 45, 5000)
+    z = rng.uniform(-80, 5, 5000)
+    # Points exactly on vertex heights and edges
+    z[:500] = rng.choice(z_dl, 500)
+    x[500:1000] = rng.choice(r_dl, 500)
+    y[500:1000] = 0
+
+    for i in range(len(x)):
+        assert is_point_inside_polycone_slabs(
+            x[i], y[i], z[i], *slabs
+        ) == is_point_inside_polycone(x[i], y[i], z[i], r_dl, z_dl)
+
+
 def test_generate_mask_deadlayer():
     with tempfile.NamedTemporaryFile(mode="w+") as tf:
         json_content = {
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import awkward as ak
+import numpy as np
+import pytest
+
+from postproc.modules.cluster import cluster_steps, m_cluster
+
+
+def test_cluster_steps_voxel():
+    edep = ak.Array([[1.0, 3.0, 2.0, 0.5], []])
+    posx = ak.Array([[0.1, 0.3, 5.0, 0.2], []])
+    posy = ak.Array([[0.0, 0.0, 0.0, 0.0], []])
+    posz = ak.Array([[0.0, 0.0, 0.0, 0.0], []])
+    vol = ak.Array([[1, 1, 1, 2], []])
+
+    result = cluster_steps({"size": 1.0}, edep, posx, posy, posz, vol)
+
+    assert result["edep"].to_list() == [[4.0, 2.0, 0.5], []]
+    assert np.allclose(ak.flatten(result["posx"]), [0.25, 5.0, 0.2])
+    assert result["vol"].to_list() == [[1, 1, 2], []]
+
+
+def test_cluster_steps_radius():
+    edep = np.array([1.0, 1.0, 1.0])
+    posx = np.array([0.9, 1.1, 2.5])
+    zeros = np.zeros(3)
+    vol = np.array([1, 1, 1])
+
+    # 0.9 and 1.1 fall into different voxels, but are within the radius
+    result = cluster_steps(
+        {"size": 1.0, "type": "radius"}, edep, posx, zeros, zeros, vol
+    )
+    assert result["edep"].to_list() == [2.0, 1.0]
+    assert np.allclose(result["posx"], [1.0, 2.5])
+
+    with pytest.raises(ValueError, match="Unknown cluster type"):
+        cluster_steps({"size": 1.0, "type": "sphere"}, edep, posx, zeros, zeros, vol)
+
+
+@pytest.mark.parametrize("mode", ["voxel", "radius"])
+def test_cluster_steps_lists(mode):
+    # Steps in the same voxel of different events are not merged
+    edep = ak.Array([[1.0, 2.0], [], [3.0], [4.0, 5.0]])
+    pos = ak.Array([[0.5, 0.5], [], [0.5], [0.5, 0.6]])
+    vol = ak.Array([[1, 1], [], [1], [1, 1]])
+
+    result = cluster_steps({"size": 1.0, "type": mode}, edep, pos, pos, pos, vol)
+    assert result["edep"].to_list() == [[3.0], [], [3.0], [9.0]]
+    assert result["vol"].to_list() == [[1], [], [1], [1]]
+
+
+def test_cluster_steps_time():
+    edep = ak.Array([[1.0, 1.0, 2.0]])
+    pos = ak.Array([[0.0, 0.0, 0.0]])
+    vol = ak.Array([[1, 1, 1]])
+    t = ak.Array([[0.0, 1.0, 100.0]])
+
+    result = cluster_steps({"size": 1.0}, edep, pos, pos, pos, vol, t)
+    assert result["edep"].to_list() == [[4.0]]
+    assert np.allclose(ak.flatten(result["t"]), [50.25])
+
+    result = cluster_steps({"size": 1.0, "dT": 10}, edep, pos, pos, pos, vol, t)
+    assert result["edep"].to_list() == [[2.0, 2.0]]
+    assert result["t"].to_list() == [[0.5, 100.0]]
+
+
+def test_m_cluster():
+    para = {"size": 1.0}
+    input = {
+        "edep": "edep",
+        "posx": "x",
+        "posy": "y",
+        "posz": "z",
+        "vol": "vol",
+        "trackid": "trackid",
+    }
+    output = {
+        "edep": "c_edep",
+        "posx": "c_x",
+        "posy": "c_y",
+        "posz": "c_z",
+        "vol": "c_vol",
+        "trackid": "c_trackid",
+    }
+    pv = {
+        "edep": ak.Array([[[1.0, 1.0], [2.0]], [[0.0, 0.0]]]),
+        "x": ak.Array([[[0.1, 0.3], [0.2]], [[0.2, 0.6]]]),
+        "y": ak.Array([[[0.0, 0.0], [0.0]], [[0.0, 0.0]]]),
+        "z": ak.Array([[[0.0, 0.0], [0.0]], [[0.0, 0.0]]]),
+        "vol": ak.Array([[[1, 1], [1]], [[2, 2]]]),
+        "trackid": ak.Array([[[7, 8], [9]], [[3, 4]]]),
+    }
+
+    m_cluster(para, input, output, pv)
+
+    assert pv["c_edep"].to_list() == [[[2.0], [2.0]], [[0.0]]]
+    # Clusters without energy use the plain mean
+    assert np.allclose(ak.flatten(pv["c_x"], axis=None), [0.2, 0.2, 0.4])
+    assert pv["c_trackid"].to_list() == [[[7], [9]], [[3]]]
+
+    with pytest.raises(ValueError, match="Required parameter size"):
+        m_cluster({}, input, output, pv)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import awkward as ak
+import numpy as np
+import pytest
+
+from postproc.modules.compact import event_selection, m_compact
+
+
+def test_event_selection():
+    pv = {
+        "mask": ak.Array([[[True, False]], [[False]], []]),
+        "val": ak.Array([[[1.0], []], [[]], [[2.0]]]),
+        "etot": ak.Array([1.0, None, 2.0]),
+    }
+    assert event_selection({"mask": "mask"}, pv).tolist() == [True, False, False]
+    assert event_selection({"val": "val"}, pv).tolist() == [True, False, True]
+    assert event_selection({"val": "etot"}, pv).tolist() == [True, False, True]
+
+
+def test_m_compact():
+    input = {"val": "edep"}
+    output = {"entry": "entry"}
+    pv = {
+        "edep": ak.Array([[1.0, 2.0], [], [3.0], []]),
+        "vol": ak.Array([[1, 2], [], [1], []]),
+        "etot": np.array([3.0, 0.0, 3.0, 0.0]),
+        "_entry": np.arange(10, 14),
+        "sensitive_volumes": np.array([1, 2]),
+    }
+
+    m_compact({"variables": ["edep", "vol", "etot"]}, input, output, pv)
+
+    assert pv["edep"].to_list() == [[1.0, 2.0], [3.0]]
+    assert pv["vol"].to_list() == [[1, 2], [1]]
+    assert pv["etot"].tolist() == [3.0, 3.0]
+    assert pv["entry"].tolist() == [10, 12]
+    # Arrays which are not per event are not touched
+    assert pv["sensitive_volumes"].tolist() == [1, 2]
+
+    # A second compaction keeps the original entry numbers
+    pv["mask"] = np.array([False, True])
+    m_compact({"variables": ["edep", "mask"]}, {"mask": "mask"}, output, pv)
+    assert pv["entry"].tolist() == [12]
+
+    pv = {"edep": ak.Array([[1.0], []])}
+    m_compact({}, {"val": "edep"}, {"entry": "entry"}, pv)
+    assert pv["entry"].tolist() == [0]
+
+    with pytest.raises(ValueError, match="Exactly one of the inputs"):
+        m_compact({}, {}, output, pv)
+
+
+def test_m_compact_pipeline_variables():
+    # Only the variables of the pipeline are compacted, whatever their length
+    pv = {
+        "edep": ak.Array([[1.0], [], [2.0]]),
+        "etot": [1.0, 0.0, 2.0],
+        "lookup": np.array([5, 6, 7]),
+        "_entry": np.arange(3),
+        "_variables": ("edep", "etot"),
+    }
+    m_compact({}, {"val": "edep"}, {}, pv)
+    assert pv["edep"].to_list() == [[1.0], [2.0]]
+    assert pv["etot"].to_list() == [1.0, 2.0]
+    assert pv["lookup"].tolist() == [5, 6, 7]
+
+    pv = {"edep": ak.Array([[1.0], []]), "sensitive_volumes": np.array([1, 2, 3])}
+    with pytest.raises(ValueError, match="Variable sensitive_volumes has 3 entries"):
+        m_compact({}, {"val": "edep"}, {}, pv)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -6,6 +6,7 @@ import pytest
 from postproc.modules.group_sensitive_volume import (
     generate_group_mask,
     group_all_in_detector_ids,
+    group_all_in_detector_ids_together,
     m_group_sensitive_volume,
 )
 
@@ -47,6 +48,24 @@ def test_group_all_in_detector_ids():
     assert ak.to_list(result) == ak.to_list(expected)
 
 
+def test_group_all_in_detector_ids_together():
+    v_voln_hw = ak.Array([[1, 2, 1], [3]])
+    arrays = {
+        "edep": ak.Array([[10.0, 20.0, 30.0], [40.0]]),
+        "vol": v_voln_hw,
+    }
+    result = group_all_in_detector_ids_together(v_voln_hw, arrays)
+    for key, array in arrays.items():
+        assert ak.to_list(result[key]) == ak.to_list(
+            group_all_in_detector_ids(v_voln_hw, array)
+        )
+
+    result = group_all_in_detector_ids_together(
+        ak.Array([1, 2, 1]), {"edep": ak.Array([1.0, 2.0, 3.0])}
+    )
+    assert ak.to_list(result["edep"]) == [[1.0, 3.0], [2.0]]
+
+
 def test_m_group_sensitive_volume():
     para = {
         "group": 1,
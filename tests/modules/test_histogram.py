@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import awkward as ak
+import h5py
+import numpy as np
+import pytest
+
+from postproc.modules.histogram import binning, histogram, m_histogram
+
+
+def test_binning():
+    assert np.allclose(
+        binning({"bins": 4, "range": [0, 2]}, 1)[0], np.linspace(0, 2, 5)
+    )
+    assert np.allclose(binning({"bins": [0, 1, 3]}, 1)[0], [0, 1, 3])
+
+    edges = binning({"bins": [2, [0, 5, 10]], "range": [[0, 1], [0, 10]]}, 2)
+    assert np.allclose(edges[0], [0, 0.5, 1])
+    assert np.allclose(edges[1], [0, 5, 10])
+
+    with pytest.raises(ValueError, match="range"):
+        binning({"bins": 4}, 1)
+
+
+def test_m_histogram():
+    input = {"x": "edep", "weight": "w"}
+    output = {"hist": "h"}
+    pv = {
+        "edep": ak.Array([[0.5, 1.5], [], [3.5, None]]),
+        "w": ak.Array([2.0, 1.0, 1.0]),
+    }
+    m_histogram({"bins": 4, "range": [0, 4]}, input, output, pv)
+
+    assert np.allclose(pv["h"].counts, [2, 2, 0, 1])
+    assert np.allclose(pv["h"].sumw2, [4, 4, 0, 1])
+
+    # 2D, unweighted
+    pv["vol"] = ak.Array([[1, 2], [], [2, 2]])
+    m_histogram(
+        {"bins": [[0, 2, 4], [0.5, 1.5, 2.5]]},
+        {"x": "edep", "y": "vol"},
+        output,
+        pv,
+    )
+    assert np.allclose(pv["h"].counts, [[1, 1], [0, 1]])
+    assert pv["h"].sumw2 is None
+
+
+def test_histogram_merge(tmp_path):
+    a = histogram([[0, 1, 2]])
+    a.fill(np.array([0.5, 1.5, 1.5]))
+    b = histogram([[0, 1, 2]])
+    b.fill(np.array([0.5]), weights=np.array([2.0]))
+
+    merged = a + b
+    assert np.allclose(merged.counts, [3, 2])
+    assert np.allclose(merged.sumw2, [5, 2])
+
+    with pytest.raises(ValueError, match="same binning"):
+        a + histogram([[0, 2]])
+
+    with h5py.File(tmp_path / "hist.hdf5", "w") as f:
+        merged.write(f.create_group("histograms/h"))
+    with h5py.File(tmp_path / "hist.hdf5", "r") as f:
+        read = histogram.read(f["histograms/h"])
+    assert np.allclose(read.counts, merged.counts)
+    assert np.allclose(read.sumw2, merged.sumw2)
+    assert np.allclose(read.edges[0], [0, 1, 2])
+
+
+if __name__ == "__main__":
+    pytest.main()
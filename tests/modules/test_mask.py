@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import awkward as ak
+import numpy as np
+import pytest
+
+from postproc.modules.mask import m_mask
+
+
+def test_m_mask():
+    pv = {
+        "mask": ak.Array([True, False, True, True]),
+        "etot": ak.Array([1.0, 2.0, 3.0, 4.0]),
+        "edep": ak.Array([[1.0], [2.0], [], [4.0]]),
+        "_entry": np.arange(10, 14),
+    }
+    m_mask({}, {"mask": "mask", "edep": "etot"}, {"edep": "etot_sel"}, pv)
+    assert ak.to_list(pv["etot_sel"]) == [1.0, 3.0, 4.0]
+    # The entry numbers of the selected events are kept with the output
+    assert pv["_entry/etot_sel"].tolist() == [10, 12, 13]
+
+    # A second selection starts from the entries of the first one
+    pv["mask_sel"] = ak.Array([False, True, True])
+    m_mask({}, {"mask": "mask_sel", "edep": "etot_sel"}, {"edep": "etot_sel2"}, pv)
+    assert pv["_entry/etot_sel2"].tolist() == [12, 13]
+
+    # Masks of values within the events do not select events
+    pv["hit_mask"] = ak.Array([[True], [False], [], [True]])
+    m_mask({}, {"mask": "hit_mask", "edep": "edep"}, {"edep": "edep_sel"}, pv)
+    assert ak.to_list(pv["edep_sel"]) == [[1.0], [], [], [4.0]]
+    assert "_entry/edep_sel" not in pv
+
+
+if __name__ == "__main__":
+    pytest.main()
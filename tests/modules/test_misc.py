@@ -1,11 +1,25 @@
 from __future__ import annotations
 
+import awkward as ak
 import numba
+import numpy as np
 import pytest
-from numba import types
+from numba import njit, types
 from numba.typed import List
 
-from postproc.modules.misc import infer_numba_type_and_depth, python_list_to_numba_list
+from postproc.modules.misc import (
+    cast_dtype,
+    compact_layout,
+    from_jagged_buffers,
+    infer_numba_type_and_depth,
+    jagged_buffers,
+    map_flat,
+    map_sublists,
+    python_list_to_numba_list,
+    restore_dtype,
+    share_offsets,
+    take_together,
+)
 
 
 def test_infer_numba_type_and_depth():
@@ -69,5 +83,146 @@ def test_python_list_to_numba_list():
         python_list_to_numba_list([])
 
 
+def test_jagged_buffers():
+    array = ak.Array([[[1.0, 2.0], []], [[3.0]]])
+    offsets, content = jagged_buffers(array)
+    assert [o.tolist() for o in offsets] == [[0, 2, 3], [0, 2, 2, 3]]
+    assert content.tolist() == [1.0, 2.0, 3.0]
+    # The buffers are views of the array
+    assert np.shares_memory(content, ak.to_layout(array).content.content.data)
+
+    offsets, content = jagged_buffers(np.array([1, 2, 3]))
+    assert offsets == ()
+    assert content.tolist() == [1, 2, 3]
+
+    offsets, content = jagged_buffers(np.array([[1, 2], [3, 4]]))
+    assert [o.tolist() for o in offsets] == [[0, 2, 4]]
+    assert content.tolist() == [1, 2, 3, 4]
+
+    with pytest.raises(TypeError, match="Unsupported layout"):
+        jagged_buffers(ak.Array([[1, None]]))
+
+
+def test_from_jagged_buffers():
+    offsets, content = jagged_buffers(ak.Array([[[1, 2], []], [[3]]]))
+    assert from_jagged_buffers(offsets, content).to_list() == [[[1, 2], []], [[3]]]
+
+
+@njit
+def _add(a, b):
+    return a + b
+
+
+@njit
+def _reverse_and_split(offsets, values):
+    # Reverses every list and splits it into one list per element
+    n = offsets[-1] - offsets[0]
+    order = np.empty(n, dtype=np.int64)
+    pos = 0
+    for i in range(len(offsets) - 1):
+        for j in range(offsets[i + 1] - 1, offsets[i] - 1, -1):
+            order[pos] = j
+            pos += 1
+    return offsets - offsets[0], np.arange(n + 1), values[order]
+
+
+def test_map_flat():
+    a = ak.Array([[1, 2], [], [3]])
+    b = ak.Array([[10, 20], [], [30]])
+    assert map_flat(_add, [a, b]).to_list() == [[11, 22], [], [33]]
+
+    # Arrays with the same structure but different offsets buffers
+    assert map_flat(_add, [a[1:], b[1:]]).to_list() == [[], [33]]
+
+    with pytest.raises(ValueError, match="same structure"):
+        map_flat(_add, [a, ak.Array([[1], [2], [3]])])
+
+
+def test_map_sublists():
+    a = ak.Array([[[1, 2], [3]], [[4, 5, 6]]])
+    assert map_sublists(_reverse_and_split, [a]).to_list() == [
+        [[[2], [1]], [[3]]],
+        [[[6], [5], [4]]],
+    ]
+
+    assert map_sublists(_reverse_and_split, [np.array([1, 2, 3])]).to_list() == [
+        [3],
+        [2],
+        [1],
+    ]
+
+
+def test_cast_dtype():
+    a = ak.Array([[1, 2], [], [3]])
+    assert str(cast_dtype(a, "int32").type) == "3 * var * int32"
+    assert cast_dtype(a, "int32").to_list() == a.to_list()
+    assert str(cast_dtype(ak.Array([0.5, 1.5]), "float32").type) == "2 * float32"
+
+    with pytest.raises(ValueError, match="out of range"):
+        cast_dtype(ak.Array([[1], [2**40]]), "int32")
+
+
+def test_restore_dtype():
+    reference = ak.values_astype(ak.Array([[1.0], [2.0]]), "float32")
+    assert str(restore_dtype(ak.Array([[1.0, 2.0]]), reference).type) == (
+        "1 * var * float32"
+    )
+    # Different kinds are not cast
+    assert str(restore_dtype(ak.Array([[1.5]]), ak.Array([[1]])).type) == (
+        "1 * var * float64"
+    )
+
+
+def _offsets_address(array):
+    return np.asarray(ak.to_layout(array).offsets.data).ctypes.data
+
+
+def test_share_offsets():
+    arrays = {
+        "x": ak.Array([[1.0, 2.0], [3.0]]),
+        "y": ak.Array([[1, 2], [3]]),
+        "z": ak.Array([[1], [2, 3]]),
+        "e": np.array([1, 2]),
+    }
+    shared = share_offsets(arrays)
+    assert _offsets_address(shared["x"]) == _offsets_address(shared["y"])
+    for key, array in arrays.items():
+        assert ak.to_list(shared[key]) == ak.to_list(array)
+
+
+def test_take_together():
+    arrays = {
+        "x": ak.Array([[1.0, 2.0], [3.0]]),
+        "y": ak.Array([[1, 2], [3]]),
+        "v": ak.Array([None, 1]),
+    }
+    selected = take_together(arrays, ak.Array([False, True]))
+    assert {key: ak.to_list(a) for key, a in selected.items()} == {
+        "x": [[3.0]],
+        "y": [[3]],
+        "v": [1],
+    }
+
+    selected = take_together(
+        {"x": arrays["x"], "y": arrays["y"]}, ak.Array([[True, False], [True]])
+    )
+    assert ak.to_list(selected["x"]) == [[1.0], [3.0]]
+    assert _offsets_address(selected["x"]) == _offsets_address(selected["y"])
+
+
+def test_compact_layout():
+    array = ak.Array([[[1.0, 2.0], [3.0]], [], [[None]]])
+    selected = array[ak.Array([[True, False], [], [True]])]
+
+    packed = compact_layout(selected)
+    assert packed.tolist() == selected.tolist()
+    assert isinstance(ak.to_layout(packed), ak.contents.ListOffsetArray)
+
+    narrowed = compact_layout(selected, narrow=True)
+    assert narrowed.tolist() == selected.tolist()
+    assert ak.to_layout(narrowed).offsets.data.dtype == np.int32
+    assert ak.to_layout(narrowed).content.content.index.data.dtype == np.int32
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -60,5 +60,18 @@ def test_m_r90_estimator():
     assert ak.to_list(result) == ak.to_list(expected)
 
 
+def test_m_r90_estimator_keeps_float32():
+    input = {"edep": "edep", "posx": "posx", "posy": "posy", "posz": "posz"}
+    output = {"r90": "r90"}
+    steps = ak.Array([[[1.0, 2.0], [3.0, 4.0]], [[5.0, 6.0], [7.0, 8.0]]])
+    pv = {key: ak.values_astype(steps, "float32") for key in input}
+
+    m_r90_estimator({}, input, output, pv)
+    expected = calculate_R90(steps, steps, steps, steps)
+
+    assert str(pv["r90"].type) == "2 * var * float32"
+    assert np.allclose(ak.to_list(pv["r90"]), ak.to_list(expected))
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+import pytest
+
+from postproc.modules import available_modules, get_module, register_module, registry
+from postproc.modules.sum import m_sum
+
+
+def empty_registry(monkeypatch):
+    # Modules registered until monkeypatch is undone are removed afterwards
+    monkeypatch.setattr(registry, "_registered_modules", {})
+    monkeypatch.setattr(registry, "_loaded_modules", {})
+
+
+@pytest.fixture
+def clean_registry(monkeypatch):
+    empty_registry(monkeypatch)
+
+
+def test_get_module():
+    assert get_module("sum") is m_sum
+
+    with pytest.raises(NotImplementedError, match=r"not_a_module not defined\."):
+        get_module("not_a_module")
+
+
+@pytest.mark.usefixtures("clean_registry")
+def test_register_module():
+    def m_custom(para, input, output, pv):  # noqa: ARG001
+        pv[output["val"]] = pv[input["val"]]
+
+    register_module("custom", m_custom)
+    assert get_module("custom") is m_custom
+    assert "custom" in available_modules()
+
+    register_module("custom_path", "postproc.modules.sum:m_sum")
+    assert get_module("custom_path") is m_sum
+
+
+def test_registered_modules_are_removed():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        empty_registry(monkeypatch)
+        register_module("custom", m_sum)
+        assert "custom" in available_modules()
+    assert "custom" not in available_modules()
+    assert get_module("sum") is m_sum
+
+
+def test_modules_are_imported_lazily():
+    code = (
+        "import sys; import postproc.modules as mod; "
+        "assert 'postproc.modules.detector_active_time' not in sys.modules; "
+        "assert 'postproc.modules.window' not in sys.modules; "
+        "mod.get_module('window'); "
+        "assert 'postproc.modules.window' in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import awkward as ak
+import numpy as np
+import pytest
+
+from postproc.modules.smear import counter_normal, file_key, m_smear
+
+resolution = {"1": [0.01], "2": [0.04], "default": [0.0, 0.01]}
+
+
+def test_counter_normal():
+    key = file_key(0, "sim_000.root")
+    entry = np.repeat(np.arange(20000), 5)
+    position = np.tile(np.arange(5), 20000)
+    values = counter_normal(key, entry, position)
+
+    assert abs(np.mean(values)) < 0.02
+    assert abs(np.std(values) - 1) < 0.02
+    # Each value only depends on its counter
+    assert np.array_equal(counter_normal(key, entry[-7:], position[-7:]), values[-7:])
+    assert not np.array_equal(
+        counter_normal(file_key(0, "sim_001.root"), entry, position), values
+    )
+
+
+def test_m_smear():
+    input = {"edep": "edep", "vol": "vol"}
+    output = {"edep": "edep_smeared"}
+    edep = ak.Array([[1.0, 2.0], [], [0.0, 3.0, None]])
+    vol = ak.Array([[1, 2], [], [2, 7, 1]])
+    pv = {"edep": edep, "vol": vol, "_entry": np.array([0, 1, 2]), "_file": "a.root"}
+    m_smear({"resolution": resolution}, input, output, pv)
+    result = pv["edep_smeared"]
+
+    assert ak.to_list(ak.num(result)) == [2, 0, 3]
+    assert result[2, 0] == 0.0
+    assert result[2, 2] is None
+    assert ak.all(abs(ak.fill_none(result - edep, 0)) < 1)
+
+    # The same entries give the same values in a batch starting at entry 2
+    pv = {"edep": edep[2:], "vol": vol[2:], "_entry": np.array([2]), "_file": "a.root"}
+    m_smear({"resolution": resolution}, input, output, pv)
+    assert ak.to_list(pv["edep_smeared"]) == ak.to_list(result[2:])
+
+    pv = {"edep": edep, "vol": ak.Array([[1, 2], [], [2, 7, 1]])}
+    with pytest.raises(ValueError, match="volumes \\[7\\]"):
+        m_smear({"resolution": {"1": [0.01], "2": [0.04]}}, input, output, pv)
+
+
+def test_m_smear_per_event():
+    pv = {"e": ak.Array([1.0, 0.0, 2.5]), "_entry": np.array([5, 6, 7])}
+    m_smear({"resolution": {"default": [0.01]}}, {"edep": "e"}, {"edep": "e_s"}, pv)
+    assert len(pv["e_s"]) == 3
+    assert pv["e_s"][1] == 0.0
+    assert pv["e_s"][0] != 1.0
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -7,6 +7,7 @@ from postproc.modules.window import (
     define_windows,
     generate_map,
     generate_windowed_hits,
+    group_by_window,
     m_window,
     subtract_smallest_time,
 )
@@ -62,6 +63,23 @@ def test_generate_windowed_hits():
     assert result == expected
 
 
+def test_group_by_window():
+    mapping = [[0, 1, 0], [], [0]]
+    arrays = {
+        "edep": ak.Array([[1.0, 2.0, 3.0], [], [4.0]]),
+        "vol": ak.Array([[1, 2, 3], [], [4]]),
+    }
+    result = group_by_window(mapping, arrays)
+    for key, array in arrays.items():
+        assert ak.to_list(result[key]) == generate_windowed_hits(
+            mapping, ak.to_list(array)
+        )
+
+    # Arrays with a different structure are grouped one by one
+    result = group_by_window([0, 0, 1], {"a": ak.Array([1, 2, 3])})
+    assert ak.to_list(result["a"]) == [[1, 2], [3]]
+
+
 def test_m_window():
     para = {"dT": 5}
     input = {
@@ -111,5 +129,41 @@ def test_m_window():
     assert ak.to_list(pv["w_posz"]) == ak.to_list(expected_posz)
 
 
+def test_m_window_keeps_narrow_dtypes():
+    para = {"dT": 5}
+    input = {"t_all": "t_all", "t": "t", "vol": "vol"}
+    output = {"w_t": "w_t", "t_sub": "t_sub", "vol": "w_vol"}
+    pv = {
+        "t_all": ak.values_astype(ak.Array([[0.0, 10.0], [20.0, 30.0]]), "float32"),
+        "t": ak.values_astype(ak.Array([[1.0, 12.0], [21.0, 35.0]]), "float32"),
+        "vol": ak.values_astype(ak.Array([[1, 2], [3, 4]]), "int32"),
+    }
+
+    m_window(para, input, output, pv)
+
+    assert str(pv["w_t"].type) == "2 * var * float32"
+    assert str(pv["t_sub"].type) == "2 * var * var * float32"
+    assert str(pv["w_vol"].type) == "2 * var * var * int32"
+    assert ak.to_list(pv["w_vol"]) == [[[1], [2]], [[3], [4]]]
+
+
+def test_m_window_events_without_times():
+    para = {"dT": 5}
+    input = {"t_all": "t_all", "t": "t", "edep": "edep"}
+    output = {"w_t": "w_t", "t_sub": "t_sub", "edep": "w_edep"}
+    pv = {
+        "t_all": ak.Array([[0.0, 10.0], [], [20.0]]),
+        "t": ak.Array([[1.0, 12.0], [], [21.0]]),
+        "edep": ak.Array([[1.0, 2.0], [], [3.0]]),
+    }
+
+    m_window(para, input, output, pv)
+
+    assert ak.to_list(pv["w_t"]) == [[1.0, 12.0], [], [1.0]]
+    assert ak.to_list(pv["t_sub"]) == [[[1.0], [12.0]], [], [[1.0]]]
+    assert ak.to_list(pv["w_edep"]) == [[[1.0], [2.0]], [], [[3.0]]]
+    assert str(pv["t_sub"].type) == "3 * var * var * float64"
+
+
 if __name__ == "__main__":
     pytest.main()
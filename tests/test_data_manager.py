@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import threading
+
+import awkward as ak
+import numpy as np
+import pytest
+import uproot
+from data_manager import data_manager, read_hdf5
+from module_manager import module_manager
+from tqdm import tqdm
+
+
+@pytest.fixture
+def infile(tmp_path):
+    rng = np.random.default_rng(1)
+    counts = rng.integers(0, 5, 100)
+    path = tmp_path.joinpath("sim.root")
+    with uproot.recreate(path) as f:
+        f["g4sntuple"] = {
+            "Edep": ak.unflatten(rng.exponential(1, counts.sum()), counts)
+        }
+    return path
+
+
+def make_inst(tmp_path, **para):
+    return {
+        "io": {"input": {"folder": str(tmp_path), "format": "root"}, "output": ""},
+        "input": {"tree": "g4sntuple", "var": {"edep": "Edep"}},
+        "para": {"step_size": 10, **para},
+        "instr": [
+            {
+                "name": "energy",
+                "module": "sum",
+                "input": {"val": "edep"},
+                "output": {"val": "etot"},
+            }
+        ],
+        "output": ["etot"],
+    }
+
+
+def run(inst, infile, outfile):
+    dm = data_manager(inst, infile, [outfile], [module_manager(inst)], 0)
+    dm.process_data()
+    dm.write_output()
+    return read_hdf5(outfile)[0]
+
+
+def interrupted_run(inst, infile, outfile, n_batches):
+    """
+    Commit the first batches of a file like a run interrupted after them.
+    """
+    dm = data_manager(inst, infile, [outfile], [module_manager(inst)], 0)
+    pbar = tqdm(disable=True)
+    entry_ranges = dm.resume()
+    for entry_range in entry_ranges[:n_batches]:
+        dm.add_batch(dm._process_range(entry_range, pbar), entry_range)
+    return entry_ranges
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    """
+    Records the first entry of every batch processed (not read back from a checkpoint).
+    """
+    starts = []
+    process_batch = data_manager.process_batch
+
+    def record(self, batch, pbar, entry_start=0):
+        starts.append(entry_start)
+        return process_batch(self, batch, pbar, entry_start)
+
+    monkeypatch.setattr(data_manager, "process_batch", record)
+    return starts
+
+
+def test_resume(tmp_path, infile, processed):
+    expected = run(make_inst(tmp_path), infile, tmp_path.joinpath("full.hdf5"))
+
+    inst = make_inst(tmp_path, checkpoint=True)
+    outfile = tmp_path.joinpath("out.hdf5")
+    entry_ranges = interrupted_run(inst, infile, outfile, 3)
+    assert outfile.with_name("out.hdf5.partial").exists()
+
+    processed.clear()
+    result = run(inst, infile, outfile)
+
+    assert processed == [start for start, _ in entry_ranges[3:]]
+    assert ak.to_list(result) == ak.to_list(expected)
+    assert not outfile.with_name("out.hdf5.partial").exists()
+
+
+def test_resume_smaller_step_size(tmp_path, infile, processed):
+    expected = run(make_inst(tmp_path), infile, tmp_path.joinpath("full.hdf5"))
+
+    # A task killed after three batches is retried with half the step size
+    outfile = tmp_path.joinpath("out.hdf5")
+    interrupted_run(make_inst(tmp_path, checkpoint=True), infile, outfile, 3)
+
+    processed.clear()
+    result = run(make_inst(tmp_path, checkpoint=True, step_size=5), infile, outfile)
+
+    assert processed == list(range(30, 100, 5))
+    assert ak.to_list(result) == ak.to_list(expected)
+
+
+def test_entry_ranges(tmp_path, infile):
+    dm = data_manager(make_inst(tmp_path, step_size=30), infile, [None], [], 0)
+    assert dm.entry_ranges() == [(0, 30), (30, 60), (60, 90), (90, 100)]
+
+    # A memory size is converted to a number of entries by uproot
+    dm = data_manager(make_inst(tmp_path, step_size="1 kB"), infile, [None], [], 0)
+    entry_ranges = dm.entry_ranges()
+    assert entry_ranges[0][0] == 0
+    assert entry_ranges[-1][1] == 100
+    assert all(a[1] == b[0] for a, b in zip(entry_ranges, entry_ranges[1:]))
+
+
+def test_batch_threads(tmp_path, infile, processed, monkeypatch):
+    expected = run(make_inst(tmp_path), infile, tmp_path.joinpath("serial.hdf5"))
+
+    # Every batch thread reads through its own file handle
+    threads = set()
+    thread_ttree = data_manager._thread_ttree
+
+    def record(self):
+        threads.add(threading.get_ident())
+        return thread_ttree(self)
+
+    monkeypatch.setattr(data_manager, "_thread_ttree", record)
+    processed.clear()
+    result = run(
+        make_inst(tmp_path, batch_threads=4), infile, tmp_path.joinpath("out.hdf5")
+    )
+
+    assert sorted(processed) == list(range(0, 100, 10))
+    assert 1 < len(threads) <= 4
+    # The batches are collected in entry order
+    assert ak.to_list(result) == ak.to_list(expected)
+
+
+if __name__ == "__main__":
+    pytest.main()
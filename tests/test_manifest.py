@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+from manifest import DONE, EMPTY, FAILED, RUNNING, run_manifest
+from misc import config_hash
+
+
+@pytest.fixture
+def infile(tmp_path):
+    path = tmp_path / "sim_000.root"
+    path.write_bytes(b"events")
+    return path
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = run_manifest(tmp_path / "out" / "manifest.sqlite", "config")
+    yield manifest
+    manifest.close()
+
+
+def test_config_hash():
+    inst = {"para": {"step_size": 1000}, "io": {"in": "a"}, "instr": [1]}
+    # Runtime parameters and io do not change the output
+    assert config_hash(inst) == config_hash(
+        {**inst, "para": {"step_size": 1000, "threads": 4}, "io": {"in": "b"}}
+    )
+    # The step size only changes the batches
+    assert config_hash(inst) == config_hash({**inst, "para": {"step_size": 10}})
+    assert config_hash(inst) != config_hash({**inst, "instr": [2]})
+
+
+def test_manifest(manifest, infile):
+    assert not manifest.completed(infile)
+
+    manifest.start([infile])
+    assert manifest.records()[str(infile)]["status"] == RUNNING
+    assert not manifest.completed(infile)
+
+    result = {"entries": 10, "bytes": 6, "duration": 1.5, "peak_memory": 100}
+    manifest.finish(infile, result)
+    assert manifest.completed(infile)
+    assert manifest.history() == {str(infile): result}
+
+    # Same database, other config
+    other = run_manifest(manifest.path, "other")
+    assert not other.completed(infile)
+    other.close()
+
+    # The input file changed
+    stat = infile.stat()
+    os.utime(infile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert not manifest.completed(infile)
+
+    manifest.start([infile])
+    manifest.fail(infile, ValueError("bad file"))
+    record = manifest.records()[str(infile)]
+    assert (record["status"], record["error"], record["attempts"]) == (
+        FAILED,
+        "bad file",
+        2,
+    )
+    assert manifest.failed(infile)
+    assert not manifest.completed(infile)
+    assert manifest.history() == {}
+
+
+def test_manifest_empty(manifest, infile):
+    manifest.start([infile])
+    manifest.finish(infile, None)
+    assert manifest.records()[str(infile)]["status"] == EMPTY
+    assert manifest.completed(infile)
+    # Files without tree are not part of the history
+    assert manifest.history() == {}
+    manifest.start([infile])
+    manifest.finish(infile, {"entries": 1})
+    assert manifest.records()[str(infile)]["status"] == DONE
+
+
+if __name__ == "__main__":
+    pytest.main()
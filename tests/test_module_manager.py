@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import threading
+import time
+from types import SimpleNamespace
+
+import awkward as ak
+import pytest
+from module import module
+from module_manager import dependencies, module_manager, run_pipelines
+from tqdm import tqdm
+
+energy = {
+    "name": "energy",
+    "module": "sum",
+    "input": {"val": "edep"},
+    "output": {"val": "etot"},
+}
+
+
+def threshold(thr):
+    return {
+        "name": f"threshold {thr}",
+        "module": "acceptance_range",
+        "para": {"thr": thr},
+        "input": {"val": "etot"},
+        "output": {"val": "mask"},
+    }
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    runs = []
+    run = module.run
+
+    def record(self, processing_variables):
+        runs.append(self.name)
+        run(self, processing_variables)
+
+    monkeypatch.setattr(module, "run", record)
+    return runs
+
+
+def stage(input, output, modifies_all=False):
+    return SimpleNamespace(input=input, output=output, modifies_all=modifies_all)
+
+
+def test_dependencies():
+    modules = [
+        stage({"val": "edep"}, {"val": "etot"}),
+        # Read after write
+        stage({"val": "etot"}, {"val": "mask"}),
+        # Independent of both
+        stage({"val": "edep"}, {"val": "emax"}),
+        # Write after read
+        stage({"val": "emax"}, {"val": "edep"}),
+        # Write after write
+        stage({"val": "t"}, {"val": "mask"}),
+    ]
+    assert dependencies(modules) == [set(), {0}, set(), {0, 2}, {1}]
+
+    # A module modifying all variables waits for all earlier ones and all later ones wait for it
+    modules.insert(3, stage({}, {}, modifies_all=True))
+    assert dependencies(modules) == [
+        set(),
+        {0},
+        set(),
+        {0, 1, 2},
+        {0, 2, 3},
+        {1, 3},
+    ]
+
+
+def test_run_concurrent(monkeypatch):
+    events = []
+    lock = threading.Lock()
+    run = module.run
+
+    def record(self, processing_variables):
+        with lock:
+            events.append(("start", self.name))
+        if self.name == "energy":
+            time.sleep(0.2)
+        run(self, processing_variables)
+        with lock:
+            events.append(("end", self.name))
+
+    monkeypatch.setattr(module, "run", record)
+    esum = {
+        "name": "esum",
+        "module": "sum",
+        "input": {"val": "edep"},
+        "output": {"val": "esum"},
+    }
+    manager = module_manager(
+        {"para": {"module_threads": 2}, "instr": [energy, threshold([1, 10]), esum]}
+    )
+    pv = {"edep": ak.Array([[0.5, 1.0], [], [0.2]])}
+    manager.run(pv, tqdm(disable=True), 0)
+
+    # The independent module runs while energy is running, the threshold waits for energy
+    assert events.index(("start", "esum")) < events.index(("end", "energy"))
+    assert events.index(("end", "energy")) < events.index(
+        ("start", "threshold [1, 10]")
+    )
+    assert ak.to_list(pv["mask"]) == [True, False, False]
+    assert ak.to_list(pv["esum"]) == pytest.approx([1.5, 0, 0.2])
+
+
+def test_run_pipelines(runs):
+    managers = [
+        module_manager({"para": {}, "instr": instr})
+        for instr in [
+            [energy, threshold([1, 10])],
+            [energy, threshold([0, 1])],
+            [energy],
+        ]
+    ]
+    pv = {"edep": ak.Array([[0.5, 1.0], [], [0.2]])}
+    results = run_pipelines(managers, pv, tqdm(disable=True), 0)
+
+    # The shared leading stage runs once, each pipeline gets its own outputs
+    assert sorted(runs) == ["energy", "threshold [0, 1]", "threshold [1, 10]"]
+    assert ak.to_list(results[0]["mask"]) == [True, False, False]
+    assert ak.to_list(results[1]["mask"]) == [False, True, True]
+    assert "mask" not in results[2]
+    # Arrays computed before the branch are shared
+    assert results[0]["etot"] is results[1]["etot"] is results[2]["etot"]
+
+    # A single pipeline runs on the given variables
+    runs.clear()
+    pv = {"edep": ak.Array([[2.0]])}
+    assert run_pipelines(managers[:1], pv, tqdm(disable=True), 0) == [pv]
+    assert runs == ["energy", "threshold [1, 10]"]
+    assert ak.to_list(pv["mask"]) == [True]
+
+
+def test_run_pipelines_different_parameters(runs):
+    # Stages only differing in their parameters are not shared
+    managers = [
+        module_manager({"para": {}, "instr": [threshold(thr)]})
+        for thr in [[1, 10], [0, 1]]
+    ]
+    results = run_pipelines(
+        managers, {"etot": ak.Array([0.5, 2.0])}, tqdm(disable=True), 0
+    )
+    assert runs == ["threshold [1, 10]", "threshold [0, 1]"]
+    assert ak.to_list(results[0]["mask"]) == [False, True]
+    assert ak.to_list(results[1]["mask"]) == [True, False]
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+path = Path(__file__).parents[1].joinpath("performance", "modules", "perf_scaling.py")
+spec = importlib.util.spec_from_file_location("perf_scaling", path)
+perf_scaling = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(perf_scaling)
+
+
+def test_sweep(tmp_path):
+    results = perf_scaling.sweep(
+        perf_scaling.default_inst(),
+        tmp_path,
+        "strong",
+        files=2,
+        entries=200,
+        threads=[1],
+        step_sizes=[100],
+        modes=["individual"],
+    )
+    assert len(results) == 1
+    result = results[0]
+    assert (result["files"], result["entries"], result["efficiency"]) == (2, 400, 1.0)
+    assert result["peak_process_memory"] > 0
+
+    table = perf_scaling.report(results).splitlines()
+    assert table[0].split()[:4] == ["scaling", "mode", "step_size", "threads"]
+    assert table[2].split()[:5] == ["strong", "individual", "100", "1", "2"]
+
+
+def test_check_inputs():
+    inst = perf_scaling.default_inst()
+    perf_scaling.check_inputs(inst)
+    inst["input"]["var"]["e"] = "Energy"
+    with pytest.raises(ValueError, match="Energy"):
+        perf_scaling.check_inputs(inst)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import awkward as ak
+import numpy as np
+import pytest
+from pipeline import pipeline
+
+inst = {
+    "para": {},
+    "dtype": {"edep": "float32"},
+    "input": {"var": {"edep": "Edep"}},
+    "instr": [
+        {
+            "name": "energy",
+            "module": "sum",
+            "input": {"val": "edep"},
+            "output": {"val": "etot"},
+        },
+        {
+            "name": "threshold",
+            "module": "acceptance_range",
+            "para": {"thr": [1, 10]},
+            "input": {"val": "etot"},
+            "output": {"val": "mask"},
+        },
+        {
+            "name": "selection",
+            "module": "mask",
+            "input": {"mask": "mask", "edep": "etot"},
+            "output": {"edep": "etot_sel"},
+        },
+    ],
+}
+
+
+def test_pipeline():
+    p = pipeline(inst)
+    edep = ak.Array([[0.5, 1.0], [], [0.2], [4.0, 5.0]])
+
+    pv = p({"edep": edep}, entry_start=10)
+    assert ak.to_list(pv["etot"]) == pytest.approx([1.5, 0, 0.2, 9.0])
+    assert ak.to_list(pv["mask"]) == [True, False, False, True]
+    assert np.array_equal(pv["_entry"], [10, 11, 12, 13])
+    assert np.array_equal(pv["_entry/etot_sel"], [10, 13])
+    assert str(ak.type(pv["edep"]).content) == "var * float32"
+
+    # Repeated calls do not share state
+    pv = p({"edep": edep[:1]})
+    assert ak.to_list(pv["etot"]) == pytest.approx([1.5])
+
+    # The top level para is passed to the modules without modifying the config
+    p = pipeline({**inst, "para": {"pack_outputs": False}})
+    assert ak.to_list(p({"edep": edep})["etot_sel"]) == pytest.approx([1.5, 9.0])
+    assert inst["instr"][1]["para"] == {"thr": [1, 10]}
+    assert p.module_manager.layout_report() == []
+
+
+def test_pipeline_packs_outputs():
+    # A mask selecting from a jagged array leaves a ListArray indexing the full content
+    instr = [
+        *inst["instr"][:2],
+        {
+            "name": "selection",
+            "module": "mask",
+            "input": {"mask": "mask", "edep": "edep"},
+            "output": {"edep": "edep_sel"},
+        },
+    ]
+    edep = ak.Array([[0.05, 0.1] * 50, [], [0.001] * 100, [0.02, 0.03] * 50])
+    p = pipeline({**inst, "instr": instr})
+    pv = p({"edep": edep})
+    assert ak.to_list(pv["edep_sel"]) == ak.to_list(pv["edep"][[0, 3]])
+    name, before, after = p.module_manager.layout_report()[-1]
+    assert name == "selection"
+    assert after < before
+
+
+def test_pipeline_entries():
+    # Outputs computed from selected events keep their entry numbers
+    instr = [
+        *inst["instr"][:2],
+        {
+            "name": "selection",
+            "module": "mask",
+            "input": {"mask": "mask", "edep": "edep"},
+            "output": {"edep": "edep_sel"},
+        },
+        {
+            "name": "energy",
+            "module": "sum",
+            "input": {"val": "edep_sel"},
+            "output": {"val": "etot_sel"},
+        },
+    ]
+    p = pipeline({**inst, "instr": instr})
+    pv = p({"edep": ak.Array([[0.5, 1.0], [], [0.2], [4.0, 5.0]])}, entry_start=10)
+    assert ak.to_list(pv["etot_sel"]) == pytest.approx([1.5, 9.0])
+    assert np.array_equal(pv["_entry/etot_sel"], [10, 13])
+
+
+def offsets_address(array):
+    return ak.to_layout(array).offsets.data.ctypes.data
+
+
+def test_pipeline_share_offsets():
+    variables = {
+        "edep": ak.Array([[0.5, 1.0], [], [0.2]]),
+        "t": ak.Array([[1.0, 2.0], [], [3.0]]),
+    }
+    inputs = ["edep", "t"]
+    pv = pipeline(inst, inputs)(variables)
+    assert offsets_address(pv["edep"]) != offsets_address(pv["t"])
+
+    pv = pipeline({**inst, "para": {"share_offsets": True}}, inputs)(variables)
+    assert offsets_address(pv["edep"]) == offsets_address(pv["t"])
+    assert ak.to_list(pv["t"]) == ak.to_list(variables["t"])
+
+
+def test_pipeline_unknown_variable():
+    with pytest.raises(ValueError, match="threshold"):
+        pipeline({**inst, "instr": inst["instr"][1:]})
+
+    with pytest.raises(ValueError, match="module"):
+        pipeline({"instr": [{"name": "energy", "input": {}, "output": {}}]})
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+from process import peak_memory, reset_peak_memory
+
+
+def test_peak_memory():
+    if not reset_peak_memory():
+        pytest.skip("the peak memory cannot be reset on this platform")
+    array = np.ones(2**24)
+    peak = peak_memory()
+    assert peak > array.nbytes
+    del array
+
+    # The peak of the previous file is not attributed to the next one
+    reset_peak_memory()
+    assert peak_memory() < peak - 2**26
+
+
+if __name__ == "__main__":
+    pytest.main()
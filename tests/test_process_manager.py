@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from process import task_error
+from process_manager import process_manager
+
+
+class fake_future:
+    def __init__(self, result=None, error=None):
+        self._result = result
+        self.error = error
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self._result
+
+
+class fake_executor:
+    def __init__(self, broken_after):
+        self.submitted = []
+        self.broken_after = broken_after
+
+    def submit(self, function, arg):  # noqa: ARG002
+        if len(self.submitted) == self.broken_after:
+            raise BrokenProcessPool
+        self.submitted.append(arg)
+        return fake_future()
+
+
+@pytest.fixture
+def pm():
+    pm = process_manager.__new__(process_manager)
+    pm.threads = 2
+    pm.memory_budget = 10
+    pm.task_memory = {0: 6, 1: 6, 2: 3}
+    pm.memory_scale = None
+    pm.oom_retries = 2
+    pm.suspects = set()
+    pm.results = []
+    pm.manifest = None
+    return pm
+
+
+def task(task_id, step_size=1000):
+    return ([f"{task_id}.root"], [[None]], {"para": {"step_size": step_size}}, task_id)
+
+
+def test_admit(pm):
+    waiting = deque((task(i), 0) for i in range(3))
+    admitted = pm._admit(waiting, {})
+    assert [arg[3] for arg, _ in admitted] == [0, 2]
+    assert [arg[3] for arg, _ in waiting] == [1]
+
+    # A task is always admitted if nothing runs, whatever its memory
+    pm.memory_budget = 1
+    assert len(pm._admit(deque([(task(0), 0)]), {})) == 1
+    assert pm._admit(deque([(task(1), 0)]), {"running": (task(2), 0)}) == []
+
+    # The estimates are scaled by the observed memory
+    pm.memory_budget = 10
+    pm.memory_scale = 2.0
+    assert len(pm._admit(deque([(task(0), 0)]), {"running": (task(2), 0)})) == 0
+
+
+def test_collect(pm):
+    waiting = deque()
+
+    assert not pm._collect(fake_future([{"peak_memory": 9}]), (task(0), 0), waiting)
+    assert pm.results == [{"peak_memory": 9}]
+    assert pm.memory_scale == 1.5
+
+    # A killed worker breaks the pool, the task is left to _recover
+    assert pm._collect(fake_future(error=BrokenProcessPool()), (task(1), 0), waiting)
+    assert not waiting
+
+    assert not pm._collect(
+        fake_future(error=MemoryError()), (task(2, "10 MB"), 1), waiting
+    )
+    arg, retries = waiting.popleft()
+    assert (arg[2]["para"]["step_size"], retries) == ("5000 kB", 2)
+
+    # Other errors are not retried
+    assert not pm._collect(fake_future(error=ValueError()), (task(1), 0), waiting)
+    assert not waiting
+
+
+class fake_manifest:
+    def __init__(self):
+        self.status = {}
+
+    def finish(self, infile, result):  # noqa: ARG002
+        self.status[infile] = "done"
+
+    def fail(self, infile, error):  # noqa: ARG002
+        self.status[infile] = "failed"
+
+
+def test_collect_partial(pm):
+    pm.manifest = fake_manifest()
+    waiting = deque()
+    arg = (["a", "b", "c", "d"], [[None]] * 4, {"para": {"step_size": 1000}}, 0)
+
+    # Only the failing file is failed, the files after it are queued again
+    error = task_error([{"entries": 1}], "b: bad file")
+    assert not pm._collect(fake_future(error=error), (arg, 1), waiting)
+    assert pm.manifest.status == {"a": "done", "b": "failed"}
+    assert pm.results == [{"entries": 1}]
+    rest, retries = waiting.popleft()
+    assert (rest[0], len(rest[1]), retries) == (["c", "d"], 2, 1)
+
+    # A file out of memory is retried with the rest of the task
+    error = task_error([{"entries": 2}], "d: out of memory", memory_error=True)
+    assert not pm._collect(fake_future(error=error), (rest, 1), waiting)
+    assert pm.manifest.status["c"] == "done"
+    rest, retries = waiting.popleft()
+    assert (rest[0], rest[2]["para"]["step_size"], retries) == (["d"], 500, 2)
+
+
+def test_recover(pm):
+    waiting = deque([(task(3), 0)])
+
+    # Any of the tasks running when the pool broke may have been killed: they are queued
+    # unchanged and run alone
+    pm._recover([(task(1), 1), (task(2), 0)], waiting)
+    assert [(arg[3], arg[2]["para"]["step_size"], r) for arg, r in waiting] == [
+        (1, 1000, 1),
+        (2, 1000, 0),
+        (3, 1000, 0),
+    ]
+    assert pm.suspects == {1, 2}
+    assert [arg[3] for arg, _ in pm._admit(waiting, {})] == [1]
+    assert pm._admit(waiting, {"running": (task(1), 1)}) == []
+
+    # Task 1 finishes, task 2 is killed running alone
+    assert not pm._collect(fake_future([None]), (task(1), 1), waiting)
+    assert [arg[3] for arg, _ in pm._admit(waiting, {})] == [2]
+    assert pm._admit(waiting, {"running": (task(2), 0)}) == []
+    pm._recover([(task(2), 0)], waiting)
+    arg, retries = waiting.popleft()
+    assert (arg[3], arg[2]["para"]["step_size"], retries) == (2, 500, 1)
+    assert pm.suspects == set()
+
+    # No retries left
+    pm._recover([(task(2), 2)], waiting)
+    assert [arg[3] for arg, _ in waiting] == [3]
+
+
+def test_submit(pm):
+    # The pool breaks after the first submission
+    executor = fake_executor(broken_after=1)
+    waiting = deque([(task(3), 0)])
+    running = {}
+    admitted = [(task(i), 0) for i in range(3)]
+
+    assert pm._submit(executor, admitted, running, waiting)
+    assert [item[0][3] for item in running.values()] == [0]
+    assert [arg[3] for arg, _ in waiting] == [1, 2, 3]
+
+
+@pytest.mark.parametrize(("n_files", "batch_threads"), [(1, 4), (3, 1), (2, 2)])
+def test_auto_batch_threads(tmp_path, n_files, batch_threads):
+    # The threads are spread over the batches of each file if there are fewer files
+    in_folder = tmp_path.joinpath("in")
+    in_folder.mkdir()
+    for i in range(n_files):
+        in_folder.joinpath(f"sim_{i}.root").touch()
+    inst = {
+        "io": {
+            "input": {"folder": str(in_folder), "format": "root"},
+            "output": str(tmp_path),
+        },
+        "input": {"tree": "g4sntuple", "var": {"edep": "Edep"}},
+        "para": {"threads": 4, "batch_threads": "auto", "schedule": "glob"},
+        "instr": [],
+        "output": [],
+    }
+    pm = process_manager(inst)
+    assert pm.batch_threads == batch_threads
+    assert all(arg[2]["para"]["batch_threads"] == batch_threads for arg in pm.args)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+import scheduler
+import uproot
+
+
+@pytest.fixture
+def infiles(tmp_path):
+    paths = []
+    for n in [10, 300, 100]:
+        path = tmp_path / f"sim_{n}.root"
+        with uproot.recreate(path) as f:
+            f["g4sntuple"] = {"Edep": np.zeros(n)}
+        paths.append(path)
+    return paths
+
+
+def make_inst(cost_model="entries"):
+    return {
+        "para": {"cost_model": cost_model, "step_size": 1000},
+        "io": {"input": {"format": "root"}},
+        "input": {"tree": "g4sntuple"},
+    }
+
+
+def test_estimate_costs(infiles):
+    costs = scheduler.estimate_costs(infiles, make_inst())
+    assert [c["entries"] for c in costs] == [10, 300, 100]
+    assert [c["cost"] for c in costs] == [10, 300, 100]
+    assert all(c["duration"] is None for c in costs)
+    assert scheduler.longest_first(costs) == [1, 2, 0]
+
+    # The durations are predicted from the recorded file or the median rate of the others
+    history = {
+        str(infiles[0]): {"entries": 10, "bytes": 1, "duration": 5.0},
+        "other.root": {"entries": 1000, "bytes": 1, "duration": 500.0},
+    }
+    costs = scheduler.estimate_costs(infiles, make_inst(), history)
+    assert [c["duration"] for c in costs] == pytest.approx([5.0, 150, 50])
+    assert scheduler.longest_first(costs) == [1, 2, 0]
+
+
+def test_estimate_costs_without_opening(infiles, monkeypatch):
+    def count_entries(infile, inst):  # noqa: ARG001
+        raise AssertionError
+
+    monkeypatch.setattr(scheduler, "count_entries", count_entries)
+    # The size cost model does not open the files
+    costs = scheduler.estimate_costs(infiles, make_inst("size"))
+    sizes = [path.stat().st_size for path in infiles]
+    assert [c["cost"] for c in costs] == sizes
+    assert [c["entries"] for c in costs] == [None] * 3
+    assert scheduler.longest_first(costs) == [1, 2, 0]
+
+    # Entry counts recorded for files of the same size are reused
+    history = {
+        str(path): {"entries": n, "bytes": size}
+        for path, n, size in zip(infiles, [10, 300, 100], sizes)
+    }
+    costs = scheduler.estimate_costs(infiles, make_inst(), history)
+    assert [c["entries"] for c in costs] == [10, 300, 100]
+    # The cost stays the file size with the size cost model
+    costs = scheduler.estimate_costs(infiles, make_inst("size"), history)
+    assert [c["cost"] for c in costs] == sizes
+
+    # A file that changed is counted again
+    history[str(infiles[0])]["bytes"] += 1
+    with pytest.raises(AssertionError):
+        scheduler.estimate_costs(infiles, make_inst(), history)
+
+
+def test_predict_makespan():
+    assert scheduler.predict_makespan([], 2) == 0
+    assert scheduler.predict_makespan([4, 3, 2, 1], 1) == 10
+    # Longest first balances the workers, short tasks first leave a long one at the end
+    assert scheduler.predict_makespan([4, 2, 1, 1], 2) == 4
+    assert scheduler.predict_makespan([1, 1, 2, 4], 2) == 5
+
+
+def test_coalesce():
+    costs = [{"entries": n, "bytes": 10 * n} for n in [50, 30, 30, 200, 10]]
+    assert scheduler.coalesce(costs, [3, 0, 1, 2, 4], {"entries": 100}) == [
+        [3],
+        [0, 1],
+        [2, 4],
+    ]
+    # Large files form a task on their own without closing the current group
+    assert scheduler.coalesce(costs, [0, 1, 2, 3, 4], {"bytes": "1 kB"}) == [
+        [0, 1],
+        [3],
+        [2, 4],
+    ]
+
+    # Files without an entry count are not packed together
+    costs = [{"entries": None, "bytes": 10**9} for _ in range(3)]
+    assert scheduler.coalesce(costs, [0, 1, 2], {"entries": 1000}) == [[0], [1], [2]]
+
+    with pytest.raises(ValueError, match="Cannot coalesce"):
+        scheduler.coalesce(costs, [0], {"files": 2})
+
+
+def test_reduce_step_size():
+    assert scheduler.reduce_step_size(1000) == 500
+    assert scheduler.reduce_step_size(1) == 1
+    assert scheduler.reduce_step_size("100 MB") == "50000 kB"
+    assert scheduler.parse_size(scheduler.reduce_step_size("1 kB")) == 1000
+
+
+def test_memory_budget():
+    assert scheduler.memory_budget({"memory_budget": "2 GB"}) == 2 * 1000**3
+    assert scheduler.memory_budget({"memory_budget": 1000}) == 1000
+    # Defaults to the physical memory of the node
+    budget = scheduler.memory_budget({})
+    assert budget is None or budget > 0
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import json
+
+import awkward as ak
+import numpy as np
+import pytest
+from shards import index_path, read_shards, select_shards, shard_writer
+
+
+def write(out, size):
+    parts = [
+        (
+            "a.root",
+            ak.Array(
+                {
+                    "etot": np.arange(7.0),
+                    "edep": [[float(i)] * (i % 3) for i in range(7)],
+                    "_entry": np.arange(10, 17),
+                }
+            ),
+        ),
+        (
+            "b.root",
+            ak.Array({"etot": np.arange(10.0, 15.0), "edep": [[1.0]] * 5}),
+        ),
+    ]
+    writer = shard_writer(out, size, ["etot"])
+    for file, array in parts:
+        writer.add(file, array)
+    writer.close()
+    return ak.concatenate([array[["etot", "edep"]] for _, array in parts])
+
+
+def test_shards(tmp_path):
+    out = tmp_path.joinpath("out.hdf5")
+    expected = write(out, 4)
+
+    with index_path(out).open() as f:
+        index = json.load(f)
+    assert index["length"] == 12
+    assert [shard["length"] for shard in index["shards"]] == [4, 4, 4]
+    assert index["shards"][1]["sources"] == [
+        {"file": "a.root", "length": 3, "entry_start": 14, "entry_stop": 17},
+        {"file": "b.root", "length": 1, "entry_start": None, "entry_stop": None},
+    ]
+    assert (index["shards"][1]["min"], index["shards"][1]["max"]) == (
+        {"etot": 4.0},
+        {"etot": 10.0},
+    )
+
+    assert ak.to_list(read_shards(out, threads=2)) == ak.to_list(expected)
+
+    # The first shard cannot contain events of the selection and is skipped
+    selection = {"etot": [10, 11]}
+    assert [shard["path"] for shard in select_shards(index, selection)] == [
+        "out.00001.hdf5",
+        "out.00002.hdf5",
+    ]
+    result = read_shards(index_path(out), selection)
+    assert ak.to_list(result.etot) == [10.0, 11.0]
+    assert read_shards(out, {"etot": [100, 200]}) is None
+
+    # Writing again replaces the shards of the previous run
+    write(out, 8)
+    assert sorted(path.name for path in tmp_path.glob("out.0*.hdf5")) == [
+        "out.00000.hdf5",
+        "out.00001.hdf5",
+    ]
+    assert ak.to_list(read_shards(out)) == ak.to_list(expected)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import queue
+
+import pytest
+from telemetry import progress_monitor, progress_reporter
+
+
+def test_progress_monitor(tmp_path):
+    progress_queue = queue.Queue()
+    metrics_file = tmp_path.joinpath("metrics.prom")
+    monitor = progress_monitor(
+        progress_queue,
+        3,
+        {"file": str(metrics_file)},
+        planned_entries={"a.root": 100, "b.root": 50, "c.root": None},
+    )
+    with monitor:
+        reporter = progress_reporter(progress_queue, 0, 120, 2.0, "a.root")
+        reporter.update(60)
+        reporter.set_description("energy")
+        # The task is killed and retried: its file starts again
+        reporter = progress_reporter(progress_queue, 0, 120, 2.0, "a.root")
+        reporter.update(120)
+        reporter.close()
+        reporter = progress_reporter(progress_queue, 1, 40, 1.0, "c.root")
+        reporter.update(10)
+
+    assert monitor.tasks_started == 2
+    assert monitor.tasks_done == 1
+    # 120 of a.root, 50 planned for b.root, 40 of c.root
+    assert monitor.entries_expected == 210
+    assert monitor.entries_progress == 130
+    assert monitor.entries_done == 190
+    assert monitor.bytes_read == 370
+
+    metrics = monitor.metrics()
+    assert metrics["postproc_entries_expected"] == 210
+    assert metrics["postproc_tasks_started"] == 2
+    text = metrics_file.read_text()
+    assert "# TYPE postproc_entries_processed_total counter\n" in text
+    assert "postproc_entries_processed_total 190\n" in text
+    assert "# TYPE postproc_eta_seconds gauge\n" in text
+    assert "postproc_tasks 3\n" in text
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from multiprocessing import shared_memory
+
+import awkward as ak
+import pytest
+from transfer import open_shared_output, release_shared_output, share_output
+
+
+def test_share_output():
+    array = ak.Array(
+        {
+            "etot": [1.0, 2.0, 3.0],
+            "edep": [[1.0], [], [0.5, 2.5]],
+            "vol": [[1], [], [2, 2]],
+        }
+    )
+    descriptor = share_output(array[[0, 2]], {"h": "histogram"})
+    assert descriptor["histograms"] == {"h": "histogram"}
+    # Every buffer starts at an aligned offset of the block
+    assert all(offset % 64 == 0 for offset, _, _ in descriptor["buffers"].values())
+
+    shm, shared = open_shared_output(descriptor)
+    assert ak.to_list(shared) == ak.to_list(array[[0, 2]])
+    assert str(shared.type) == str(array[[0, 2]].type)
+    del shared
+    release_shared_output(shm)
+
+    # The block is unlinked once released
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=descriptor["shm"])
+
+
+# The block object cannot be closed while the array is alive and reports it when collected
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnraisableExceptionWarning")
+def test_release_with_live_views():
+    descriptor = share_output(ak.Array({"etot": [1.0, 2.0]}), {})
+    shm, shared = open_shared_output(descriptor)
+    # The array still references the block: it is unlinked, the mapping is freed with the array
+    release_shared_output(shm)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=descriptor["shm"])
+    assert ak.to_list(shared.etot) == [1.0, 2.0]
+
+
+def test_share_output_without_array():
+    descriptor = share_output(None, {})
+    assert descriptor["shm"] is None
+    assert open_shared_output(descriptor) == (None, None)
+
+
+def test_share_empty_output():
+    array = ak.Array({"etot": [1.0]})[:0]
+    shm, shared = open_shared_output(share_output(array, {}))
+    assert len(shared) == 0
+    assert shared.fields == ["etot"]
+    del shared
+    release_shared_output(shm)
+
+
+if __name__ == "__main__":
+    pytest.main()
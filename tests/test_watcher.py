@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import pytest
+import watcher
+from watcher import folder_watcher
+
+
+def make_watcher(tmp_path, **watch):
+    (tmp_path / "in").mkdir()
+    inst = {
+        "para": {"threads": 1, "watch": watch},
+        "io": {
+            "input": {"folder": str(tmp_path / "in"), "format": "root"},
+            "output": str(tmp_path / "out"),
+        },
+        "instr": [],
+        "output": [],
+    }
+    return folder_watcher(inst)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(watcher.time, "time", lambda: clock[0])
+    return clock
+
+
+def test_poll_stable_time(tmp_path, clock):
+    w = make_watcher(tmp_path, stable_time=60)
+    infile = tmp_path / "in" / "sim_000.root"
+    infile.write_bytes(b"events")
+
+    # A new file is only complete once it did not change for stable_time
+    assert w.poll() == []
+    clock[0] += 30
+    assert w.poll() == []
+
+    # Writing to it restarts the wait
+    with infile.open("ab") as f:
+        f.write(b"more")
+    clock[0] += 40
+    assert w.poll() == []
+    clock[0] += 59
+    assert w.poll() == []
+    clock[0] += 1
+    assert w.poll() == [(infile, w.output_files(infile))]
+
+    # Each file is submitted once
+    clock[0] += 100
+    assert w.poll() == []
+
+
+def test_poll_sentinel(tmp_path, clock):
+    w = make_watcher(tmp_path, sentinel=".done")
+    infile = tmp_path / "in" / "sim_000.root"
+    infile.write_bytes(b"events")
+    clock[0] += 1000
+    assert w.poll() == []
+
+    # The sentinel completes the file without waiting, it is not matched as input itself
+    (tmp_path / "in" / "sim_000.root.done").touch()
+    assert w.poll() == [(infile, w.output_files(infile))]
+    assert w.poll() == []
+
+
+def test_poll_skips_existing_outputs(tmp_path, clock):
+    w = make_watcher(tmp_path, stable_time=0)
+    for name in ["sim_000", "sim_001"]:
+        (tmp_path / "in" / f"{name}.root").write_bytes(b"events")
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "sim_000.hdf5").touch()
+
+    assert w.poll() == []
+    clock[0] += 1
+    assert [infile.name for infile, _ in w.poll()] == ["sim_001.root"]
+
+    # Files removed while not yet complete are forgotten
+    infile = tmp_path / "in" / "sim_002.root"
+    infile.write_bytes(b"events")
+    assert w.poll() == []
+    infile.unlink()
+    assert w.poll() == []
+    assert infile not in w.candidates
+
+
+def test_watch_mode():
+    with pytest.raises(ValueError, match="individual mode"):
+        folder_watcher({"para": {"mode": "summarize"}})
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import awkward as ak
+import h5py
+import pytest
+from data_manager import data_manager, read_hdf5
+from module_manager import module_manager
+from writer import output_writer
+
+
+def test_output_writer(tmp_path):
+    path = tmp_path.joinpath("out.hdf5")
+    batches = [
+        ak.Array({"etot": [1.0, 2.0], "edep": [[1.0], [0.5, 1.5]]}),
+        ak.Array({"etot": [3.0], "edep": [[1.0, 1.0, 1.0]]}),
+        ak.Array({"etot": [0.0, 4.0], "edep": [[], [4.0]]}),
+    ]
+    writer = output_writer(path, narrow_offsets=True, max_pending=1)
+    for batch in batches:
+        writer.put(batch)
+    assert not path.exists()
+    writer.close({})
+
+    with h5py.File(path, "r") as f:
+        assert f["awkward"].attrs["parts"] == 3
+    array, histograms = read_hdf5(path)
+    assert ak.to_list(array) == ak.to_list(ak.concatenate(batches))
+    assert histograms == {}
+    assert not writer.tmp_path.exists()
+
+
+def test_output_writer_without_parts(tmp_path):
+    path = tmp_path.joinpath("out.hdf5")
+    output_writer(path).close({})
+    assert read_hdf5(path) == (None, {})
+
+
+def test_output_writer_abort(tmp_path):
+    path = tmp_path.joinpath("out.hdf5")
+    writer = output_writer(path, max_pending=1)
+    writer.put(ak.Array({"etot": [1.0]}))
+    writer.abort()
+    assert not writer._thread.is_alive()
+    assert not writer.tmp_path.exists()
+    assert not path.exists()
+
+
+def test_output_writer_missing_folder(tmp_path):
+    # The file is opened by the caller, so put cannot block on a writer that never started
+    with pytest.raises(OSError, match="create file"):
+        output_writer(tmp_path.joinpath("missing", "out.hdf5"))
+
+
+def test_output_writer_as_input(tmp_path):
+    path = tmp_path.joinpath("out.hdf5")
+    writer = output_writer(path)
+    writer.put(ak.Array({"edep": [[1.0], [0.5, 1.5]]}))
+    writer.put(ak.Array({"edep": [[2.0, 1.0]]}))
+    writer.close({})
+
+    inst = {
+        "io": {"input": {"format": "hdf5"}, "output": ""},
+        "input": {"base_name": "awkward", "var": {"edep": "edep"}},
+        "para": {"step_size": 10},
+        "instr": [
+            {
+                "name": "energy",
+                "module": "sum",
+                "input": {"val": "edep"},
+                "output": {"val": "etot"},
+            }
+        ],
+        "output": ["etot"],
+    }
+    outfile = tmp_path.joinpath("etot.hdf5")
+    dm = data_manager(inst, path, [outfile], [module_manager(inst)], 0)
+    dm.process_data()
+    dm.write_output()
+    assert ak.to_list(read_hdf5(outfile)[0].etot) == [1.0, 2.0, 3.0]
+
+
+if __name__ == "__main__":
+    pytest.main()